@@ -1,68 +1,49 @@
 #!/usr/bin/env python3
 
 import argparse
-import time
 import logging
 
-from tplight import LB130
+from tplight import LB130, BulbGroup, EffectRunner, Timeline
+from tplight.schedule import compile_wakeup, sync_rules
+from tplight.transitions import TransitionScheduler
 
 
-def long_transite(light, duration, brightness=None, color_temp=None, hue=None, saturation=None):
+def long_transite(lights, duration, brightness=None, color_temp=None, hue=None, saturation=None):
     """
     Perform transition between bulb states with duration that exceeds maximum
     valid `transition_period` set in `light` object.
-    Transition will be splitted to several steps and processed sequentially in
-    the synchronous mode.
+    Transition will be splitted to several steps planned once from the current
+    state of every bulb. Transitions of all bulbs run at the same time.
     Input values is normalized according to the limits -- refer to constants in
     the `light` object.
 
     Args:
-        light: LB130 object of light bulb.
+        lights: LB130 object of light bulb or a list of them.
         duration: Duration of states transition in milliseconds.
         brightness: Target brightness (usually from 0 to 100).
         color_temp: Target color temperature (usually from 2500 to 9000).
         hue: Target hue (usually from 0 to 360).
         saturation: Target color saturation (usually from 0 to 100).
     """
-    start_end_states = {}
-
-    if brightness is not None:
-        start_end_states['brightness'] = (light.brightness, min(light.max_brightness, brightness))
-
-    if color_temp is not None:
-        start_end_states['color_temp'] = (
-            light.temperature, min(light.max_color_temp, max(light.min_color_temp, color_temp))
+    if isinstance(lights, LB130):
+        lights = [lights]
+
+    scheduler = TransitionScheduler()
+    for light in lights:
+        scheduler.transite(
+            light,
+            duration,
+            brightness=brightness,
+            color_temp=color_temp,
+            hue=hue,
+            saturation=saturation,
         )
+    scheduler.run()
 
-    if hue is not None:
-        start_end_states['hue'] = (light.hue, min(light.max_hue, max(light.min_hue, hue)))
 
-    if saturation is not None:
-        start_end_states['saturation'] = (
-            light.saturation, min(light.max_saturation, max(light.min_saturation, saturation))
-        )
-
-    duration = int(duration)
-    steps = [light.max_transition_period] * (duration / light.max_transition_period)
-    if duration % light.max_transition_period:
-        steps.append(duration % light.max_transition_period)
-
-    for step, current_duration in enumerate(steps, 1):
-        states = {
-            parameter: current_value + (target_value - current_value) / len(steps) * step
-            for parameter, (current_value, target_value) in list(start_end_states.items())
-        }
-        states['transition_period'] = current_duration
-        states['synchronous'] = True
-        if not light.ison():
-            states['on_off'] = 1
-        logging.debug('Step %d/%d: %s', step, len(steps), light)
-        light.transite_light_state(**states)
-
-
-def scenario_1(light, minutes_before_wakeup, max_brightness, max_temperature):
+def scenario_1(lights, minutes_before_wakeup, max_brightness, max_temperature):
     """
-    Turn on bulb and raise the brightness gradually simulating the sunrise in
+    Turn on bulbs and raise the brightness gradually simulating the sunrise in
     a kind of accelerated mode.
 
     There are 3 steps during the `minutes_before_wakeup` time:
@@ -72,6 +53,7 @@ def scenario_1(light, minutes_before_wakeup, max_brightness, max_temperature):
     Then pulse 200 times with 100% brightness and more cold light.
 
     Args:
+        lights: LB130 object of light bulb or a list of them.
         minutes_before_wakeup: Number of minutes before cold light starts to
             pulse on maximum allowed brightness.
         max_brightness: Maximum brightness to raise to during
@@ -79,46 +61,42 @@ def scenario_1(light, minutes_before_wakeup, max_brightness, max_temperature):
         max_temperature: Maximum temperature to raise to during
             `minutes_before_wakeup` period.
     """
+    if isinstance(lights, LB130):
+        lights = [lights]
     duration = minutes_before_wakeup * 60 * 1000
 
     long_transite(
-        light,
+        lights,
         0.5 * duration,
-        color_temp=light.min_color_temp,
+        color_temp=LB130.min_color_temp,
         brightness=1,
     )
     long_transite(
-        light,
+        lights,
         0.35 * duration,
-        color_temp=(max_temperature + light.min_color_temp) / 2,
+        color_temp=(max_temperature + LB130.min_color_temp) / 2,
         brightness=max_brightness / 2,
     )
     long_transite(
-        light,
+        lights,
         0.15 * duration,
         color_temp=max_temperature,
         brightness=max_brightness,
     )
 
-    for _ in range(200):
-        light.transite_light_state(
-            transition_period=300,
-            color_temp=4200,
-            brightness=100,
-            synchronous=True,
-        )
-        light.transite_light_state(
-            transition_period=300,
-            color_temp=max_temperature,
-            brightness=max_brightness,
-            synchronous=True,
-        )
-        time.sleep(1)
+    # Pulse: 0.3s to cold light, 0.3s back, then 1s pause
+    rest = {'color_temp': max_temperature, 'brightness': max_brightness}
+    pulse = Timeline(
+        [(0, rest), (0.3, {'color_temp': 4200, 'brightness': 100}), (0.6, rest), (1.6, rest)],
+        loop=True,
+    )
+    with BulbGroup(lights) as group:
+        EffectRunner(group, fps=10).run(pulse, duration=200 * pulse.duration)
 
 
 def main():
     p = argparse.ArgumentParser()
-    p.add_argument('address', help='IP of bulb')
+    p.add_argument('address', nargs='+', help='IP of bulbs')
     p.add_argument('time', type=int, help='How much time is before wake up in minutes')
     p.add_argument('--debug', '-d', action='store_true', help='Enable debug output')
     p.add_argument(
@@ -133,15 +111,36 @@ def main():
         default=3600,
         help='Set the maximum temperature be reached at the end of scenario'
     )
+    p.add_argument(
+        '--at',
+        metavar='HH:MM',
+        help='Store the scenario on the bulbs as daily rules waking up at HH:MM instead'
+    )
     args = p.parse_args()
 
     if args.debug:
         logging.basicConfig(level=logging.DEBUG)
 
-    light = LB130(args.address)
-    logging.info('Device alias: %s', light.alias)
-
-    scenario_1(light, args.time, args.max_brightness, args.max_temperature)
+    if args.at:
+        try:
+            rules = compile_wakeup(args.at, args.time, args.max_brightness, args.max_temperature)
+        except ValueError as e:
+            p.error(str(e))
+        for bulb, result in sync_rules(args.address, rules, 'wakeup').items():
+            if isinstance(result, Exception):
+                logging.error('%s: %s', bulb, result)
+            else:
+                logging.info(
+                    '%s: %d rules added, %d deleted',
+                    bulb, len(result['added']), len(result['deleted'])
+                )
+        return
+
+    lights = [LB130(address) for address in args.address]
+    for light in lights:
+        logging.info('Device alias: %s', light.alias)
+
+    scenario_1(lights, args.time, args.max_brightness, args.max_temperature)
 
 
 if __name__ == '__main__':
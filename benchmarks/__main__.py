@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Run all benchmarks and store the results as JSON.
+
+Run from the repository root: `python -m benchmarks --output results.json`,
+then compare two runs with `python -m benchmarks --compare base.json results.json`.
+"""
+
+import argparse
+import json
+import sys
+
+from . import bench_cli, bench_codec, bench_fleet, bench_json, bench_latency, bench_loss, results
+from . import bench_sync
+
+
+def codec(quick):
+    sizes = [32, 512, 4096] if quick else [32, 128, 512, 1024, 4096, 16384]
+    return bench_codec.run(sizes, 50 if quick else 200)
+
+
+def json_overhead(quick):
+    return bench_json.run(200 if quick else 2000)
+
+
+def latency(quick):
+    return bench_latency.run(50 if quick else 500)
+
+
+def fleet(quick):
+    return bench_fleet.run([1, 10, 100] if quick else [1, 10, 100, 1000], 5 if quick else 20)
+
+
+def loss(quick):
+    return bench_loss.run([0.0, 0.05] if quick else [0.0, 0.01, 0.05, 0.2], 50 if quick else 300)
+
+
+def cli(quick):
+    return bench_cli.run(3 if quick else 20)
+
+
+def sync(quick):
+    return bench_sync.run([0.0, 0.05] if quick else [0.0, 0.05, 0.2], 5 if quick else 20)
+
+
+# Benchmarks by name, every one takes the `quick` flag
+SUITE = {
+    'codec': codec,
+    'json': json_overhead,
+    'latency': latency,
+    'fleet': fleet,
+    'loss': loss,
+    'cli': cli,
+    'sync': sync,
+}
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument(
+        'names', nargs='*', help='Benchmarks to run, all by default: ' + ', '.join(SUITE)
+    )
+    p.add_argument('--quick', '-q', action='store_true', help='Fewer and smaller runs')
+    p.add_argument('--output', '-o', help='JSON file to write the results to')
+    p.add_argument(
+        '--compare', nargs=2, metavar=('BASE', 'CURRENT'),
+        help='Print the changes between two result files instead of running'
+    )
+    p.add_argument(
+        '--threshold', type=float, default=0.1, help='Relative change to report on compare'
+    )
+    args = p.parse_args()
+    unknown = set(args.names) - set(SUITE)
+    if unknown:
+        p.error('Unknown benchmarks: ' + ', '.join(sorted(unknown)))
+
+    if args.compare:
+        base, current = (results.load(path) for path in args.compare)
+        for name, key, field, old, new in results.compare(base, current):
+            change = (new - old) / old if old else 0.0
+            if abs(change) >= args.threshold:
+                print(f'{name} {key[0]}={key[1]} {field}: {old:.4g} -> {new:.4g} ({change:+.0%})')
+        return
+
+    benchmarks = {}
+    for name in args.names or SUITE:
+        print(f'Running {name}...', file=sys.stderr)
+        benchmarks[name] = SUITE[name](args.quick)
+
+    if args.output:
+        results.save(args.output, benchmarks)
+    else:
+        print(json.dumps(benchmarks, indent=2))
+
+
+if __name__ == '__main__':
+    main()
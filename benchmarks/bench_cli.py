@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Start-up time and messages of `python -m tplight` commands against an
+emulated bulb, as started by home automation triggers: a process per command.
+
+The emulated bulb listens on the default port of a loopback address.
+Run from the repository root: `python -m benchmarks.bench_cli`.
+"""
+
+import argparse
+import subprocess
+import sys
+
+from tplight.emulator import Emulator
+
+from . import results
+
+# Command-line options of the measured commands
+COMMANDS = {
+    'on': ['--on'],
+    'brightness': ['--brightness', '40'],
+    'switch': ['--switch'],
+    'brightness_offset': ['--brightness-offset', '-10'],
+    'status': ['--status'],
+}
+
+
+def run(number, host='127.0.9.1'):
+    """Measure every command, and the bare interpreter for reference. Return rows of results."""
+    rows = []
+
+    def start(arguments):
+        subprocess.run([sys.executable] + arguments, check=True, stdout=subprocess.DEVNULL)
+
+    durations = results.latencies(lambda i: start(['-c', 'pass']), number)
+    rows.append(dict(command='python', messages=0, **results.summary(durations)))
+    with Emulator(host=host, port=9999) as emulator:
+        bulb = emulator.bulbs[0]
+        for name, options in COMMANDS.items():
+            sent = bulb.requests
+            start(['-m', 'tplight', host] + options)
+            messages = bulb.requests - sent
+            durations = results.latencies(
+                lambda i: start(['-m', 'tplight', host] + options), number
+            )
+            rows.append(dict(command=name, messages=messages, **results.summary(durations)))
+    return rows
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--number', '-n', type=int, default=20, help='Processes per command')
+    p.add_argument('--host', default='127.0.9.1', help='Loopback address of the emulated bulb')
+    args = p.parse_args()
+
+    print(f'{"command":>18} {"messages":>8} {"p50":>9} {"p99":>9}')
+    for row in run(args.number, args.host):
+        print(
+            f'{row["command"]:>18} {row["messages"]:>8} {row["p50_ms"]:7.2f}ms'
+            f' {row["p99_ms"]:7.2f}ms'
+        )
+
+
+if __name__ == '__main__':
+    main()
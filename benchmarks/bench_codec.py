@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of `tplight.codec` against the former str based routines of
+`LB130.__encrypt` and `LB130.__decrypt`.
+
+Run from the repository root: `python -m benchmarks.bench_codec`.
+"""
+
+import argparse
+import json
+import timeit
+
+from tplight import codec
+
+
+def legacy_encrypt(value, key):
+    """Encrypt the command string. Implementation before `tplight.codec`."""
+    valuelist = list(value)
+
+    for i in range(len(valuelist)):
+        var = ord(valuelist[i])
+        valuelist[i] = chr(var ^ int(key))
+        key = ord(valuelist[i])
+    return bytearray(''.join(valuelist).encode('latin_1'))
+
+
+def legacy_decrypt(value, key):
+    """Decrypt the command string. Implementation before `tplight.codec`."""
+    valuelist = list(value.decode('latin_1'))
+
+    for i in range(len(valuelist)):
+        var = ord(valuelist[i])
+        valuelist[i] = chr(var ^ key)
+        key = var
+
+    return ''.join(valuelist)
+
+
+def payload(size):
+    """Build a JSON message of roughly `size` bytes resembling a rule list."""
+    rule = {
+        'id': 'CF652E0D1D57B0BC12D978822F4456CA', 'name': 'name', 'enable': 1,
+        'wday': [1, 0, 1, 0, 1, 0, 0], 'stime_opt': 0, 'smin': 780, 'sact': 2,
+    }
+    rules = []
+    message = ''
+    while len(message) < size:
+        rules.append(rule)
+        message = json.dumps({'smartlife.iot.common.schedule': {'get_rules': {
+            'rule_list': rules, 'err_code': 0,
+        }}})
+    return message[:size]
+
+
+def measure(func, arg, number):
+    """Return the best time of one call in microseconds."""
+    return min(timeit.repeat(lambda: func(arg), number=number, repeat=5)) / number * 1e6
+
+
+def run(sizes, number):
+    """Measure both implementations for every payload size. Return rows of results."""
+    key = codec.DEFAULT_KEY
+    rows = []
+    for size in sizes:
+        text = payload(size)
+        plain = text.encode('latin_1')
+        encrypted = codec.encrypt(plain, key)
+        assert bytes(legacy_encrypt(text, key)) == encrypted
+        assert legacy_decrypt(encrypted, key) == text
+
+        row = {
+            'size': len(plain),
+            'legacy_encrypt_us': measure(lambda v: legacy_encrypt(v, key), text, number),
+            'encrypt_us': measure(lambda v: codec.encrypt(v, key), plain, number),
+            'legacy_decrypt_us': measure(lambda v: legacy_decrypt(v, key), encrypted, number),
+            'decrypt_us': measure(lambda v: codec.decrypt(v, key), encrypted, number),
+        }
+        # Bytes per microsecond is megabytes per second
+        row['encrypt_mb_s'] = len(plain) / row['encrypt_us']
+        row['decrypt_mb_s'] = len(plain) / row['decrypt_us']
+        rows.append(row)
+    return rows
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument(
+        '--sizes', type=int, nargs='+', default=[32, 128, 512, 1024, 4096, 16384],
+        help='Payload sizes in bytes'
+    )
+    p.add_argument('--number', '-n', type=int, default=200, help='Calls per measurement')
+    args = p.parse_args()
+
+    print(f'{"size":>7} {"encrypt":>20} {"decrypt":>20}')
+    for row in run(args.sizes, args.number):
+        print(
+            f'{row["size"]:>7}'
+            f' {row["legacy_encrypt_us"]:8.1f}/{row["encrypt_us"]:6.1f}us'
+            f' x{row["legacy_encrypt_us"] / row["encrypt_us"]:<4.0f}'
+            f' {row["legacy_decrypt_us"]:8.1f}/{row["decrypt_us"]:6.1f}us'
+            f' x{row["legacy_decrypt_us"] / row["decrypt_us"]:<4.0f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
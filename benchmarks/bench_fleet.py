@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Commands per second sent by `BulbGroup` to fleets of emulated bulbs.
+
+Run from the repository root: `python -m benchmarks.bench_fleet`.
+"""
+
+import argparse
+import time
+
+from tplight import BulbGroup
+from tplight.emulator import Emulator
+
+from . import results
+
+
+def run(sizes, rounds):
+    """Measure group transitions for every fleet size. Return rows of results."""
+    rows = []
+    with Emulator(count=max(sizes)) as emulator:
+        for size in sizes:
+            with BulbGroup(emulator.addresses[:size]) as group:
+                group.on()
+                failed = 0
+                durations = []
+                for i in range(rounds):
+                    start = time.perf_counter()
+                    outcome = group.transite_light_state(brightness=i % 100 + 1)
+                    durations.append(time.perf_counter() - start)
+                    failed += sum(1 for error in outcome.values() if error is not None)
+            elapsed = sum(durations)
+            rows.append(dict(
+                bulbs=size,
+                commands_per_s=size * rounds / elapsed,
+                failed=failed,
+                **results.summary(durations),
+            ))
+    return rows
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument(
+        '--sizes', type=int, nargs='+', default=[1, 10, 100, 1000], help='Numbers of bulbs'
+    )
+    p.add_argument('--rounds', '-n', type=int, default=20, help='Group commands per size')
+    args = p.parse_args()
+
+    print(f'{"bulbs":>6} {"commands/s":>11} {"p50":>9} {"p99":>9} {"failed":>6}')
+    for row in run(args.sizes, args.rounds):
+        print(
+            f'{row["bulbs"]:>6} {row["commands_per_s"]:11.0f} {row["p50_ms"]:7.2f}ms'
+            f' {row["p99_ms"]:7.2f}ms {row["failed"]:>6}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Share of `json` serialization in the request and reply handling of
+`LB130.__fetch_dict`, compared to the encryption alone, and the cost of
+requests taken from `protocol.payload_cache`.
+
+Run from the repository root: `python -m benchmarks.bench_json`.
+"""
+
+import argparse
+import json
+
+from tplight import LB130, codec, protocol
+from tplight.emulator import EmulatedBulb
+
+from .bench_codec import measure
+
+
+def messages():
+    """Get typical requests with the replies of an emulated bulb."""
+    bulb = EmulatedBulb()
+    for _ in range(40):
+        bulb.add_rule({'name': 'rule', 'enable': 1, 'wday': [1] * 7, 'smin': 600, 'sact': 1})
+    return {
+        'get_sysinfo': protocol.GET_SYSINFO,
+        'transition_light_state': protocol.transition_request(
+            LB130, 0, {'on_off': 1, 'hue': 120, 'saturation': 65, 'brightness': 10}
+        ),
+        'get_rules': {protocol.SCHEDULE: {'get_rules': {}}},
+    }, bulb
+
+
+def run(number):
+    """Measure encoding of the request and reading of the reply. Return rows of results."""
+    requests, bulb = messages()
+    key = codec.DEFAULT_KEY
+    rows = []
+    for name, request in requests.items():
+        reply = codec.encrypt(json.dumps(bulb.handle(request)).encode('latin_1'), key)
+        plain_request = json.dumps(request).encode('latin_1')
+        encode_us = measure(lambda r: protocol.encode(r, key, cache=False), request, number)
+        cached_us = measure(lambda r: protocol.encode(r, key), request, number)
+        encrypt_us = measure(lambda r: codec.encrypt(r, key), plain_request, number)
+        read_us = measure(lambda r: protocol.read_reply(r, request, key), reply, number)
+        decrypt_us = measure(lambda r: codec.decrypt(r, key), reply, number)
+        rows.append({
+            'request': name,
+            'request_bytes': len(plain_request),
+            'reply_bytes': len(reply),
+            'encode_us': encode_us,
+            'encode_json_share': 1 - encrypt_us / encode_us,
+            'encode_cached_us': cached_us,
+            'read_reply_us': read_us,
+            'read_reply_json_share': 1 - decrypt_us / read_us,
+        })
+    return rows
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--number', '-n', type=int, default=2000, help='Calls per measurement')
+    args = p.parse_args()
+
+    print(f'{"request":>22} {"bytes":>11} {"encode":>16} {"cached":>8} {"read_reply":>16}')
+    for row in run(args.number):
+        print(
+            f'{row["request"]:>22} {row["request_bytes"]:>5}/{row["reply_bytes"]:<5}'
+            f' {row["encode_us"]:6.1f}us json {row["encode_json_share"]:3.0%}'
+            f' {row["encode_cached_us"]:6.1f}us'
+            f' {row["read_reply_us"]:6.1f}us json {row["read_reply_json_share"]:3.0%}'
+        )
+
+
+if __name__ == '__main__':
+    main()
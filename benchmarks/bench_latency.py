@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Latency of `LB130` commands against one emulated bulb.
+
+Run from the repository root: `python -m benchmarks.bench_latency`.
+"""
+
+import argparse
+
+from tplight import LB130, UDPTransport
+from tplight.emulator import Emulator, NetworkConditions
+
+from . import results
+
+
+def run(number, latency=0.0):
+    """Measure construction, `status()` and `transite_light_state`. Return rows of results."""
+    rows = []
+    with Emulator(conditions=NetworkConditions(latency=latency)) as emulator:
+        ip, port = emulator.addresses[0]
+
+        def construct(i):
+            LB130(ip, transport=UDPTransport(ip, port)).close()
+
+        with LB130(ip, transport=UDPTransport(ip, port)) as light:
+            commands = {
+                'construct': construct,
+                'status': lambda i: light.status(),
+                'transite_light_state': lambda i: light.transite_light_state(
+                    brightness=i % 100 + 1
+                ),
+            }
+            for name, func in commands.items():
+                func(0)
+                rows.append(dict(command=name, **results.summary(results.latencies(func, number))))
+    return rows
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--number', '-n', type=int, default=500, help='Calls per command')
+    p.add_argument('--latency', type=float, default=0.0, help='Emulated reply delay in seconds')
+    args = p.parse_args()
+
+    print(f'{"command":>22} {"p50":>9} {"p99":>9} {"max":>9}')
+    for row in run(args.number, args.latency):
+        print(
+            f'{row["command"]:>22} {row["p50_ms"]:7.3f}ms {row["p99_ms"]:7.3f}ms'
+            f' {row["max_ms"]:7.3f}ms'
+        )
+
+
+if __name__ == '__main__':
+    main()
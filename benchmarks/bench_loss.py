@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Cost of the retries of `LB130` when replies of the emulated bulb are lost.
+
+Run from the repository root: `python -m benchmarks.bench_loss`.
+"""
+
+import argparse
+
+from tplight import AdaptiveRetryPolicy, LB130, UDPTransport
+from tplight.emulator import Emulator, NetworkConditions
+
+from . import results
+
+
+def run(losses, number, latency=0.001, seed=0):
+    """Measure transitions for every loss probability. Return rows of results."""
+    rows = []
+    for loss in losses:
+        conditions = NetworkConditions(latency=latency, loss=loss)
+        with Emulator(conditions=conditions, seed=seed) as emulator:
+            ip, port = emulator.addresses[0]
+            policy = AdaptiveRetryPolicy()
+            with LB130(ip, transport=UDPTransport(ip, port), retry_policy=policy) as light:
+                failed = 0
+
+                def transite(i):
+                    nonlocal failed
+                    try:
+                        light.transite_light_state(brightness=i % 100 + 1)
+                    except RuntimeError:
+                        failed += 1
+
+                bulb = emulator.bulbs[0]
+                sent = bulb.requests
+                durations = results.latencies(transite, number)
+                rows.append(dict(
+                    loss=loss,
+                    attempts_per_command=(bulb.requests - sent) / number,
+                    failed=failed,
+                    rto_ms=policy.rto * 1000,
+                    **results.summary(durations),
+                ))
+    return rows
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument(
+        '--losses', type=float, nargs='+', default=[0.0, 0.01, 0.05, 0.2],
+        help='Probabilities of a lost reply'
+    )
+    p.add_argument('--number', '-n', type=int, default=300, help='Commands per loss value')
+    p.add_argument('--latency', type=float, default=0.001, help='Emulated reply delay in seconds')
+    args = p.parse_args()
+
+    print(f'{"loss":>5} {"attempts":>8} {"mean":>9} {"p50":>9} {"p99":>9} {"failed":>6}')
+    for row in run(args.losses, args.number, args.latency):
+        print(
+            f'{row["loss"]:>5.0%} {row["attempts_per_command"]:8.3f} {row["mean_ms"]:7.2f}ms'
+            f' {row["p50_ms"]:7.2f}ms {row["p99_ms"]:7.2f}ms {row["failed"]:>6}'
+        )
+
+
+if __name__ == '__main__':
+    main()
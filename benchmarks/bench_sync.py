@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Start and end skew of a scene set on many emulated bulbs, by separate `LB130`
+objects one after another and by `BulbGroup.transite_synchronized`.
+
+Run from the repository root: `python -m benchmarks.bench_sync`.
+"""
+
+import argparse
+import time
+
+from tplight import BulbGroup, LB130, UDPTransport
+from tplight.emulator import Emulator, NetworkConditions
+
+from . import results
+
+
+def run(losses, rounds, size=20, latency=0.002, seed=0):
+    """Measure the skew for every loss probability. Return rows of results."""
+    rows = []
+    for loss in losses:
+        conditions = NetworkConditions(latency=latency, jitter=latency / 2, loss=loss)
+        with Emulator(count=size, conditions=conditions, seed=seed) as emulator:
+            lights = [
+                LB130(ip, transport=UDPTransport(ip, port), lazy=True)
+                for ip, port in emulator.addresses
+            ]
+            sequential = []
+            for i in range(rounds):
+                starts = []
+                for light in lights:
+                    starts.append(time.perf_counter())
+                    try:
+                        light.transite_light_state(brightness=i % 100 + 1, transition_period=1000)
+                    except RuntimeError:
+                        pass
+                sequential.append(starts[-1] - starts[0])
+            for light in lights:
+                light.close()
+
+            bursts = []
+            start_skews = []
+            end_skews = []
+            retried = 0
+            failed = 0
+            with BulbGroup(emulator.addresses) as group:
+                for i in range(rounds):
+                    report = group.transite_synchronized(
+                        at=time.monotonic() + 0.01, brightness=i % 100 + 1, transition_period=1000
+                    )
+                    bursts.append(report.burst)
+                    start_skews.append(report.start_skew)
+                    end_skews.append(report.end_skew)
+                    retried += len(report.retried)
+                    failed += sum(1 for error in report.results.values() if error is not None)
+            rows.append(dict(
+                loss=loss,
+                sequential_skew_ms=results.percentile(sequential, 0.5) * 1000,
+                burst_ms=results.percentile(bursts, 0.5) * 1000,
+                start_skew_ms=results.percentile(start_skews, 0.5) * 1000,
+                end_skew_ms=results.percentile(end_skews, 0.5) * 1000,
+                max_end_skew_ms=max(end_skews) * 1000,
+                retried=retried,
+                failed=failed,
+            ))
+    return rows
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument(
+        '--losses', type=float, nargs='+', default=[0.0, 0.05, 0.2],
+        help='Probabilities of a lost reply'
+    )
+    p.add_argument('--rounds', '-n', type=int, default=20, help='Scenes per loss value')
+    p.add_argument('--size', type=int, default=20, help='Number of bulbs')
+    args = p.parse_args()
+
+    print(
+        f'{"loss":>5} {"sequential":>10} {"burst":>9} {"start":>9} {"end":>9}'
+        f' {"max end":>9} {"retried":>7}'
+    )
+    for row in run(args.losses, args.rounds, args.size):
+        print(
+            f'{row["loss"]:>5.0%} {row["sequential_skew_ms"]:8.2f}ms {row["burst_ms"]:7.2f}ms'
+            f' {row["start_skew_ms"]:7.2f}ms {row["end_skew_ms"]:7.2f}ms'
+            f' {row["max_end_skew_ms"]:7.2f}ms {row["retried"]:>7}'
+        )
+
+
+if __name__ == '__main__':
+    main()
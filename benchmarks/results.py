@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Timing helpers and machine-readable results of the benchmarks."""
+
+import datetime
+import json
+import platform
+import subprocess
+import sys
+import time
+
+
+def percentile(values, fraction):
+    """Get the percentile of the values, e.g. `fraction=0.99`, by the nearest rank."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def latencies(func, number):
+    """Call the function `number` times with the call index. Return durations in seconds."""
+    durations = []
+    for i in range(number):
+        start = time.perf_counter()
+        func(i)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def summary(durations):
+    """Get p50, p99, mean and max of the durations in milliseconds."""
+    return {
+        'count': len(durations),
+        'p50_ms': percentile(durations, 0.5) * 1000,
+        'p99_ms': percentile(durations, 0.99) * 1000,
+        'mean_ms': sum(durations) / len(durations) * 1000,
+        'max_ms': max(durations) * 1000,
+    }
+
+
+def metadata():
+    """Describe the environment the results were measured in."""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+    }
+
+
+def save(path, benchmarks):
+    """Write the results of the benchmarks, a dict of name to rows, as JSON."""
+    with open(path, 'w') as f:
+        json.dump({'meta': metadata(), 'benchmarks': benchmarks}, f, indent=2)
+        f.write('\n')
+
+
+def load(path):
+    """Read results written by `save()`."""
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(base, current):
+    """
+    Compare numeric values of the rows with equal parameters.
+
+    Rows are matched by their first value, e.g. payload size or number of
+    bulbs. Values ending with `_ms` or `_us` are times, other numbers are
+    rates or counts.
+
+    Returns:
+        List of `(benchmark, key, name, base value, current value)`.
+    """
+    changes = []
+    for name, rows in current['benchmarks'].items():
+        base_rows = {
+            _row_key(row): row for row in base['benchmarks'].get(name, ())
+        }
+        for row in rows:
+            base_row = base_rows.get(_row_key(row))
+            if base_row is None:
+                continue
+            for field, value in row.items():
+                old = base_row.get(field)
+                if (
+                    isinstance(value, (int, float)) and isinstance(old, (int, float))
+                    and not isinstance(value, bool) and field != next(iter(row))
+                ):
+                    changes.append((name, _row_key(row), field, old, value))
+    return changes
+
+
+def _row_key(row):
+    return next(iter(row.items()))
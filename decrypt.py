@@ -3,33 +3,21 @@
 Test script for decrypting data from the TP-Link RBG wireless light.
 """
 
+from tplight import codec
+
 
 def encrypt(value, key):
     """
     Encrypt the command string.
     """
-    valuelist = list(value)
-
-    for i in range(len(valuelist)):
-        val = ord(valuelist[i])
-        valuelist[i] = chr(val ^ int(key))
-        key = ord(valuelist[i])
-
-    return "".join(valuelist)
+    return codec.encrypt(value.encode('latin_1'), key).decode('latin_1')
 
 
 def decrypt(value, key):
     """
     Decrypt the command string.
     """
-    valuelist = list(value)
-
-    for i in range(len(valuelist)):
-        val = valuelist[i]
-        valuelist[i] = chr(val ^ key)
-        key = val
-
-    return "".join(valuelist)
+    return codec.decrypt(bytes(value), key).decode('latin_1')
 
 
 def main():
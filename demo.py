@@ -6,7 +6,7 @@ Demo for the TP-Link A19-LB130 RBGW WiFi bulb
 
 
 import time
-from tplight import LB130
+from tplight import LB130, EffectRunner, Timeline
 
 
 def main():
@@ -25,27 +25,16 @@ def main():
     # set the transition period for any changes to 1 seconds
     light.transition_period = 0
 
-    # set the brightness to 50%
-    light.brightness = 50
+    # set the brightness to 50% and the saturation to 90% in one transition
+    with light.coalesce():
+        light.brightness = 50
+        light.saturation = 90
     time.sleep(2)
 
-    # set the saturation to 100%
-    light.saturation = 90
-    time.sleep(2)
-
-    # cycle through the colours
-    light.hue = 0
-    time.sleep(1)
-    light.hue = 60
-    time.sleep(1)
-    light.hue = 120
-    time.sleep(1)
-    light.hue = 180
-    time.sleep(1)
-    light.hue = 240
-    time.sleep(1)
-    light.hue = 300
-    time.sleep(1)
+    # cycle once through the colour wheel in 6 seconds, 5 frames per second
+    wheel = Timeline([(0, {'hue': 0}), (2, {'hue': 120}), (4, {'hue': 240}), (6, {'hue': 360})],
+                     loop=True)
+    EffectRunner(light, fps=5).run(wheel, duration=wheel.duration)
 
     # set the colour to warm white and the brightness to 0
     light.temperature = 3800
@@ -0,0 +1,28 @@
+"""Tests of `tplight` against emulated bulbs of `tplight.emulator`."""
+
+from tplight import AdaptiveRetryPolicy, LB130, UDPTransport
+
+
+def short_policy(deadline=0.5):
+    """Get a retry policy giving up on a silent bulb quickly."""
+    return AdaptiveRetryPolicy(initial_rto=0.1, deadline=deadline)
+
+
+def connect(emulator, index=0, transport=UDPTransport, **kwargs):
+    """Get `LB130` of the emulated bulb without any request sent."""
+    ip, port = emulator.addresses[index]
+    kwargs.setdefault('retry_policy', short_policy())
+    return LB130(ip, transport=transport(ip, port), lazy=True, **kwargs)
+
+
+def record_requests(bulb):
+    """Collect the request dicts answered by the emulated bulb. Return the list."""
+    requests = []
+    handle = bulb.handle
+
+    def recording(request):
+        requests.append(request)
+        return handle(request)
+
+    bulb.handle = recording
+    return requests
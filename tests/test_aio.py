@@ -0,0 +1,72 @@
+import asyncio
+import json
+import unittest
+from unittest import mock
+
+from tplight import AsyncLB130
+from tplight.aio import DatagramRouter
+from tplight.emulator import Emulator
+
+
+class AsyncLB130Test(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = Emulator().start()
+
+    def tearDown(self):
+        self.emulator.stop()
+
+    def test_concurrent_requests(self):
+        ip, port = self.emulator.addresses[0]
+
+        async def run():
+            light = AsyncLB130(ip)
+            light.port = port
+            return await asyncio.gather(light.status(), light.status())
+
+        for status in asyncio.run(run()):
+            self.assertIn('system', json.loads(status))
+
+    def test_router_created_again_after_failure(self):
+        ip, port = self.emulator.addresses[0]
+
+        async def run():
+            light = AsyncLB130(ip)
+            light.port = port
+            with mock.patch.object(DatagramRouter, 'create', side_effect=OSError('no socket')):
+                with self.assertRaises(OSError):
+                    await light.status()
+            return json.loads(await light.status())
+
+        self.assertIn('system', asyncio.run(run()))
+
+    def test_shared_router_closed_with_loop(self):
+        ip, port = self.emulator.addresses[0]
+        routers = []
+        create = DatagramRouter.create
+
+        async def recording_create(*args, **kwargs):
+            router = await create(*args, **kwargs)
+            routers.append(router)
+            return router
+
+        async def run():
+            light = AsyncLB130(ip)
+            light.port = port
+            await asyncio.gather(light.status(), light.status())
+
+        with mock.patch.object(DatagramRouter, 'create', recording_create):
+            asyncio.run(run())
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(run())
+                loop.run_until_complete(AsyncLB130.close_shared())
+            finally:
+                loop.close()
+        self.assertEqual(len(routers), 2)
+        for router in routers:
+            self.assertEqual(router.transport.get_extra_info('socket').fileno(), -1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+
+from tplight.cache import DeviceCache, read_json, write_json_atomic
+from tplight.energy import EnergyCache
+
+
+class JSONFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'cache', 'test.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        self.assertIsNone(read_json(self.path))
+        write_json_atomic(self.path, {'a': [1, 2]})
+        self.assertEqual(read_json(self.path), {'a': [1, 2]})
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ['test.json'])
+
+    def test_broken_files_read_empty(self):
+        os.makedirs(os.path.dirname(self.path))
+        for content in ('{"devices": ', '[]', '{"devices": []}'):
+            with open(self.path, 'w') as f:
+                f.write(content)
+            self.assertIsNone(DeviceCache(self.path).lookup(ip_address='10.0.0.1'))
+            self.assertIsNone(EnergyCache(self.path).lookup('ID', 'day', '2026-01'))
+
+    def test_caches_write_through_helper(self):
+        sysinfo = {'deviceId': 'ID', 'sw_ver': '1.0'}
+        DeviceCache(self.path).store('10.0.0.1', sysinfo, {'wattage': 10})
+        entry = DeviceCache(self.path).lookup(ip_address='10.0.0.1')
+        self.assertEqual(entry['light_details'], {'wattage': 10})
+
+        path = os.path.join(self.directory.name, 'energy.json')
+        EnergyCache(path).store([('ID', 'day', '2026-01', {1: 5, 2: 7})])
+        self.assertEqual(EnergyCache(path).lookup('ID', 'day', '2026-01'), {1: 5, 2: 7})
+
+
+if __name__ == '__main__':
+    unittest.main()
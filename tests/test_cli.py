@@ -0,0 +1,111 @@
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+import unittest
+from unittest import mock
+
+from tplight import FallbackTransport, __main__ as cli
+from tplight.emulator import Emulator
+
+# The command line talks to the default port, the bulbs get their own addresses
+NETWORK = '127.0.9.8/30'
+
+
+class CommandLineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = Emulator(2, host=NETWORK, port=9999).start()
+        self.bulb = self.emulator.bulbs[0]
+        self.host = self.emulator.addresses[0][0]
+
+    def tearDown(self):
+        self.emulator.stop()
+
+    def run_cli(self, *arguments):
+        """Run the command line. Return the number of messages it sent and the output."""
+        sent = sum(bulb.requests for bulb in self.emulator.bulbs)
+        output = io.StringIO()
+        with mock.patch('sys.argv', ['tplight'] + list(arguments)):
+            with contextlib.redirect_stdout(output):
+                cli.main()
+        return sum(bulb.requests for bulb in self.emulator.bulbs) - sent, output.getvalue()
+
+    def test_setter_sends_one_message(self):
+        self.assertEqual(self.run_cli(self.host, '--brightness', '40', '--hue', '0')[0], 1)
+        self.assertEqual(self.bulb.light['brightness'], 40)
+        self.assertEqual(self.bulb.light['hue'], 0)
+
+    def test_status_read_once(self):
+        self.assertEqual(self.run_cli(self.host, '--status')[0], 1)
+        on_off = self.bulb.on_off
+        self.assertEqual(self.run_cli(self.host, '--status', '--switch')[0], 2)
+        self.assertEqual(self.bulb.on_off, 1 - on_off)
+
+    def test_relative_changes_skip_cache(self):
+        with mock.patch('tplight.cache.DeviceCache') as cache:
+            sent, _ = self.run_cli(self.host, '--status', '--brightness-offset', '-5')
+        self.assertEqual(sent, 2)
+        cache.assert_not_called()
+
+    def test_many_bulbs(self):
+        sent, output = self.run_cli(NETWORK, '--brightness', '30', '--json')
+        self.assertEqual(sent, 2)
+        rows = [json.loads(line) for line in output.splitlines()]
+        self.assertEqual(
+            {row['address'] for row in rows}, {ip for ip, _ in self.emulator.addresses}
+        )
+        self.assertEqual({row['result'] for row in rows}, {'ok'})
+        self.assertTrue(all(bulb.light['brightness'] == 30 for bulb in self.emulator.bulbs))
+
+    def test_wait_ends_at_deadline(self):
+        start = time.monotonic()
+        self.run_cli(self.host, '-b', '10', '-p', '10000', '--wait', '--deadline', '0.3')
+        self.assertLess(time.monotonic() - start, 2.0)
+        self.assertEqual(self.bulb.light['brightness'], 10)
+
+    def test_discover_with_transport(self):
+        with mock.patch('tplight.discovery.iter_discover', return_value=[]) as discover:
+            self.run_cli(
+                self.host, '--discover', '5', '--transport', 'auto', '--deadline', '1', '--on'
+            )
+        (timeout,), kwargs = discover.call_args
+        self.assertLessEqual(timeout, 1)
+        self.assertIs(kwargs['transport_class'], FallbackTransport)
+
+    def test_resolve_inventory(self):
+        inventory = {
+            'desk': '10.0.0.5',
+            'office': ['desk', '10.0.0.6'],
+            'hall': '10.0.1.0/30',
+        }
+        self.assertEqual(cli.resolve(['office', 'hall', '10.0.0.6'], inventory), {
+            '10.0.0.5': 'desk',
+            '10.0.0.6': '10.0.0.6',
+            '10.0.1.1': 'hall',
+            '10.0.1.2': 'hall',
+        })
+        with self.assertRaises(ValueError):
+            cli.resolve(['loop'], {'loop': ['loop', 'x']})
+
+
+class StartUpTest(unittest.TestCase):
+
+    def test_optional_modules_not_imported(self):
+        modules = ('asyncio', 'concurrent.futures', 'numpy', 'pprint', 'tplight.cache')
+        code = (
+            'import sys, tplight.__main__; '
+            f'print(",".join(m for m in {modules!r} if m in sys.modules))'
+        )
+        output = subprocess.run(
+            [sys.executable, '-c', code], check=True, capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout
+        self.assertEqual(output.strip(), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import json
+import unittest
+
+from tplight import codec, protocol
+
+
+class CodecTest(unittest.TestCase):
+
+    def test_known_message(self):
+        self.assertEqual(codec.encrypt(b'{}'), bytes([0xAB ^ 0x7B, 0xAB ^ 0x7B ^ 0x7D]))
+        self.assertEqual(codec.decrypt(bytes([0xD0, 0xAD])), b'{}')
+
+    def test_round_trip_around_fast_path(self):
+        for size in (0, 1, codec.FAST_PATH_THRESHOLD - 1, codec.FAST_PATH_THRESHOLD, 5000):
+            data = bytes(i * 7 % 256 for i in range(size))
+            for key in (0, 0xAB, 0xFF):
+                self.assertEqual(codec.decrypt(codec.encrypt(data, key), key), data)
+
+    def test_many_matches_single(self):
+        messages = [b'', b'a', b'{"system":{"get_sysinfo":{}}}' * 3]
+        encrypted = codec.encrypt_many(messages)
+        self.assertEqual(encrypted, [codec.encrypt(m) for m in messages])
+        self.assertEqual(codec.decrypt_many(encrypted), messages)
+
+    def test_payload_cache_returns_same_bytes(self):
+        data = {protocol.LIGHTING: {'transition_light_state': {'brightness': 10}}}
+        cached = protocol.encode(data)
+        self.assertEqual(cached, protocol.encode(dict(data)))
+        self.assertEqual(cached, protocol.encode(data, cache=False))
+        self.assertEqual(json.loads(protocol.decode(cached)), data)
+
+    def test_check_reply_names_missing_method(self):
+        with self.assertRaisesRegex(protocol.BulbError, 'get_light_state'):
+            protocol.check_reply(protocol.GET_LIGHT_STATE, {protocol.LIGHTING: {'err_code': 0}})
+
+
+if __name__ == '__main__':
+    unittest.main()
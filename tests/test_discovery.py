@@ -0,0 +1,29 @@
+import unittest
+
+from tplight import TCPTransport, iter_discover, metrics
+from tplight.emulator import Emulator
+
+
+class DiscoveryTest(unittest.TestCase):
+
+    def test_bulbs_built_from_replies(self):
+        events = []
+        metrics.observe(events.append)
+        try:
+            with Emulator(2, host='127.0.9.12/30', port=9999, tcp=True) as emulator:
+                for bulb, (ip, _) in zip(emulator.bulbs, emulator.addresses):
+                    lights = list(iter_discover(0.3, address=ip, transport_class=TCPTransport))
+                    self.assertEqual([light.ip_address for light in lights], [ip])
+                    requests = bulb.requests
+                    with lights[0] as light:
+                        self.assertEqual(light.alias, bulb.sysinfo['alias'])
+                        self.assertEqual(bulb.requests, requests)
+                        light.transite_light_state(brightness=15)
+                    self.assertEqual(bulb.light['brightness'], 15)
+        finally:
+            metrics.unobserve(events.append)
+        self.assertEqual([event.transport for event in events], ['tcp', 'tcp'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+from tplight.emulator import Emulator
+from tplight.energy import EnergyCache, EnergyCollector
+
+
+class EnergyCollectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = Emulator(2).start()
+        fd, self.path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        os.unlink(self.path)
+        self.today = datetime.date.today()
+
+    def tearDown(self):
+        self.emulator.stop()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def collect(self, bulbs):
+        before = sum(bulb.requests for bulb in self.emulator.bulbs)
+        with EnergyCollector(bulbs, EnergyCache(self.path)) as collector:
+            table = collector.days(datetime.date(self.today.year - 1, 11, 1), today=self.today)
+        return table, sum(bulb.requests for bulb in self.emulator.bulbs) - before
+
+    def test_completed_months_fetched_once(self):
+        first, sent = self.collect(self.emulator.addresses)
+        self.assertGreater(sent, 2 * 2)
+        second, sent = self.collect(self.emulator.addresses)
+        self.assertEqual(sent, 2)
+        self.assertEqual(list(first), list(second))
+
+    def test_cache_follows_device(self):
+        first, _ = self.collect(self.emulator.addresses)
+        # The devices swap their addresses, as after a DHCP change
+        bulbs = self.emulator.bulbs
+        bulbs[0].sysinfo, bulbs[1].sysinfo = bulbs[1].sysinfo, bulbs[0].sysinfo
+        swapped, sent = self.collect(self.emulator.addresses)
+        self.assertEqual(sent, 2)
+        self.assertNotEqual(first.totals()[first.bulbs[0]], first.totals()[first.bulbs[1]])
+        self.assertEqual(swapped.totals()[first.bulbs[0]], first.totals()[first.bulbs[1]])
+        self.assertEqual(swapped.totals()[first.bulbs[1]], first.totals()[first.bulbs[0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import socket
+import time
+import unittest
+
+from tplight import BulbGroup, protocol
+from tplight.emulator import Emulator, NetworkConditions
+
+from . import record_requests, short_policy
+
+
+class BulbGroupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = Emulator(3).start()
+        # Bound but never answering
+        self.silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.silent.bind(('127.0.0.1', 0))
+        self.bulbs = self.emulator.addresses + [self.silent.getsockname()]
+        self.group = BulbGroup(self.bulbs, lambda: short_policy(0.3))
+
+    def tearDown(self):
+        self.group.close()
+        self.silent.close()
+        self.emulator.stop()
+
+    def test_partial_failure(self):
+        self.emulator.bulbs[1].errors[(protocol.LIGHTING, 'transition_light_state')] = -1
+        results = self.group.transite_light_state(brightness=30)
+        self.assertIsNone(results[self.bulbs[0]])
+        self.assertIsInstance(results[self.bulbs[1]], protocol.BulbError)
+        self.assertIsNone(results[self.bulbs[2]])
+        self.assertIsInstance(results[self.bulbs[3]], RuntimeError)
+        self.assertEqual(self.emulator.bulbs[0].light['brightness'], 30)
+
+    def test_fetch_each(self):
+        requests = {
+            self.bulbs[0]: protocol.GET_TIME,
+            self.bulbs[1]: protocol.GET_SYSINFO,
+        }
+        results = self.group.fetch_each(requests)
+        self.assertIn(protocol.TIMESETTING, results[self.bulbs[0]])
+        self.assertIn(protocol.SYSTEM, results[self.bulbs[1]])
+
+    def test_synchronized(self):
+        bulbs = self.bulbs[:3]
+        report = self.group.transite_synchronized(
+            {bulb: {} for bulb in bulbs}, at=time.monotonic() + 0.02,
+            brightness=55, transition_period=100,
+        )
+        self.assertEqual(report.results, dict.fromkeys(bulbs))
+        self.assertEqual(set(report.periods.values()), {100})
+        self.assertEqual(report.retried, [])
+        self.assertLess(report.end_skew, 0.1)
+        self.assertTrue(all(bulb.light['brightness'] == 55 for bulb in self.emulator.bulbs))
+
+    def test_synchronized_checks_periods_first(self):
+        requests = record_requests(self.emulator.bulbs[0])
+        for kwargs in (
+            {'transition_period': -500},
+            {'states': {self.bulbs[0]: {}, self.bulbs[1]: {'transition_period': 10 ** 6}}},
+        ):
+            with self.assertRaises(ValueError):
+                self.group.transite_synchronized(brightness=10, **kwargs)
+        self.assertEqual(requests, [])
+
+
+class SyncRetriesTest(unittest.TestCase):
+
+    def test_retried_bulbs_end_together(self):
+        conditions = NetworkConditions(loss=0.3)
+        with Emulator(10, conditions=conditions, seed=1) as emulator:
+            with BulbGroup(emulator.addresses, lambda: short_policy(2.0)) as group:
+                report = group.transite_synchronized(brightness=20, transition_period=3000)
+        self.assertTrue(report.retried)
+        for bulb in report.retried:
+            if bulb in report.periods:
+                self.assertLess(report.periods[bulb], 3000)
+        self.assertLess(report.end_skew, 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
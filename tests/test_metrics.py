@@ -0,0 +1,48 @@
+import unittest
+
+from tplight import metrics, protocol
+from tplight.emulator import Emulator
+from tplight.metrics import Histogram, MetricsCollector
+
+from . import connect
+
+
+class MetricsCollectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = Emulator().start()
+        self.light = connect(self.emulator)
+        self.collector = metrics.observe(MetricsCollector())
+
+    def tearDown(self):
+        metrics.unobserve(self.collector)
+        self.light.close()
+        self.emulator.stop()
+
+    def test_outcomes(self):
+        self.light.transite_light_state(brightness=20)
+        self.emulator.bulbs[0].errors[(protocol.LIGHTING, 'transition_light_state')] = -1
+        with self.assertRaises(RuntimeError):
+            self.light.transite_light_state(brightness=30)
+
+        ip, port = self.emulator.addresses[0]
+        bulb = f'{ip}:{port}'
+        self.assertEqual(self.collector.requests, {(bulb, 'ok'): 1, (bulb, 'error'): 1})
+        call = f'{protocol.LIGHTING}.transition_light_state'
+        self.assertEqual(self.collector.rtt_by_call[call].count, 2)
+        self.assertIn(
+            f'tplight_requests_total{{bulb="{bulb}",outcome="error"}} 1',
+            self.collector.prometheus(),
+        )
+
+    def test_histogram_quantile(self):
+        histogram = Histogram((0.01, 0.1, 1.0))
+        for value in (0.005, 0.05, 0.05, 5.0):
+            histogram.add(value)
+        self.assertEqual(histogram.quantile(0.5), 0.1)
+        self.assertEqual(histogram.quantile(1.0), float('inf'))
+        self.assertEqual(histogram.cumulative()[-1], (float('inf'), 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
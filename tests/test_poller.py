@@ -0,0 +1,71 @@
+import unittest
+
+from tplight import protocol
+from tplight.emulator import Emulator
+from tplight.poller import Poller
+
+
+class PollerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = Emulator(2).start()
+        self.bulbs = self.emulator.addresses
+        self.poller = Poller(self.bulbs, timeout=0.5)
+
+    def tearDown(self):
+        self.poller.close()
+        self.emulator.stop()
+
+    def test_reports_changes(self):
+        self.poller.poll()
+        self.emulator.bulbs[0].light['brightness'] = 77
+        self.poller.refresh(self.bulbs[0])
+        changes = self.poller.poll()
+        self.assertEqual(
+            [(c.bulb, c.field, c.new) for c in changes], [(self.bulbs[0], 'brightness', 77)]
+        )
+
+    def test_malformed_reply_backs_off(self):
+        self.emulator.bulbs[0].handle = lambda request: {
+            protocol.LIGHTING: {'get_light_state': {'err_code': 0, 'on_off': 1}}
+        }
+        changes = self.poller.poll()
+        schedule = self.poller.schedules[self.bulbs[0]]
+        self.assertEqual(schedule.failures, 1)
+        self.assertIs(schedule.available, False)
+        self.assertGreater(schedule.interval, self.poller.min_interval)
+        self.assertIn((self.bulbs[1], 'available', True), [
+            (c.bulb, c.field, c.new) for c in changes
+        ])
+
+    def test_backoff_after_many_failures(self):
+        self.emulator.bulbs[0].handle = lambda request: {
+            protocol.LIGHTING: {'get_light_state': {'err_code': 0}}
+        }
+        schedule = self.poller.schedules[self.bulbs[0]]
+        schedule.failures = 5000
+        self.poller.poll()
+        self.assertEqual(schedule.interval, self.poller.max_backoff)
+
+    def test_device_error_keeps_light_state(self):
+        self.emulator.bulbs[0].errors[(protocol.LIGHTING, 'get_light_state')] = (
+            protocol.INVALID_ARGUMENT
+        )
+        self.poller.poll()
+        schedule = self.poller.schedules[self.bulbs[0]]
+        self.assertFalse(schedule.sysinfo)
+        self.assertEqual(schedule.failures, 1)
+        self.assertIs(schedule.available, False)
+
+    def test_falls_back_to_sysinfo(self):
+        self.emulator.bulbs[0].errors[(protocol.LIGHTING, 'get_light_state')] = (
+            protocol.METHOD_NOT_SUPPORTED
+        )
+        self.poller.poll()
+        self.poller.poll()
+        self.assertTrue(self.poller.schedules[self.bulbs[0]].sysinfo)
+        self.assertIsNotNone(self.poller.state(self.bulbs[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
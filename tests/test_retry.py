@@ -0,0 +1,53 @@
+import time
+import unittest
+
+from tplight import AdaptiveRetryPolicy, BulbUnavailableError, RetryPolicy
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def test_fixed_timeouts(self):
+        call = RetryPolicy(timeout=0.5, max_retry=3).begin()
+        self.assertEqual(list(call), [0.5, 1.0, 1.5])
+
+    def test_rto_follows_rtt(self):
+        policy = AdaptiveRetryPolicy(min_rto=0.01)
+        for _ in range(20):
+            policy.record_success(0.02)
+        self.assertAlmostEqual(policy.srtt, 0.02)
+        self.assertLess(policy.rto, 0.1)
+
+    def test_deadline_ends_attempts(self):
+        call = AdaptiveRetryPolicy(initial_rto=0.05, deadline=0.1, jitter=0).begin()
+        total = 0.0
+        for timeout in call:
+            time.sleep(timeout)
+            total += timeout
+        self.assertLessEqual(total, 0.15)
+
+    def test_circuit_breaker(self):
+        policy = AdaptiveRetryPolicy(failure_threshold=2, reset_timeout=0.05)
+        for _ in range(2):
+            policy.begin().failed()
+        self.assertEqual(policy.state, 'open')
+        with self.assertRaises(BulbUnavailableError):
+            policy.begin()
+
+        time.sleep(0.06)
+        self.assertEqual(policy.state, 'half-open')
+        probe = policy.begin()
+        self.assertIsNotNone(probe.next_timeout())
+        self.assertIsNone(probe.next_timeout())
+        probe.succeeded()
+        self.assertEqual(policy.state, 'closed')
+
+    def test_failed_probe_opens_again(self):
+        policy = AdaptiveRetryPolicy(failure_threshold=1, reset_timeout=0.05)
+        policy.begin().failed()
+        time.sleep(0.06)
+        policy.begin().failed()
+        self.assertEqual(policy.state, 'open')
+
+
+if __name__ == '__main__':
+    unittest.main()
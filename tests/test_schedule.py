@@ -0,0 +1,58 @@
+import unittest
+
+from tplight.emulator import Emulator
+from tplight.schedule import compile_plan, compile_wakeup, parse_minute, sync_rules
+
+
+class CompileTest(unittest.TestCase):
+
+    def test_parse_minute(self):
+        self.assertEqual(parse_minute('07:30'), 450)
+        self.assertEqual(parse_minute(5), 5)
+        with self.assertRaises(ValueError):
+            parse_minute('24:00')
+
+    def test_plan_past_midnight(self):
+        keyframes = [(0, {'brightness': 10}), (60, {'brightness': 100})]
+        rules = compile_plan(keyframes, '23:30', 'night', wday=(0, 0, 0, 0, 0, 1, 0), max_rules=3)
+        self.assertEqual([rule['smin'] for rule in rules], [1410, 0, 30])
+        self.assertEqual([rule['s_light']['brightness'] for rule in rules], [10, 55, 100])
+        self.assertEqual(rules[0]['wday'], [0, 0, 0, 0, 0, 1, 0])
+        # Rules after midnight run on the next day
+        self.assertEqual(rules[1]['wday'], [0, 0, 0, 0, 0, 0, 1])
+        self.assertEqual([rule['name'] for rule in rules], ['night 00', 'night 01', 'night 02'])
+
+    def test_wakeup_keeps_to_max_rules(self):
+        rules = compile_wakeup('07:30', 45, max_rules=8)
+        self.assertLessEqual(len(rules), 8)
+        self.assertEqual(rules[-1]['smin'], 450)
+        self.assertEqual(rules[-1]['s_light']['brightness'], 60)
+
+
+class SyncRulesTest(unittest.TestCase):
+
+    def test_idempotent(self):
+        rules = compile_wakeup('07:30', 20)
+        with Emulator(3) as emulator:
+            emulator.bulbs[0].rules.append({'id': 'OTHER', 'name': 'other', 'smin': 5})
+            emulator.bulbs[1].schedule_enabled = 0
+            first = sync_rules(emulator.addresses, rules, 'wakeup')
+            counts = [bulb.requests for bulb in emulator.bulbs]
+            second = sync_rules(emulator.addresses, rules, 'wakeup')
+
+            for result in first.values():
+                self.assertEqual(len(result['added']), len(rules))
+            for result in second.values():
+                self.assertEqual(result, {'added': [], 'deleted': []})
+            # The second sync only reads the rules
+            self.assertEqual([bulb.requests for bulb in emulator.bulbs], [c + 1 for c in counts])
+            self.assertEqual(emulator.bulbs[0].rules[0]['id'], 'OTHER')
+            self.assertEqual(emulator.bulbs[1].schedule_enabled, 1)
+
+            third = sync_rules(emulator.addresses, compile_wakeup('08:00', 20), 'wakeup')
+            for result in third.values():
+                self.assertEqual(len(result['deleted']), len(rules))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import asyncio
+import json
+import unittest
+
+from tplight import protocol
+from tplight.emulator import Emulator
+from tplight.server import Gateway, GatewayServer
+
+from . import record_requests
+
+
+class GatewayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = Emulator().start()
+        self.ip, self.port = self.emulator.addresses[0]
+        self.bulb = f'{self.ip}:{self.port}'
+
+    def tearDown(self):
+        self.emulator.stop()
+
+    def request(self, *requests):
+        async def send():
+            server = GatewayServer(Gateway())
+            responses = await asyncio.gather(
+                *(server.handle(method, path, {}, body) for method, path, body in requests)
+            )
+            return server.gateway, [(status, json.loads(data)) for status, _, data in responses]
+        return asyncio.run(send())
+
+    def test_spellings_share_bulb(self):
+        gateway, responses = self.request(
+            ('GET', f'/bulbs/{self.bulb}/status', b''),
+            ('GET', f'/bulbs/{self.ip}:{self.port:06d}/status', b''),
+        )
+        self.assertEqual([status for status, _ in responses], [200, 200])
+        self.assertEqual(gateway.bulbs, [self.bulb])
+        self.assertEqual(gateway.shared_reads, 1)
+        self.assertEqual(self.emulator.bulbs[0].requests, 1)
+
+    def test_transition(self):
+        _, [(status, state)] = self.request(
+            ('POST', f'/bulbs/{self.bulb}/transition', b'{"brightness": 35}'),
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(state['brightness'], 35)
+        self.assertEqual(self.emulator.bulbs[0].light['brightness'], 35)
+
+    def test_bulb_error_is_bad_gateway(self):
+        self.emulator.bulbs[0].errors[(protocol.LIGHTING, 'get_light_details')] = -1
+        _, [(status, _)] = self.request(('GET', f'/bulbs/{self.bulb}/details', b''))
+        self.assertEqual(status, 502)
+
+    def test_transition_period_not_kept(self):
+        requests = record_requests(self.emulator.bulbs[0])
+        path = f'/bulbs/{self.bulb}/transition'
+
+        async def send():
+            server = GatewayServer(Gateway())
+            for body in (b'{"brightness": 35, "transition_period": 5000}', b'{"brightness": 45}'):
+                status, _, _ = await server.handle('POST', path, {}, body)
+                self.assertEqual(status, 200)
+
+        asyncio.run(send())
+        periods = [
+            request[protocol.LIGHTING]['transition_light_state']['transition_period']
+            for request in requests
+        ]
+        self.assertEqual(periods, [5000, 0])
+
+    def test_invalid_content_length(self):
+        async def send():
+            server = GatewayServer(Gateway())
+            await server.start(http='127.0.0.1:0')
+            try:
+                host, port = server.addresses[0][:2]
+                reader, writer = await asyncio.open_connection(host, port)
+                writer.write(
+                    f'POST /bulbs/{self.bulb}/transition HTTP/1.1\r\n'
+                    'Content-Length: x\r\n\r\n'.encode()
+                )
+                response = await reader.read()
+                writer.close()
+                return response
+            finally:
+                await server.close()
+
+        self.assertTrue(asyncio.run(send()).startswith(b'HTTP/1.1 400 '))
+
+    def test_invalid_address(self):
+        _, [(status, _)] = self.request(('GET', '/bulbs/10.0.0/state', b''))
+        self.assertEqual(status, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
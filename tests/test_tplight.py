@@ -0,0 +1,72 @@
+import unittest
+
+from tplight import BulbGroup, EffectRunner, Timeline, protocol
+from tplight.emulator import Emulator
+
+from . import connect, record_requests
+
+
+class LB130Test(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = Emulator().start()
+        self.bulb = self.emulator.bulbs[0]
+        self.light = connect(self.emulator)
+
+    def tearDown(self):
+        self.light.close()
+        self.emulator.stop()
+
+    def test_transition(self):
+        self.light.transite_light_state(brightness=40, hue=120, saturation=50)
+        self.assertEqual(self.bulb.light['brightness'], 40)
+        self.assertEqual(self.light.light_state(max_age=float('inf'))['hue'], 120)
+
+    def test_batch_isolates_errors(self):
+        self.bulb.errors[(protocol.SYSTEM, 'get_sysinfo')] = -1
+        requests = record_requests(self.bulb)
+        with self.light.batch() as batch:
+            sysinfo = batch.sysinfo()
+            date = batch.time()
+        self.assertEqual(len(requests), 1)
+        self.assertIsInstance(sysinfo.exception(), protocol.BulbError)
+        self.assertIsNotNone(date.result())
+
+    def test_coalesce_drops_unchanged_values(self):
+        state = self.light.refresh()
+        requests = record_requests(self.bulb)
+        with self.light.coalesce():
+            self.light.brightness = state['brightness']
+            self.light.hue = (state['hue'] + 90) % 360
+            self.light.hue = (state['hue'] + 180) % 360
+        self.assertEqual(len(requests), 1)
+        sent = requests[0][protocol.LIGHTING]['transition_light_state']
+        self.assertNotIn('brightness', sent)
+        self.assertEqual(sent['hue'], (state['hue'] + 180) % 360)
+
+    def test_coalesce_sends_nothing_without_changes(self):
+        state = self.light.refresh()
+        requests = record_requests(self.bulb)
+        with self.light.coalesce():
+            self.light.brightness = state['brightness']
+        self.assertEqual(requests, [])
+
+    def test_schedule_rules(self):
+        rule_id = self.light.add_rule({'name': 'test', 'smin': 60, 'sact': 2, 'enable': 1})
+        self.assertEqual([rule['id'] for rule in self.light.rules()], [rule_id])
+        self.light.delete_rule(rule_id)
+        self.assertEqual(self.light.rules(), [])
+
+    def test_effect_keeps_transition_period(self):
+        self.light.transition_period = 1500
+        timeline = Timeline([(0, {'brightness': 1}), (0.2, {'brightness': 90})])
+        EffectRunner(self.light, fps=20).run(timeline)
+        self.assertEqual(self.light.transition_period, 1500)
+        with BulbGroup(self.emulator.addresses) as group:
+            group.transition_period = 700
+            EffectRunner(group, fps=20).run(timeline)
+            self.assertEqual(group.transition_period, 700)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import json
+import socket
+import struct
+import unittest
+
+from tplight import TCPTransport, codec, protocol
+from tplight.emulator import Emulator
+
+from . import connect
+
+
+class TCPTransportTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.emulator = Emulator(tcp=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.emulator.stop()
+
+    def test_length_prefix(self):
+        message = codec.encrypt(json.dumps(protocol.GET_SYSINFO).encode())
+        with socket.create_connection(self.emulator.addresses[0], timeout=2) as sock:
+            sock.sendall(struct.pack('>I', len(message)) + message)
+            (size,) = struct.unpack('>I', sock.recv(4, socket.MSG_WAITALL))
+            reply = sock.recv(size, socket.MSG_WAITALL)
+        self.assertEqual(len(reply), size)
+        response = json.loads(codec.decrypt(reply))
+        self.assertEqual(response[protocol.SYSTEM]['get_sysinfo']['err_code'], 0)
+
+    def test_transport_frames_messages(self):
+        ip, port = self.emulator.addresses[0]
+        with TCPTransport(ip, port) as transport:
+            for _ in range(2):
+                transport.send(protocol.encode(protocol.GET_TIME))
+                response = json.loads(protocol.decode(transport.receive(2.0)))
+                self.assertIn('get_time', response[protocol.TIMESETTING])
+
+    def test_pipeline(self):
+        with connect(self.emulator, transport=TCPTransport) as light:
+            responses = light.pipeline([protocol.GET_TIME, protocol.GET_SYSINFO])
+        self.assertIn(protocol.TIMESETTING, responses[0])
+        self.assertIn(protocol.SYSTEM, responses[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1 +1,37 @@
-from .tplight import LB130  # noqa: F401
+"""
+Control TP-Link LB130 smart bulbs.
+
+The classes are imported on first access, so the command-line interface and
+scripts using one bulb do not pay for `asyncio` and the fleet modules.
+"""
+
+import importlib
+
+# Public names by the module defining them
+_EXPORTS = {
+    'tplight': ('LB130',),
+    'transport': ('FallbackTransport', 'TCPTransport', 'TransportPool', 'UDPTransport'),
+    'aio': ('AsyncLB130',),
+    'fleet': ('BulbGroup',),
+    'discovery': ('discover', 'iter_discover'),
+    'cache': ('DeviceCache',),
+    'retry': ('AdaptiveRetryPolicy', 'BulbUnavailableError', 'RetryPolicy'),
+    'effects': ('EffectRunner', 'Timeline'),
+    'protocol': ('BulbError',),
+}
+_MODULES = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = sorted(_MODULES)
+
+
+def __getattr__(name):
+    module = _MODULES.get(name)
+    if module is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module('.' + module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,16 +1,242 @@
 #!/usr/bin/env python3
-"""Command-line interface for `tplight` module."""
+"""
+Command-line interface for `tplight` module.
+
+Every call sends the fewest messages the options need: setters send one
+transition without reading the bulb, `--switch` and `--brightness-offset`
+read the status once more. Modules needed only by some options are imported
+when used, the interface is started as a process per command.
+
+Many bulbs are given as addresses, CIDR ranges, names from an inventory file
+or found with `--discover`. They are handled concurrently and reported as a
+table or as JSON lines printed as the bulbs answer.
+
+`python -m tplight serve` runs the gateway daemon of `tplight.server`.
+"""
 
 import argparse
 import json
-import pprint
+import sys
+import time
 
 from . import tplight
+from .retry import AdaptiveRetryPolicy
+from .transport import FallbackTransport, TCPTransport, UDPTransport
+
+TRANSPORTS = {'udp': UDPTransport, 'tcp': TCPTransport, 'auto': FallbackTransport}
+
+# Columns of the results table, other keys of the results are not shown
+COLUMNS = ('bulb', 'address', 'result', 'on_off', 'brightness', 'hue', 'saturation',
+           'color_temp', 'mode', 'time', 'ms')
+
+
+class DeadlinePolicy(AdaptiveRetryPolicy):
+    """Adaptive retry policy ending every request by the deadline of the command."""
+
+    def __init__(self, end):
+        super().__init__()
+        self.end = end
+        self.request_deadline = self.deadline
+
+    def begin(self):
+        self.deadline = max(0.0, min(self.request_deadline, self.end - time.monotonic()))
+        return super().begin()
+
+
+def load_inventory(path):
+    """
+    Read the inventory file: a JSON or YAML mapping of names to IP addresses,
+    CIDR ranges or lists of other names and addresses, e.g. groups of bulbs.
+    """
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError('Install PyYAML to read YAML inventory files')
+            inventory = yaml.safe_load(f)
+        else:
+            inventory = json.load(f)
+    if not isinstance(inventory, dict):
+        raise ValueError(f'Inventory {path} is not a mapping of names')
+    return inventory
+
+
+def resolve(names, inventory):
+    """
+    Expand the target names to bulbs.
+
+    Returns:
+        Dict of IP addresses to labels, in the order of the names.
+    """
+    targets = {}
+
+    def add(name, label, seen):
+        if name in inventory:
+            if name in seen:
+                raise ValueError(f'Inventory name {name} includes itself')
+            value = inventory[name]
+            values = value if isinstance(value, list) else [value]
+            for value in values:
+                # Single bulbs are labelled with their name, groups with the addresses
+                add(str(value), name if len(values) == 1 else None, seen | {name})
+        elif '/' in name:
+            import ipaddress
+            for ip in ipaddress.ip_network(name, strict=False).hosts():
+                targets.setdefault(str(ip), label or str(ip))
+        else:
+            targets.setdefault(name, label or name)
+
+    for name in names:
+        add(name, None, frozenset())
+    return targets
+
+
+def target_state(light, args):
+    """Build the transition requested by the options. Return its keyword args dict."""
+    new_state = {}
+    if args.on:
+        new_state['on_off'] = 1
+    if args.off:
+        new_state['on_off'] = 0
+    if args.switch:
+        new_state['on_off'] = int(not light.ison(max_age=None))
+
+    if args.transition_period is not None:
+        new_state['transition_period'] = args.transition_period
+    if args.temperature is not None:
+        new_state['color_temp'] = args.temperature
+    if args.hue is not None:
+        new_state['hue'] = args.hue
+    if args.saturation is not None:
+        new_state['saturation'] = args.saturation
+    if args.circadian:
+        new_state['mode'] = 'circadian'
+    if args.brightness is not None:
+        new_state['brightness'] = args.brightness
+    if args.brightness_offset is not None:
+        new_state['brightness'] = max(light.min_brightness, min(
+            light.max_brightness, light.brightness + args.brightness_offset
+        ))
+    return new_state
+
+
+def execute(light, args, end=None):
+    """
+    Run the requested operation on the bulb.
+
+    With `--wait` returns at the end of the transition, or at `end`
+    monotonic time of the deadline if it comes first.
+
+    Returns:
+        Dict with `sysinfo` and `time` if requested, `state` if the status was
+        read and `set` with the sent changes.
+    """
+    result = {}
+    # The status is read once, for printing it and for the relative changes
+    read_status = args.status or args.switch or args.brightness_offset is not None
+
+    if read_status or args.time:
+        with light.batch() as batch:
+            status = batch.sysinfo() if read_status else None
+            date = batch.time() if args.time else None
+        if args.status:
+            result['sysinfo'] = status.result()
+        if date:
+            result['time'] = date.result()
+
+    new_state = target_state(light, args)
+    if new_state:
+        start = time.monotonic()
+        light.transite_light_state(**new_state)
+        result['set'] = new_state
+        if args.wait:
+            wait_end = start + light.transition_period / 1000.0
+            if end is not None:
+                wait_end = min(wait_end, end)
+            time.sleep(max(0.0, wait_end - time.monotonic()))
+    if read_status:
+        # Includes the reply to the transition, no request is sent
+        result['state'] = light.light_state(max_age=float('inf'))
+    return result
+
+
+def run_one(light, label, args, end=None):
+    """Run the operation on one bulb. Return a flat result row for the output."""
+    start = time.monotonic()
+    row = {'bulb': label, 'address': light.ip_address}
+    try:
+        result = execute(light, args, end)
+    except (RuntimeError, OSError, ValueError) as e:
+        row['result'] = str(e) or type(e).__name__
+    else:
+        row['result'] = 'ok'
+        row.update(result.get('set', {}))
+        row.update(result.get('state', {}))
+        if 'time' in result:
+            row['time'] = result['time'].strftime('%Y/%m/%d %H:%M:%S')
+        if 'sysinfo' in result:
+            row['sysinfo'] = result['sysinfo']
+    finally:
+        light.close()
+    row['ms'] = round((time.monotonic() - start) * 1000)
+    return row
+
+
+def print_table(rows):
+    """Print the result rows aligned in columns."""
+    columns = [column for column in COLUMNS if any(column in row for row in rows)]
+    cells = [[str(row.get(column, '')) for column in columns] for row in rows]
+    widths = [max(len(text) for text in column) for column in zip(columns, *cells)]
+    for line in [columns] + cells:
+        print('  '.join(text.ljust(width) for text, width in zip(line, widths)).rstrip())
+
+
+def run_many(lights, args, end):
+    """Run the operation on all bulbs concurrently and print the results."""
+    import concurrent.futures
+
+    rows = {}
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.parallel)
+    futures = {
+        executor.submit(run_one, light, label, args, end): (light, label)
+        for light, label in lights
+    }
+    try:
+        timeout = None if end is None else max(0.0, end - time.monotonic())
+        for future in concurrent.futures.as_completed(futures, timeout):
+            row = future.result()
+            rows[futures[future]] = row
+            if args.json:
+                print(json.dumps(row), flush=True)
+    except concurrent.futures.TimeoutError:
+        for future, target in futures.items():
+            if target not in rows:
+                future.cancel()
+                light, label = target
+                row = rows[target] = {
+                    'bulb': label, 'address': light.ip_address, 'result': 'deadline exceeded'
+                }
+                if args.json:
+                    print(json.dumps(row), flush=True)
+    finally:
+        executor.shutdown(wait=False)
+
+    if not args.json:
+        print_table([rows[target] for target in futures.values()])
+    return all(row['result'] == 'ok' for row in rows.values())
 
 
 def main():
+    if sys.argv[1:2] == ['serve']:
+        from .server import main as serve
+        return serve(sys.argv[2:])
+
     p = argparse.ArgumentParser()
-    p.add_argument('address', help='IP of bulb')
+    p.add_argument(
+        'targets', nargs='*', metavar='address',
+        help='IP of bulb, CIDR range of IPs or name from the inventory'
+    )
     p.add_argument(
         '--transition-period', '-p', type=int, help='Set transition_period between state changes'
     )
@@ -20,7 +246,34 @@ def main():
     p.add_argument('--circadian', action='store_true', help='Set bulb color mode to circadian')
     p.add_argument('--status', action='store_true', help='Get bulb status')
     p.add_argument('--time', action='store_true', help='Get bulb time')
-    p.add_argument('--wait', action='store_true', help='Wait until the transition_period end')
+    p.add_argument(
+        '--wait', action='store_true', help='Wait until the transition_period end or the deadline'
+    )
+    p.add_argument(
+        '--no-cache', action='store_true',
+        help='Ignored, the light details cache is not used by any option'
+    )
+    p.add_argument(
+        '--transport',
+        choices=sorted(TRANSPORTS),
+        default='udp',
+        help='Talk to the bulb over UDP, TCP or TCP falling back to UDP'
+    )
+    p.add_argument(
+        '--inventory', '-i',
+        help='JSON or YAML file mapping names to IPs, CIDR ranges or lists of them'
+    )
+    p.add_argument(
+        '--discover', nargs='?', type=float, const=1.0, metavar='SECONDS',
+        help='Add bulbs answering the broadcast within SECONDS, 1 by default'
+    )
+    p.add_argument(
+        '--parallel', '-j', type=int, default=32, help='Maximum number of bulbs handled at once'
+    )
+    p.add_argument('--deadline', type=float, help='Give up on bulbs not done after SECONDS')
+    p.add_argument(
+        '--json', action='store_true', help='Print results as JSON lines as the bulbs answer'
+    )
     group = p.add_mutually_exclusive_group()
     group.add_argument('--brightness', '-b', type=int, help='Set bulb brightness')
     group.add_argument(
@@ -33,44 +286,54 @@ def main():
     group.add_argument('--on', action='store_true', help='Turn on the bulb')
     group.add_argument('--off', action='store_true', help='Turn off the bulb')
     args = p.parse_args()
+    if not args.targets and args.discover is None:
+        p.error('Give the address of a bulb or --discover')
+    if args.parallel < 1:
+        p.error('--parallel should be positive')
 
-    light = tplight.LB130(args.address)
-
-    new_state = {}
+    end = None if args.deadline is None else time.monotonic() + args.deadline
+    try:
+        inventory = load_inventory(args.inventory) if args.inventory else {}
+        targets = resolve(args.targets, inventory)
+    except (OSError, ValueError) as e:
+        p.error(str(e))
 
-    if args.status:
-        pprint.pprint(json.loads(light.status()))
-    if args.time:
-        print((light.time.strftime('%Y/%m/%d %H:%M:%S')))
+    lights = []
+    if args.discover is not None:
+        from .discovery import iter_discover
+        timeout = args.discover if end is None else min(args.discover, end - time.monotonic())
+        for light in iter_discover(timeout, transport_class=TRANSPORTS[args.transport]):
+            if light.ip_address in targets:
+                light.close()
+                continue
+            # Found bulbs are initialised from their replies, the status is known
+            targets[light.ip_address] = None
+            lights.append((light, light.alias))
+    for ip, label in targets.items():
+        if label is None:
+            continue
+        try:
+            # No option reads the light details, the cache would only cost disk I/O
+            light = tplight.LB130(ip, transport=TRANSPORTS[args.transport](ip), lazy=True)
+        except ValueError as e:
+            p.error(f'{label}: {e}')
+        lights.append((light, label))
+    for light, _ in lights:
+        light.retry_policy = AdaptiveRetryPolicy() if end is None else DeadlinePolicy(end)
 
-    if args.on:
-        new_state['on_off'] = 1
-    if args.off:
-        new_state['on_off'] = 0
-    if args.switch:
-        new_state['on_off'] = int(not light.ison())
-
-    if args.transition_period:
-        new_state['transition_period'] = args.transition_period
-    if args.temperature:
-        new_state['color_temp'] = args.temperature
-    if args.hue:
-        new_state['hue'] = args.hue
-    if args.saturation:
-        new_state['saturation'] = args.saturation
-    if args.circadian:
-        new_state['mode'] = 'circadian'
-    if args.brightness:
-        new_state['brightness'] = args.brightness
-    if args.brightness_offset:
-        new_state['brightness'] = max(light.min_brightness, min(
-            light.max_brightness, light.brightness + args.brightness_offset
-        ))
-    if args.wait:
-        new_state['synchronous'] = True
+    if len(lights) == 1 and not args.json and args.discover is None:
+        light, _ = lights[0]
+        with light:
+            result = execute(light, args, end)
+        if 'sysinfo' in result:
+            import pprint
+            pprint.pprint(result['sysinfo'])
+        if 'time' in result:
+            print((result['time'].strftime('%Y/%m/%d %H:%M:%S')))
+        return
 
-    if new_state:
-        light.transite_light_state(**new_state)
+    if not run_many(lights, args, end):
+        raise SystemExit(1)
 
 
 if __name__ == '__main__':
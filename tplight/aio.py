@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""Asyncio control class for TP-Link A19-LB130 RBGW WiFi bulb."""
+
+import asyncio
+import json
+import logging
+import time
+import weakref
+
+from . import metrics
+from . import protocol
+from .retry import AdaptiveRetryPolicy
+from .tplight import LB130
+
+
+class DatagramRouter(asyncio.DatagramProtocol):
+    """
+    One UDP endpoint shared by all async bulbs of the event loop.
+
+    Received datagrams are routed to the future waiting for a reply from the
+    source address.
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.__waiters = {}
+        self.__closed = None
+
+    @classmethod
+    async def create(cls, local_addr=('0.0.0.0', 0)):
+        """Open the endpoint on the running event loop."""
+        loop = asyncio.get_running_loop()
+        _, router = await loop.create_datagram_endpoint(cls, local_addr=local_addr)
+        return router
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.__closed = asyncio.get_running_loop().create_future()
+
+    def connection_lost(self, exc):
+        for waiter in self.__waiters.values():
+            if not waiter.done():
+                waiter.set_exception(exc or ConnectionError('Endpoint is closed'))
+        self.__waiters.clear()
+        if not self.__closed.done():
+            self.__closed.set_result(None)
+
+    def datagram_received(self, data, addr):
+        waiter = self.__waiters.get(addr[:2])
+        if waiter is not None and not waiter.done():
+            waiter.set_result(data)
+        else:
+            logging.debug('Dropped unexpected datagram from %s', addr)
+
+    def error_received(self, exc):
+        logging.debug('Datagram endpoint error: %s', exc)
+
+    def send(self, data, address):
+        """Send one datagram to the address."""
+        self.transport.sendto(data, address)
+
+    async def receive(self, address, timeout):
+        """
+        Wait for one datagram from the address.
+
+        Raises `asyncio.TimeoutError` if nothing arrives in `timeout` seconds.
+        Only one coroutine may wait for the same address at a time.
+        """
+        if address in self.__waiters:
+            raise RuntimeError(f'Already waiting for a reply from {address}')
+        waiter = self.__waiters[address] = asyncio.get_running_loop().create_future()
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        finally:
+            del self.__waiters[address]
+
+    async def close(self):
+        """Close the endpoint."""
+        if self.transport is not None:
+            self.transport.close()
+            await self.__closed
+
+    async def wait_closed(self):
+        """Wait until the endpoint is closed."""
+        await self.__closed
+
+
+class AsyncLB130(object):
+    """
+    Awaitable methods for controlling the LB130 bulb.
+
+    Create with `await AsyncLB130.connect(ip_address)`. Bulbs without
+    explicit `router` share one endpoint per event loop, closed when
+    `asyncio.run()` ends or by `close_shared()`.
+    """
+
+    encryption_key = LB130.encryption_key
+
+    min_brightness = LB130.min_brightness
+    max_brightness = LB130.max_brightness
+    min_hue = LB130.min_hue
+    max_hue = LB130.max_hue
+    min_saturation = LB130.min_saturation
+    max_saturation = LB130.max_saturation
+    min_transition_period = LB130.min_transition_period
+    max_transition_period = LB130.max_transition_period
+    min_color_temp = LB130.min_color_temp
+    max_color_temp = LB130.max_color_temp
+
+    port = 9999
+
+    lamp_beam_angle = 0
+    min_voltage = 0
+    max_voltage = 0
+    wattage = 0
+    incandescent_equivalent = 0
+    max_lumens = 0
+    color_rendering_index = 0
+
+    # Event loop to (future of the shared router, task holding it open)
+    __routers = weakref.WeakKeyDictionary()
+
+    def __init__(self, ip_address, router=None, retry_policy=None):
+        """Initialise the bulb with an IP address. No network I/O is done."""
+        self.ip_address = ip_address
+        self.retry_policy = retry_policy or AdaptiveRetryPolicy()
+        self.__router = router
+        self.__lock = None
+        self.__transition_period = 0
+        self.__state = {
+            'alias': '',
+            'device_id': '',
+            'on_off': 0,
+            'hue': 0,
+            'saturation': 0,
+            'brightness': 0,
+            'color_temp': 0,
+            'mode': '',
+        }
+
+    @classmethod
+    async def connect(cls, ip_address, router=None, retry_policy=None):
+        """Create the bulb and fetch its status and light details."""
+        light = cls(ip_address, router, retry_policy)
+        await light.status()
+        for name, value in protocol.parse_light_details(await light.light_details()).items():
+            setattr(light, name, value)
+        return light
+
+    @classmethod
+    async def close_shared(cls):
+        """
+        Close the endpoint shared by the bulbs of the running event loop.
+
+        `asyncio.run()` closes it on exit, loops run otherwise should call
+        this before they are closed. The next request opens it again.
+        """
+        shared = cls.__routers.pop(asyncio.get_running_loop(), None)
+        if shared is not None:
+            _, holder = shared
+            holder.cancel()
+            await asyncio.gather(holder, return_exceptions=True)
+
+    def __str__(self):
+        return (
+            '<AsyncLB130'
+            f' {self.ip_address}'
+            f' {"ON" if self.on_off else "OFF"}'
+            f' transition_period:{self.__transition_period}'
+            f' hue:{self.hue}'
+            f' saturation:{self.saturation}'
+            f' brightness:{self.brightness}'
+            f' color_temp:{self.temperature}'
+            f'>'
+        )
+
+    async def transite_light_state(self, **kwargs):
+        """
+        Update one or more bulb's properties at one time.
+
+        Accepts the same keyword arguments as `LB130.transite_light_state`.
+        With `synchronous` awaits until the end of transition_period.
+        """
+        if 'transition_period' in kwargs:
+            self.transition_period = kwargs['transition_period']
+        data = protocol.transition_request(self, self.__transition_period, kwargs)
+
+        start_time = time.monotonic()
+        response = await self.fetch_dict(data)
+
+        try:
+            state = protocol.parse_light_state(
+                response[protocol.LIGHTING]['transition_light_state']
+            )
+        except (KeyError, TypeError, ValueError):
+            state = data[protocol.LIGHTING]['transition_light_state']
+        self.__state.update((k, v) for k, v in state.items() if k in self.__state)
+
+        if kwargs.get('synchronous'):
+            await asyncio.sleep(max(
+                0, self.__transition_period / 1000.0 - (time.monotonic() - start_time)
+            ))
+
+    async def status(self):
+        """Get the connection status from the bulb. Returns JSON string."""
+        data = await self.fetch_dict(protocol.GET_SYSINFO)
+        self.__state.update(protocol.parse_sysinfo(data))
+        return json.dumps(data)
+
+    async def light_details(self):
+        """Get the light details from the bulb."""
+        return await self.fetch_dict(protocol.GET_LIGHT_DETAILS)
+
+    async def on(self):
+        """Set the bulb to an ON state."""
+        await self.transite_light_state(on_off=1)
+
+    async def off(self):
+        """Set the bulb to an OFF state."""
+        await self.transite_light_state(on_off=0)
+
+    async def ison(self):
+        """Check if bulb is on."""
+        await self.status()
+        return self.on_off
+
+    async def reboot(self):
+        """Reboot the bulb."""
+        await self.fetch_dict(protocol.REBOOT)
+
+    async def set_alias(self, name):
+        """Set the device alias."""
+        await self.fetch_dict(protocol.set_alias_request(name))
+        self.__state['alias'] = name
+
+    async def time(self):
+        """Get the date and time from the device."""
+        return protocol.parse_time(await self.fetch_dict(protocol.GET_TIME))
+
+    async def set_time(self, date):
+        """Set the date and time on the device."""
+        await self.fetch_dict(protocol.set_time_request(date))
+
+    async def timezone(self):
+        """Get the timezone from the device."""
+        return protocol.parse_timezone(await self.fetch_dict(protocol.GET_TIMEZONE))
+
+    async def set_timezone(self, timezone):
+        """Set the timezone on the device."""
+        protocol.check_timezone(timezone)
+        await self.fetch_dict(protocol.set_timezone_request(timezone, await self.time()))
+
+    @property
+    def transition_period(self):
+        """Get the bulb transition period."""
+        return self.__transition_period
+
+    @transition_period.setter
+    def transition_period(self, period):
+        """Set the bulb transition period."""
+        if self.min_transition_period <= period <= self.max_transition_period:
+            self.__transition_period = period
+        else:
+            raise ValueError(
+                '`transition_period` is out of range:'
+                f' {self.min_transition_period} to {self.max_transition_period}'
+            )
+
+    @property
+    def alias(self):
+        """Get the cached device alias."""
+        return self.__state['alias']
+
+    @property
+    def device_id(self):
+        """Get the cached device id."""
+        return self.__state['device_id']
+
+    @property
+    def on_off(self):
+        """Get the cached power state."""
+        return self.__state['on_off']
+
+    @property
+    def hue(self):
+        """Get the cached bulb hue."""
+        return self.__state['hue']
+
+    @property
+    def saturation(self):
+        """Get the cached bulb saturation."""
+        return self.__state['saturation']
+
+    @property
+    def brightness(self):
+        """Get the cached bulb brightness."""
+        return self.__state['brightness']
+
+    @property
+    def temperature(self):
+        """Get the cached bulb color temperature."""
+        return self.__state['color_temp']
+
+    @property
+    def mode(self):
+        """Get the cached bulb color mode."""
+        return self.__state['mode']
+
+    @property
+    def hsb(self):
+        """Get the cached bulb hue, saturation, and brightness."""
+        return (self.hue, self.saturation, self.brightness)
+
+    async def fetch_dict(self, data):
+        """Fetch dict from the device. Return value is a dict too."""
+        start = time.perf_counter()
+        enc_message = protocol.encode(data, self.encryption_key)
+        encode_time = time.perf_counter() - start
+        if self.__lock is None:
+            self.__lock = asyncio.Lock()
+        async with self.__lock:
+            return await self.__fetch_data(enc_message, data, encode_time)
+
+    async def __fetch_data(self, enc_message, request, encode_time=0.0):
+        """Send the encrypted request to the device. Return response dict."""
+        address = (self.ip_address, self.port)
+        event = metrics.RequestEvent(request, address)
+        event.encode_time = encode_time
+        start = time.perf_counter()
+        try:
+            router = await self.__get_router()
+            call = self.retry_policy.begin()
+            for timeout in call:
+                event.attempts = call.attempts
+                router.send(enc_message, address)
+                sent = time.perf_counter()
+                event.bytes_sent += len(enc_message)
+                deadline = time.monotonic() + timeout
+                try:
+                    while True:
+                        data = await router.receive(address, max(0, deadline - time.monotonic()))
+                        received = time.perf_counter()
+                        event.bytes_received += len(data)
+                        response = protocol.read_reply(data, request, self.encryption_key)
+                        event.decode_time += time.perf_counter() - received
+                        if response is not None:
+                            event.rtt = received - sent
+                            event.response = response
+                            call.succeeded()
+                            protocol.check_reply(request, response)
+                            return response
+                        logging.debug('Ignored unexpected datagram from %s', self.ip_address)
+                except asyncio.TimeoutError:
+                    logging.debug('No reply from %s. Try %d', self.ip_address, call.attempts)
+
+            call.failed()
+            raise RuntimeError('Error connecting to bulb')
+        except Exception as e:
+            event.fail(e)
+            raise
+        finally:
+            event.duration = time.perf_counter() - start
+            if metrics.observers:
+                metrics.emit(event)
+
+    async def __get_router(self):
+        """Get own router or the shared one of the running event loop."""
+        if self.__router is not None:
+            return self.__router
+        loop = asyncio.get_running_loop()
+        shared = self.__routers.get(loop)
+        if shared is None:
+            ready = loop.create_future()
+            shared = self.__routers[loop] = (ready, loop.create_task(self.__hold_router(ready)))
+        ready, _ = shared
+        # A caller going away does not cancel the router shared with others
+        router = await asyncio.shield(ready)
+        if router.transport.is_closing():
+            if self.__routers.get(loop) is shared:
+                del self.__routers[loop]
+            return await self.__get_router()
+        return router
+
+    @classmethod
+    async def __hold_router(cls, ready):
+        """
+        Open the shared router of the running loop and keep it until it is
+        closed or the task is cancelled, as `asyncio.run()` does on exit.
+
+        The entry of the loop is removed when done, so the loop is not kept
+        alive by the router and the next request opens a new one.
+        """
+        loop = asyncio.get_running_loop()
+        router = None
+        try:
+            router = await DatagramRouter.create()
+            ready.set_result(router)
+            await router.wait_closed()
+        except Exception as e:
+            ready.set_exception(e)
+        finally:
+            if not ready.done():
+                ready.cancel()
+            shared = cls.__routers.get(loop)
+            if shared is not None and shared[0] is ready:
+                del cls.__routers[loop]
+            if router is not None:
+                await router.close()
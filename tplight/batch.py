@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""Several protocol calls merged into one message."""
+
+import json
+
+from .protocol import BulbError
+
+
+class PendingResult(object):
+    """Result of a batched call, available after the batch is sent."""
+
+    def __init__(self, module, method):
+        self.module = module
+        self.method = method
+        self.__done = False
+        self.__value = None
+        self.__error = None
+
+    def __repr__(self):
+        state = 'done' if self.__done else 'pending'
+        return f'<PendingResult {self.module}.{self.method} {state}>'
+
+    @property
+    def done(self):
+        """Check if the batch of the call was sent and the reply was received."""
+        return self.__done
+
+    def result(self):
+        """Get the value of the call. Raise the error of the call if it failed."""
+        if not self.__done:
+            raise RuntimeError('Batch was not sent yet.')
+        if self.__error is not None:
+            raise self.__error
+        return self.__value
+
+    def exception(self):
+        """Get the error of the call or None."""
+        if not self.__done:
+            raise RuntimeError('Batch was not sent yet.')
+        return self.__error
+
+    def _set_result(self, value):
+        self.__done = True
+        self.__value = value
+
+    def _set_exception(self, error):
+        self.__done = True
+        self.__error = error
+
+
+class Batch(object):
+    """
+    Queue of calls sent to the bulb in one message.
+
+    Every call is a request dict with one module and one method, e.g.
+    `protocol.GET_SYSINFO`. Calls may use different modules but every
+    module and method pair is allowed once per batch. The batch is sent on
+    `send()` or on leaving the `with` block without an exception.
+    """
+
+    def __init__(self, send):
+        """
+        Initialise the batch.
+
+        Args:
+            send: Function sending the request dict to the bulb and
+                returning the response dict without checking `err_code`.
+        """
+        self.__send = send
+        self.__calls = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None and self.__calls:
+            self.send()
+
+    def __len__(self):
+        return len(self.__calls)
+
+    def add(self, request, parse=None):
+        """
+        Queue the call.
+
+        Args:
+            request: Request dict with one module and one method.
+            parse: Function building the call result from the response dict
+                `{module: {method: reply}}`. The response dict itself is the
+                result if not provided.
+
+        Returns:
+            `PendingResult` of the call.
+        """
+        ((module, methods),) = request.items()
+        ((method, args),) = methods.items()
+        if any(c.module == module and c.method == method for c, _, _ in self.__calls):
+            raise ValueError(f'{module}.{method} is already in the batch.')
+        pending = PendingResult(module, method)
+        self.__calls.append((pending, args, parse))
+        return pending
+
+    def request(self):
+        """Get the merged request dict of all queued calls."""
+        return self.request_of(self.__calls)
+
+    def send(self):
+        """Send the queued calls and resolve their results."""
+        if not self.__calls:
+            return
+        calls, self.__calls = self.__calls, []
+        try:
+            response = self.__send(self.request_of(calls))
+        except Exception as e:
+            for pending, _, _ in calls:
+                pending._set_exception(e)
+            raise
+        self.resolve(calls, response)
+
+    @staticmethod
+    def request_of(calls):
+        """Get the merged request dict of the calls."""
+        data = {}
+        for pending, args, _ in calls:
+            data.setdefault(pending.module, {})[pending.method] = args
+        return data
+
+    @staticmethod
+    def resolve(calls, response):
+        """Set results of the calls from the response dict."""
+        for pending, _, parse in calls:
+            module_reply = response.get(pending.module)
+            reply = module_reply.get(pending.method) if isinstance(module_reply, dict) else None
+            if not isinstance(reply, dict):
+                # The module itself may have failed, e.g. it is not supported
+                pending._set_exception(BulbError(
+                    f'Bulb returned no reply for {pending.module}.{pending.method}: '
+                    + json.dumps(module_reply),
+                    module_reply.get('err_code') if isinstance(module_reply, dict) else None,
+                ))
+                continue
+            if reply.get('err_code', 0) != 0:
+                pending._set_exception(BulbError(
+                    'Bulb returned error: '
+                    + json.dumps({pending.module: {pending.method: reply}}),
+                    reply['err_code'],
+                ))
+                continue
+            data = {pending.module: {pending.method: reply}}
+            try:
+                pending._set_result(data if parse is None else parse(data))
+            except Exception as e:
+                pending._set_exception(e)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""On-disk cache of static bulb information."""
+
+import json
+import logging
+import os
+import tempfile
+
+
+def default_cache_dir():
+    """Get the directory for tplight cache files."""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'tplight')
+
+
+def read_json(path, valid=None):
+    """
+    Read the JSON cache file.
+
+    Args:
+        path: Path of the file.
+        valid: Callable checking the format of the content. Dicts are
+            accepted by default.
+
+    Returns:
+        The content, or None if the file is missing, broken or of unknown format.
+    """
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        if (isinstance(data, dict) if valid is None else valid(data)):
+            return data
+        logging.debug('Ignored cache file of unknown format: %s', path)
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        logging.debug('Failed to read cache file %s: %s', path, e)
+    return None
+
+
+def write_json_atomic(path, data):
+    """
+    Write the JSON cache file through a temporary file replacing it, so
+    readers never see a partly written file. Errors are logged.
+    """
+    directory = os.path.dirname(path) or '.'
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        logging.debug('Failed to write cache file %s: %s', path, e)
+
+
+class DeviceCache(object):
+    """
+    Light details and static sysinfo of the bulbs keyed by `deviceId`.
+
+    The last known address of every device is kept too, so a bulb can be
+    looked up before its sysinfo is fetched. Entries are dropped when the
+    firmware version of the device changes.
+    """
+
+    file_name = 'devices.json'
+
+    def __init__(self, path=None):
+        """
+        Initialise the cache.
+
+        Args:
+            path: Path of the cache file. `devices.json` in the user cache
+                directory by default.
+        """
+        self.path = path or os.path.join(default_cache_dir(), self.file_name)
+        self.__data = None
+
+    def lookup(self, ip_address=None, device_id=None):
+        """
+        Find the cached entry of the device.
+
+        Args:
+            ip_address: Last known IP address of the device.
+            device_id: Device id. Takes precedence over `ip_address`.
+
+        Returns:
+            Dict with `sysinfo` and `light_details` dicts or None.
+        """
+        data = self.__load()
+        if device_id is None:
+            device_id = data['addresses'].get(ip_address)
+        return data['devices'].get(device_id)
+
+    def store(self, ip_address, sysinfo, light_details):
+        """
+        Save the device entry.
+
+        Args:
+            ip_address: Current IP address of the device.
+            sysinfo: Static sysinfo values including `deviceId` and `sw_ver`.
+            light_details: Light details values.
+        """
+        device_id = sysinfo['deviceId']
+
+        def change(data):
+            data['devices'][device_id] = {'sysinfo': sysinfo, 'light_details': light_details}
+            data['addresses'][ip_address] = device_id
+
+        self.__update(change)
+
+    def remember_address(self, ip_address, device_id):
+        """Update the known address of the device if it changed."""
+        data = self.__load()
+        if device_id in data['devices'] and data['addresses'].get(ip_address) != device_id:
+            def change(data):
+                data['addresses'][ip_address] = device_id
+
+            self.__update(change)
+
+    def invalidate(self, device_id):
+        """Drop the device entry."""
+        if device_id in self.__load()['devices']:
+            def change(data):
+                data['devices'].pop(device_id, None)
+
+            self.__update(change)
+
+    def is_valid(self, entry, sysinfo):
+        """Check if the cached entry matches the sysinfo fetched from the device."""
+        cached = entry['sysinfo']
+        return all(cached.get(name) == sysinfo.get(name) for name in ('deviceId', 'sw_ver'))
+
+    def __load(self):
+        """Get the cache content, reading the file on first use."""
+        if self.__data is None:
+            self.__data = self.__read()
+        return self.__data
+
+    def __read(self):
+        """Read the cache file. Return empty content if it is missing or broken."""
+        data = read_json(self.path, lambda data: (
+            isinstance(data, dict)
+            and isinstance(data.get('devices'), dict)
+            and isinstance(data.get('addresses'), dict)
+        ))
+        return data if data is not None else {'devices': {}, 'addresses': {}}
+
+    def __update(self, change):
+        """Apply the change to the latest file content and write it back."""
+        data = self.__read()
+        change(data)
+        self.__data = data
+        write_json_atomic(self.path, data)
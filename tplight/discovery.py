@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Discovery of LB130 bulbs in the local network."""
+
+import logging
+import socket
+import time
+
+from . import protocol
+from .tplight import LB130
+from .transport import DatagramTruncated, UDPTransport, receive_into
+
+BROADCAST_ADDRESS = '255.255.255.255'
+PORT = 9999
+
+
+def iter_discover(
+    timeout=1.0,
+    address=BROADCAST_ADDRESS,
+    port=PORT,
+    repeat=3,
+    transport_pool=None,
+    transport_class=UDPTransport,
+):
+    """
+    Broadcast `get_sysinfo` request and yield bulbs as their replies arrive.
+
+    The request is sent `repeat` times spread over `timeout` to survive lost
+    packets. Devices which are not bulbs, e.g. smart plugs, are skipped.
+
+    Args:
+        timeout: Time to wait for the replies in seconds.
+        address: Broadcast address of the subnet.
+        port: Port of the bulbs.
+        repeat: How many times to send the request.
+        transport_pool: `TransportPool` to take the transports of the bulbs
+            from. Every bulb gets its own transport if not provided.
+        transport_class: Class of the transports of the bulbs, called with
+            the IP and port, e.g. `TCPTransport`. Ignored with `transport_pool`.
+
+    Yields:
+        `LB130` objects initialised from the replies without further requests.
+    """
+    enc_message = protocol.encode(protocol.GET_SYSINFO, LB130.encryption_key)
+    buffer = bytearray(4096)
+    seen = set()
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        start = time.monotonic()
+        deadline = start + timeout
+        sent = 0
+
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if sent < repeat and now >= start + timeout * sent / repeat:
+                sock.sendto(enc_message, (address, port))
+                sent += 1
+            next_send = start + timeout * sent / repeat if sent < repeat else deadline
+            sock.settimeout(max(0, min(deadline, next_send) - now))
+            try:
+                size, (ip, reply_port) = receive_into(sock, buffer)
+            except DatagramTruncated as e:
+                # Picked up by the next broadcast
+                buffer = bytearray(e.buffer_size)
+                continue
+            except socket.timeout:
+                continue
+            if ip in seen:
+                continue
+
+            data = protocol.read_reply(
+                memoryview(buffer)[:size], protocol.GET_SYSINFO, LB130.encryption_key
+            )
+            if data is None:
+                logging.debug('Ignored malformed discovery reply from %s', ip)
+                continue
+            seen.add(ip)
+            if 'light_state' not in data[protocol.SYSTEM]['get_sysinfo']:
+                continue
+
+            if transport_pool is None:
+                transport = transport_class(ip, reply_port)
+            else:
+                transport = transport_pool.get(ip, reply_port)
+            yield LB130(ip, transport=transport, sysinfo=data)
+
+
+def discover(
+    timeout=1.0,
+    address=BROADCAST_ADDRESS,
+    port=PORT,
+    repeat=3,
+    transport_pool=None,
+    transport_class=UDPTransport,
+):
+    """
+    Find bulbs in the local network.
+
+    Accepts the same arguments as `iter_discover`.
+
+    Returns:
+        List of `LB130` objects found during `timeout`.
+    """
+    return list(iter_discover(timeout, address, port, repeat, transport_pool, transport_class))
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""Light effects played on the bulbs at a fixed frame rate."""
+
+import bisect
+import logging
+import threading
+import time
+
+from .tplight import LB130
+
+
+class Timeline(object):
+    """
+    Keyframes of a light effect.
+
+    Every keyframe is a `(seconds, state)` pair, where the state is a dict of
+    `LB130.transite_light_state` keyword arguments. Numeric values are
+    interpolated linearly between the keyframes, the hue the short way round
+    the colour circle. Other values are kept from the previous keyframe.
+    """
+
+    def __init__(self, keyframes, loop=False):
+        """
+        Initialise the timeline.
+
+        Args:
+            keyframes: Iterable of `(seconds, state)` pairs.
+            loop: Start over after the last keyframe. The last keyframe is
+                then blended into the first one.
+        """
+        self.keyframes = sorted(keyframes, key=lambda keyframe: keyframe[0])
+        if not self.keyframes:
+            raise ValueError('Timeline needs at least one keyframe.')
+        self.loop = loop
+        self.__times = [seconds for seconds, _ in self.keyframes]
+
+    @property
+    def duration(self):
+        """Get the time of the last keyframe in seconds."""
+        return self.__times[-1]
+
+    def state_at(self, seconds):
+        """Get the state dict at the time from the start of the timeline."""
+        if self.loop and self.duration > 0:
+            seconds %= self.duration
+        index = bisect.bisect_right(self.__times, seconds)
+        if index == 0:
+            return dict(self.keyframes[0][1])
+        if index == len(self.keyframes):
+            return dict(self.keyframes[-1][1])
+
+        (start_time, start), (end_time, end) = self.keyframes[index - 1:index + 1]
+        ratio = (seconds - start_time) / (end_time - start_time)
+        state = dict(start)
+        for name, end_value in end.items():
+            start_value = start.get(name)
+            if name == 'on_off' or not all(
+                isinstance(v, (int, float)) and not isinstance(v, bool)
+                for v in (start_value, end_value)
+            ):
+                continue
+            delta = end_value - start_value
+            if name == 'hue':
+                delta = (delta + 180) % 360 - 180
+                state[name] = round(start_value + delta * ratio) % 360
+            else:
+                state[name] = round(start_value + delta * ratio)
+        return state
+
+
+class EffectStats(object):
+    """Counters of a played effect."""
+
+    def __init__(self, target_fps):
+        self.target_fps = target_fps
+        # Frames dispatched, including the ones equal to the previous frame
+        self.frames = 0
+        # Frames actually sent to the bulbs
+        self.sent = 0
+        # Frames dropped or merged into a later frame because of the lag
+        self.dropped = 0
+        # Bulb requests which failed
+        self.errors = 0
+        self.elapsed = 0.0
+        self.max_lag = 0.0
+        self.__total_lag = 0.0
+
+    def __repr__(self):
+        return (
+            f'<EffectStats fps:{self.fps:.2f}/{self.target_fps:g}'
+            f' frames:{self.frames} sent:{self.sent} dropped:{self.dropped}'
+            f' errors:{self.errors} lag:{self.mean_lag * 1000:.1f}ms'
+            f' max_lag:{self.max_lag * 1000:.1f}ms>'
+        )
+
+    @property
+    def fps(self):
+        """Get the achieved frame rate."""
+        return self.frames / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def mean_lag(self):
+        """Get the mean delay of the frames behind their schedule in seconds."""
+        return self.__total_lag / self.frames if self.frames else 0.0
+
+    def record(self, lag):
+        """Account one dispatched frame."""
+        self.frames += 1
+        self.__total_lag += lag
+        self.max_lag = max(self.max_lag, lag)
+
+
+class EffectRunner(object):
+    """
+    Play an effect on a bulb or a group of bulbs.
+
+    Frames are scheduled against the monotonic clock, every frame starts a
+    transition to its state lasting till the next frame, so the bulb itself
+    interpolates between the frames. When sending falls behind the schedule,
+    the late frames are dropped rather than queued: states of a generator are
+    merged into the next frame and a timeline jumps to the current time.
+
+    The target is anything with `transite_light_state`, e.g. `LB130` or
+    `tplight.BulbGroup` for many bulbs over one socket. A short retry
+    deadline, e.g. `AdaptiveRetryPolicy(deadline=1 / fps)`, keeps a lost
+    reply from stalling the following frames.
+    """
+
+    def __init__(self, target, fps=5.0):
+        self.target = target
+        self.fps = fps
+        self.stats = EffectStats(fps)
+        self.__stop = threading.Event()
+
+    @property
+    def period(self):
+        """Get the frame period in seconds."""
+        return 1.0 / self.fps
+
+    def stop(self):
+        """Stop the running effect after the current frame. Safe to call from other threads."""
+        self.__stop.set()
+
+    def run(self, source, duration=None):
+        """
+        Play the effect until it ends, `duration` passes or `stop()` is called.
+
+        Args:
+            source: `Timeline` or an iterable of state dicts, one per frame.
+            duration: Maximum time to play in seconds. A timeline without
+                loop ends after its last keyframe by default.
+
+        Returns:
+            `EffectStats` of the run, also available as `stats`.
+        """
+        period = self.period
+        timeline = source if isinstance(source, Timeline) else None
+        if timeline is None:
+            states = iter(source)
+        elif duration is None and not timeline.loop:
+            duration = timeline.duration
+        transition_period = min(LB130.max_transition_period, round(period * 1000))
+
+        stats = self.stats = EffectStats(self.fps)
+        self.__stop.clear()
+        start = time.monotonic()
+        index = 0
+        last_state = None
+        # Frames set the period of the target, it is restored after the effect
+        saved_period = getattr(self.target, 'transition_period', None)
+
+        try:
+            while not self.__stop.is_set():
+                if duration is not None and index * period > duration:
+                    break
+                if timeline is None:
+                    state = next(states, None)
+                    if state is None:
+                        break
+
+                due = start + index * period
+                now = time.monotonic()
+                if now < due:
+                    if self.__stop.wait(due - now):
+                        break
+                    now = time.monotonic()
+
+                behind = int((now - due) // period)
+                if behind and timeline is None:
+                    for _ in range(behind):
+                        later = next(states, None)
+                        if later is None:
+                            break
+                        state = dict(state, **later)
+                if behind:
+                    logging.debug('Effect is %d frames behind', behind)
+                    stats.dropped += behind
+                    index += behind
+                if timeline is not None:
+                    target_time = (index + 1) * period
+                    if duration is not None:
+                        target_time = min(target_time, duration)
+                    state = timeline.state_at(target_time)
+
+                stats.record(now - due)
+                if state != last_state:
+                    self.__send(state, transition_period)
+                    last_state = state
+                index += 1
+        finally:
+            if saved_period is not None:
+                self.target.transition_period = saved_period
+
+        stats.elapsed = time.monotonic() - start
+        return stats
+
+    def __send(self, state, transition_period):
+        """Start the transition to the frame state and account errors."""
+        self.stats.sent += 1
+        kwargs = dict(state)
+        kwargs.setdefault('transition_period', transition_period)
+        try:
+            results = self.target.transite_light_state(**kwargs)
+        except Exception as e:
+            logging.debug('Effect frame failed: %s', e)
+            self.stats.errors += 1
+            return
+        if isinstance(results, dict):
+            self.stats.errors += sum(1 for error in results.values() if error is not None)
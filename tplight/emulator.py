@@ -0,0 +1,624 @@
+#!/usr/bin/env python3
+"""
+Emulated LB130 bulbs serving the protocol on localhost for tests and
+benchmarks.
+
+Run `python -m tplight.emulator --count 10` to serve ten bulbs, or use
+`Emulator` from the code:
+
+    with Emulator(count=100, conditions=NetworkConditions(loss=0.05)) as emulator:
+        group = BulbGroup(emulator.addresses)
+"""
+
+import argparse
+import asyncio
+import calendar
+import datetime
+import hashlib
+import ipaddress
+import json
+import logging
+import random
+import struct
+import threading
+import time
+import uuid
+
+from . import codec
+from . import protocol
+
+
+class NetworkConditions(object):
+    """
+    Delivery of the replies.
+
+    Every UDP reply is delayed by `latency` plus a random `jitter`, lost with
+    probability `loss`, sent twice with probability `duplicate` and delayed
+    by `late_delay` more seconds with probability `late`, so it comes after
+    the client gave up waiting. TCP replies get the delay only.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, loss=0.0, duplicate=0.0, late=0.0, late_delay=2.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.duplicate = duplicate
+        self.late = late
+        self.late_delay = late_delay
+
+    def delays(self, rng, reliable=False):
+        """Get the delays in seconds of the copies of one reply. Empty if it is lost."""
+        delay = self.latency + rng.uniform(0, self.jitter) if self.jitter else self.latency
+        if reliable:
+            return [delay]
+        if self.loss and rng.random() < self.loss:
+            return []
+        if self.late and rng.random() < self.late:
+            delay += self.late_delay
+        if self.duplicate and rng.random() < self.duplicate:
+            return [delay, delay + self.latency]
+        return [delay]
+
+
+class EmulatedBulb(object):
+    """
+    State and request handling of one emulated bulb.
+
+    The light state is kept like on the device: when the bulb is off its
+    colour values are reported in `dft_on_state`. Methods listed in
+    `errors` answer with the error code, and any method fails with
+    probability `error_rate`.
+    """
+
+    reboot_time = 1.0
+
+    def __init__(self, index=0, address=None, rng=None, error_rate=0.0):
+        self.index = index
+        self.address = address
+        self.error_rate = error_rate
+        # Dict of `(module, method)` to error code
+        self.errors = {}
+        self.requests = 0
+        self.rng = rng or random.Random(index)
+
+        device_id = hashlib.sha1(f'tplight-emulator-{index}'.encode()).hexdigest().upper()
+        self.sysinfo = {
+            'sw_ver': '1.5.5 Build 170623 Rel.090105',
+            'hw_ver': '1.0',
+            'model': 'LB130(EU)',
+            'description': 'Smart Wi-Fi LED Bulb with Color Changing',
+            'alias': f'Bulb {index}',
+            'mic_type': 'IOT.SMARTBULB',
+            'dev_state': 'normal',
+            'mic_mac': '50C7BF' + device_id[:6],
+            'deviceId': device_id,
+            'oemId': 'D5C424D3C480911C980ECDD56C27988F',
+            'hwId': '111E35908497A05512E259BB76801E10',
+            'is_factory': False,
+            'disco_ver': '1.0',
+            'ctrl_protocols': {'name': 'Linkie', 'version': '1.0'},
+            'is_dimmable': 1,
+            'is_color': 1,
+            'is_variable_color_temp': 1,
+            'preferred_state': [
+                {'index': 0, 'hue': 0, 'saturation': 0, 'color_temp': 2700, 'brightness': 50},
+                {'index': 1, 'hue': 0, 'saturation': 75, 'color_temp': 0, 'brightness': 100},
+                {'index': 2, 'hue': 120, 'saturation': 75, 'color_temp': 0, 'brightness': 100},
+                {'index': 3, 'hue': 240, 'saturation': 75, 'color_temp': 0, 'brightness': 100},
+            ],
+            'rssi': -57,
+            'active_mode': 'none',
+            'heapsize': 316848,
+        }
+        self.light_details = {
+            'lamp_beam_angle': 150,
+            'min_voltage': 110,
+            'max_voltage': 120,
+            'wattage': 10,
+            'incandescent_equivalent': 60,
+            'max_lumens': 800,
+            'color_rendering_index': 80,
+        }
+        self.on_off = 1
+        self.light = {
+            'mode': 'normal', 'hue': 30, 'saturation': 100, 'color_temp': 0, 'brightness': 7
+        }
+        self.time_offset = 0.0
+        self.timezone = 39
+        self.rules = []
+        self.schedule_enabled = 1
+        self.__down_until = 0.0
+        self.__handlers = {
+            protocol.SYSTEM: {
+                'get_sysinfo': self.get_sysinfo,
+                'set_dev_alias': self.set_dev_alias,
+                'reboot': self.reboot,
+            },
+            protocol.COMMON_SYSTEM: {
+                'set_dev_alias': self.set_dev_alias,
+                'reboot': self.reboot,
+            },
+            protocol.LIGHTING: {
+                'get_light_state': self.get_light_state,
+                'transition_light_state': self.transition_light_state,
+                'get_light_details': lambda args: dict(self.light_details),
+                'get_default_behavior': lambda args: {
+                    'soft_on': {'mode': 'last_status'}, 'hard_on': {'mode': 'last_status'}
+                },
+            },
+            protocol.TIMESETTING: {
+                'get_time': lambda args: protocol._date_fields(self.now()),
+                'set_time': self.set_time,
+                'get_timezone': lambda args: {'index': self.timezone},
+                'set_timezone': self.set_timezone,
+            },
+            protocol.SCHEDULE: {
+                'get_rules': lambda args: {
+                    'rule_list': [dict(rule) for rule in self.rules],
+                    'enable': self.schedule_enabled,
+                },
+                'add_rule': self.add_rule,
+                'edit_rule': self.edit_rule,
+                'delete_rule': self.delete_rule,
+                'delete_all_rules': self.delete_all_rules,
+                'set_overall_enable': self.set_overall_enable,
+                'get_next_action': self.get_next_action,
+            },
+            protocol.EMETER: {
+                'get_realtime': lambda args: {
+                    'power_mw': self.light_details['wattage'] * 10 * self.light['brightness']
+                    if self.on_off else 0
+                },
+                'get_daystat': self.get_daystat,
+                'get_monthstat': self.get_monthstat,
+                'erase_emeter_stat': lambda args: {},
+            },
+        }
+
+    @property
+    def available(self):
+        """Check if the bulb answers, i.e. it is not rebooting."""
+        return time.monotonic() >= self.__down_until
+
+    def now(self):
+        """Get the local time of the device."""
+        return datetime.datetime.now().replace(microsecond=0) + datetime.timedelta(
+            seconds=round(self.time_offset)
+        )
+
+    def handle(self, request):
+        """Answer the request dict. Return the response dict."""
+        self.requests += 1
+        response = {}
+        for module, methods in request.items():
+            handlers = self.__handlers.get(module)
+            if handlers is None or not isinstance(methods, dict):
+                response[module] = self.__error(
+                    protocol.MODULE_NOT_SUPPORTED, 'module not support'
+                )
+                continue
+            replies = response[module] = {}
+            for method, args in methods.items():
+                replies[method] = self.__call(module, method, handlers.get(method), args)
+        return response
+
+    def __call(self, module, method, handler, args):
+        if handler is None:
+            return self.__error(protocol.METHOD_NOT_SUPPORTED, 'method not support')
+        if (module, method) in self.errors:
+            return self.__error(self.errors[(module, method)], 'emulated error')
+        if self.error_rate and self.rng.random() < self.error_rate:
+            return self.__error(protocol.INVALID_ARGUMENT, 'emulated error')
+        try:
+            reply = handler(args if isinstance(args, dict) else {})
+        except (KeyError, TypeError, ValueError) as e:
+            return self.__error(protocol.INVALID_ARGUMENT, f'invalid argument: {e}')
+        reply['err_code'] = 0
+        return reply
+
+    @staticmethod
+    def __error(code, message):
+        return {'err_code': code, 'err_msg': message}
+
+    def light_state(self):
+        """Get the light state as reported by the device."""
+        if self.on_off:
+            return dict(self.light, on_off=1)
+        return {'on_off': 0, 'dft_on_state': dict(self.light)}
+
+    def get_sysinfo(self, args):
+        return dict(self.sysinfo, light_state=self.light_state())
+
+    def get_light_state(self, args):
+        return self.light_state()
+
+    def transition_light_state(self, args):
+        limits = {
+            'hue': (0, 360),
+            'saturation': (0, 100),
+            'brightness': (0, 100),
+            'color_temp': (2500, 9000),
+        }
+        for name, (low, high) in limits.items():
+            if name in args:
+                value = int(args[name])
+                if not (low <= value <= high or (name == 'color_temp' and value == 0)):
+                    raise ValueError(name)
+        if 'on_off' in args:
+            if int(args['on_off']) not in (0, 1):
+                raise ValueError('on_off')
+            self.on_off = int(args['on_off'])
+        for name in limits:
+            if name in args:
+                self.light[name] = int(args[name])
+        if 'mode' in args:
+            self.light['mode'] = str(args['mode'])
+        return self.light_state()
+
+    def set_dev_alias(self, args):
+        self.sysinfo['alias'] = str(args['alias'])
+        return {}
+
+    def reboot(self, args):
+        self.__down_until = time.monotonic() + float(args.get('delay', 1)) + self.reboot_time
+        return {}
+
+    def set_time(self, args):
+        date = datetime.datetime(
+            args['year'], args['month'], args['mday'], args['hour'], args['min'], args['sec']
+        )
+        self.time_offset = (date - datetime.datetime.now()).total_seconds()
+        return {}
+
+    def set_timezone(self, args):
+        index = int(args['index'])
+        if not protocol.MIN_TIMEZONE <= index <= protocol.MAX_TIMEZONE:
+            raise ValueError('index')
+        self.timezone = index
+        if 'year' in args:
+            self.set_time(args)
+        return {}
+
+    def add_rule(self, args):
+        rule = dict(args, id=uuid.UUID(int=self.rng.getrandbits(128)).hex.upper())
+        self.rules.append(rule)
+        return {'id': rule['id']}
+
+    def edit_rule(self, args):
+        rule = self.__rule(args['id'])
+        rule.update(args)
+        return {}
+
+    def delete_rule(self, args):
+        self.rules.remove(self.__rule(args['id']))
+        return {}
+
+    def delete_all_rules(self, args):
+        self.rules.clear()
+        return {}
+
+    def set_overall_enable(self, args):
+        self.schedule_enabled = int(args['enable'])
+        return {}
+
+    def get_next_action(self, args):
+        """Find the next enabled rule by its weekday and start minute."""
+        if not self.schedule_enabled:
+            return {'type': -1}
+        now = self.now()
+        minute = now.hour * 60 + now.minute
+        best = None
+        for rule in self.rules:
+            if not rule.get('enable', 1):
+                continue
+            for days in range(8):
+                # `wday` starts from Sunday
+                weekday = (now.weekday() + 1 + days) % 7
+                if rule.get('wday', [1] * 7)[weekday] and (days or rule.get('smin', 0) > minute):
+                    wait = days * 1440 + rule.get('smin', 0) - minute
+                    if best is None or wait < best[0]:
+                        best = (wait, rule)
+                    break
+        if best is None:
+            return {'type': -1}
+        wait, rule = best
+        return {
+            'type': 1,
+            'id': rule['id'],
+            'schd_sec': rule.get('smin', 0) * 60,
+            'day': (now + datetime.timedelta(minutes=wait)).day,
+            'action': rule.get('sact', -1),
+        }
+
+    def energy_wh(self, date):
+        """Get the emulated energy use of the day. Stable for the bulb and the day."""
+        seed = f'{self.sysinfo["deviceId"]}-{date.isoformat()}'
+        daily = random.Random(seed).randint(0, self.light_details['wattage'] * 8)
+        return daily if date <= self.now().date() else 0
+
+    def get_daystat(self, args):
+        year, month = int(args['year']), int(args['month'])
+        days = calendar.monthrange(year, month)[1]
+        today = self.now().date()
+        return {'day_list': [
+            {'year': year, 'month': month, 'day': date.day, 'energy_wh': self.energy_wh(date)}
+            for date in (datetime.date(year, month, day) for day in range(1, days + 1))
+            if date <= today
+        ]}
+
+    def get_monthstat(self, args):
+        year = int(args['year'])
+        today = self.now().date()
+        month_list = []
+        for month in range(1, 13):
+            if datetime.date(year, month, 1) > today:
+                break
+            energy = self.get_daystat({'year': year, 'month': month})['day_list']
+            month_list.append({
+                'year': year, 'month': month, 'energy_wh': sum(d['energy_wh'] for d in energy)
+            })
+        return {'month_list': month_list}
+
+    def __rule(self, rule_id):
+        for rule in self.rules:
+            if rule['id'] == rule_id:
+                return rule
+        raise KeyError(rule_id)
+
+
+class _DatagramServer(asyncio.DatagramProtocol):
+    """UDP endpoint of one emulated bulb."""
+
+    def __init__(self, emulator, bulb):
+        self.emulator = emulator
+        self.bulb = bulb
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        response = self.emulator._answer(self.bulb, data)
+        if response is None:
+            return
+        loop = asyncio.get_running_loop()
+        for delay in self.emulator.conditions.delays(self.emulator.rng):
+            if delay > 0:
+                loop.call_later(delay, self.__send, response, addr)
+            else:
+                self.__send(response, addr)
+
+    def __send(self, data, addr):
+        if not self.transport.is_closing():
+            self.transport.sendto(data, addr)
+
+
+class Emulator(object):
+    """
+    Many emulated LB130 bulbs served from a background thread.
+
+    Every bulb listens on its own address: with a single `host` the bulbs
+    take consecutive ports from `port`, or ephemeral ports if `port` is 0.
+    With a network like `127.1.0.0/16` every bulb gets its own loopback
+    address and the same `port`, as real bulbs do.
+    """
+
+    __header = struct.Struct('>I')
+
+    def __init__(
+        self,
+        count=1,
+        host='127.0.0.1',
+        port=0,
+        tcp=False,
+        conditions=None,
+        seed=None,
+        error_rate=0.0,
+    ):
+        """
+        Initialise the bulbs. Call `start()` or use as context manager to serve them.
+
+        Args:
+            count: Number of bulbs.
+            host: IP address to listen on, or a network to take an address
+                for every bulb from.
+            port: First UDP port, also used for TCP. 0 for ephemeral ports.
+            tcp: Serve the length-prefixed TCP protocol too.
+            conditions: `NetworkConditions` of the replies.
+            seed: Seed of the random generators, for reproducible runs.
+            error_rate: Probability of an error reply to every method.
+        """
+        self.tcp = tcp
+        self.conditions = conditions or NetworkConditions()
+        self.rng = random.Random(seed)
+        if '/' in host:
+            hosts = ipaddress.ip_network(host).hosts()
+            binds = [(str(next(hosts)), port) for _ in range(count)]
+        else:
+            binds = [(host, port + i if port else 0) for i in range(count)]
+        self.bulbs = [
+            EmulatedBulb(
+                i, address, random.Random(None if seed is None else f'{seed}-{i}'), error_rate
+            )
+            for i, address in enumerate(binds)
+        ]
+        self.__loop = None
+        self.__thread = None
+        self.__stopped = None
+        self.__servers = []
+        self.__streams = {}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def __len__(self):
+        return len(self.bulbs)
+
+    @property
+    def addresses(self):
+        """Get `(ip, port)` of every bulb, bound to the actual ports after the start."""
+        return [bulb.address for bulb in self.bulbs]
+
+    def start(self):
+        """Serve the bulbs in a background thread. Return when all of them listen."""
+        if self.__thread is not None:
+            return self
+        started = threading.Event()
+        errors = []
+
+        def run():
+            self.__loop = asyncio.new_event_loop()
+            try:
+                self.__loop.run_until_complete(self.__run(started, errors))
+            finally:
+                self.__loop.close()
+                started.set()
+
+        self.__thread = threading.Thread(target=run, name='tplight-emulator', daemon=True)
+        self.__thread.start()
+        started.wait()
+        if errors:
+            self.__thread.join()
+            self.__thread = None
+            raise errors[0]
+        return self
+
+    def stop(self):
+        """Stop serving and close the sockets."""
+        if self.__thread is None:
+            return
+        self.__loop.call_soon_threadsafe(self.__stopped.set)
+        self.__thread.join()
+        self.__thread = None
+
+    async def serve(self):
+        """Serve the bulbs on the running event loop until cancelled."""
+        try:
+            await self.__open()
+            await asyncio.Event().wait()
+        finally:
+            self.__close()
+
+    async def __run(self, started, errors):
+        self.__stopped = asyncio.Event()
+        try:
+            await self.__open()
+        except OSError as e:
+            errors.append(e)
+            self.__close()
+            return
+        started.set()
+        try:
+            await self.__stopped.wait()
+        finally:
+            streams = self.__close()
+            await asyncio.gather(*streams, return_exceptions=True)
+
+    async def __open(self):
+        """Create the sockets of all bulbs."""
+        loop = asyncio.get_running_loop()
+        for bulb in self.bulbs:
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: _DatagramServer(self, bulb), local_addr=bulb.address
+            )
+            self.__servers.append(transport)
+            bulb.address = transport.get_extra_info('sockname')[:2]
+            if self.tcp:
+                server = await asyncio.start_server(
+                    lambda r, w, bulb=bulb: self.__serve_stream(bulb, r, w), *bulb.address
+                )
+                self.__servers.append(server)
+        logging.debug('Emulating %d bulbs', len(self.bulbs))
+
+    def __close(self):
+        """Close the sockets and the TCP connections. Return tasks serving the connections."""
+        for server in self.__servers:
+            server.close()
+        self.__servers = []
+        streams, self.__streams = self.__streams, {}
+        for writer in streams.values():
+            writer.close()
+        return list(streams)
+
+    def _answer(self, bulb, data):
+        """Decrypt the request, handle it and encrypt the response. None if no reply."""
+        if not bulb.available:
+            return None
+        try:
+            request = json.loads(codec.decrypt(bytes(data)))
+        except ValueError:
+            logging.debug('Ignored malformed request to %s', bulb.address)
+            return None
+        if not isinstance(request, dict):
+            return None
+        response = json.dumps(bulb.handle(request), separators=(',', ':'))
+        return codec.encrypt(response.encode('latin_1'))
+
+    async def __serve_stream(self, bulb, reader, writer):
+        """Answer length-prefixed requests of one TCP connection in order."""
+        task = asyncio.current_task()
+        self.__streams[task] = writer
+        try:
+            while True:
+                header = await reader.readexactly(self.__header.size)
+                data = await reader.readexactly(self.__header.unpack(header)[0])
+                response = self._answer(bulb, data)
+                if response is None:
+                    continue
+                (delay,) = self.conditions.delays(self.rng, reliable=True)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                writer.write(self.__header.pack(len(response)) + response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.__streams.pop(task, None)
+            writer.close()
+
+
+def main():
+    p = argparse.ArgumentParser(description='Serve emulated LB130 bulbs.')
+    p.add_argument('--count', '-n', type=int, default=1, help='Number of bulbs')
+    p.add_argument(
+        '--host', default='127.0.0.1', help='Address to listen on or a network of addresses'
+    )
+    p.add_argument('--port', '-p', type=int, default=9999, help='First port, 0 for ephemeral')
+    p.add_argument('--tcp', action='store_true', help='Serve TCP too')
+    p.add_argument('--latency', type=float, default=0.0, help='Reply delay in seconds')
+    p.add_argument('--jitter', type=float, default=0.0, help='Random extra delay in seconds')
+    p.add_argument('--loss', type=float, default=0.0, help='Probability of a lost reply')
+    p.add_argument(
+        '--duplicate', type=float, default=0.0, help='Probability of a duplicated reply'
+    )
+    p.add_argument('--late', type=float, default=0.0, help='Probability of a late reply')
+    p.add_argument('--error-rate', type=float, default=0.0, help='Probability of an error reply')
+    p.add_argument('--seed', type=int, help='Random seed')
+    args = p.parse_args()
+
+    emulator = Emulator(
+        args.count,
+        args.host,
+        args.port,
+        tcp=args.tcp,
+        conditions=NetworkConditions(
+            args.latency, args.jitter, args.loss, args.duplicate, args.late
+        ),
+        seed=args.seed,
+        error_rate=args.error_rate,
+    )
+    with emulator:
+        for ip, port in emulator.addresses:
+            print(f'{ip}:{port}')
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
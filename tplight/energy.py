@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Energy use history of many bulbs.
+
+`EnergyCollector` fetches the daily or monthly energy use of the bulbs in
+concurrent `BulbGroup` sweeps and returns it as an `EnergyTable` of array
+columns. Completed months and years are kept in `EnergyCache` on disk and
+never fetched again, so a daily report costs one sweep for the current month:
+
+    with EnergyCollector(ips, EnergyCache()) as collector:
+        table = collector.days(datetime.date.today() - datetime.timedelta(days=1))
+    print(table.totals())
+"""
+
+import array
+import datetime
+import os
+
+from . import protocol
+from .cache import default_cache_dir, read_json, write_json_atomic
+from .fleet import BulbGroup
+
+
+class EnergyTable(object):
+    """
+    Energy use rows in array columns.
+
+    Attributes:
+        kind: `day` or `month`.
+        bulbs: List of the bulb labels, indexed by the `bulb` column.
+        bulb: Array of the bulb indexes of the rows.
+        period: Array of the periods of the rows: `date.toordinal()` of the
+            days or `year * 12 + month - 1` of the months.
+        energy_wh: Array of the energy used in the period in Wh.
+        errors: Dict of bulb to the exception of the bulbs without history.
+    """
+
+    def __init__(self, kind, bulbs=()):
+        if kind not in ('day', 'month'):
+            raise ValueError('kind should be day or month.')
+        self.kind = kind
+        self.bulbs = list(bulbs)
+        self.bulb = array.array('I')
+        self.period = array.array('l')
+        self.energy_wh = array.array('l')
+        self.errors = {}
+
+    def __len__(self):
+        return len(self.energy_wh)
+
+    def __iter__(self):
+        return self.rows()
+
+    def append(self, bulb, period, energy_wh):
+        """Add the row of the bulb index, period number and energy."""
+        self.bulb.append(bulb)
+        self.period.append(period)
+        self.energy_wh.append(energy_wh)
+
+    def date(self, period):
+        """Get `datetime.date` of the period number, the first day of the months."""
+        if self.kind == 'day':
+            return datetime.date.fromordinal(period)
+        return datetime.date(period // 12, period % 12 + 1, 1)
+
+    def rows(self):
+        """Iterate `(bulb label, date, energy in Wh)` of the rows."""
+        for bulb, period, energy_wh in zip(self.bulb, self.period, self.energy_wh):
+            yield self.bulbs[bulb], self.date(period), energy_wh
+
+    def totals(self):
+        """Get dict of bulb label to the energy used in all rows in Wh."""
+        totals = dict.fromkeys(self.bulbs, 0)
+        for bulb, energy_wh in zip(self.bulb, self.energy_wh):
+            totals[self.bulbs[bulb]] += energy_wh
+        return totals
+
+    def to_numpy(self):
+        """
+        Export the columns as NumPy arrays.
+
+        Returns:
+            Dict of `bulb` indexes, `date` as `datetime64` of days or months
+            and `energy_wh` arrays.
+        """
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError('Install NumPy to export the energy table') from None
+
+        def column(values, kind):
+            return numpy.frombuffer(values, dtype=f'{kind}{values.itemsize}').astype(numpy.int64)
+
+        if self.kind == 'day':
+            dates = column(self.period, 'i') - datetime.date(1970, 1, 1).toordinal()
+            dates = dates.astype('datetime64[D]')
+        else:
+            dates = (column(self.period, 'i') - 1970 * 12).astype('datetime64[M]')
+        return {
+            'bulb': column(self.bulb, 'u'),
+            'date': dates,
+            'energy_wh': column(self.energy_wh, 'i'),
+        }
+
+    def to_pandas(self):
+        """Export the rows as `pandas.DataFrame` with `bulb`, `date` and `energy_wh` columns."""
+        try:
+            import pandas
+        except ImportError:
+            raise ImportError('Install pandas to export the energy table') from None
+        columns = self.to_numpy()
+        return pandas.DataFrame({
+            'bulb': pandas.Categorical.from_codes(columns['bulb'], self.bulbs),
+            'date': columns['date'],
+            'energy_wh': columns['energy_wh'],
+        })
+
+
+class EnergyCache(object):
+    """
+    Energy use of the completed months and years keyed by `deviceId`, so
+    the history stays with the bulb when its address changes.
+
+    The file holds the daily values of every completed month and the
+    monthly values of every completed year of the bulbs.
+    """
+
+    file_name = 'energy.json'
+
+    def __init__(self, path=None):
+        """
+        Initialise the cache.
+
+        Args:
+            path: Path of the cache file. `energy.json` in the user cache
+                directory by default.
+        """
+        self.path = path or os.path.join(default_cache_dir(), self.file_name)
+        self.__data = None
+
+    def lookup(self, device_id, kind, key):
+        """
+        Get the cached values.
+
+        Args:
+            device_id: `deviceId` of the bulb.
+            kind: `day` for the days of a month or `month` for the months of a year.
+            key: `YYYY-MM` of the month or `YYYY` of the year.
+
+        Returns:
+            Dict of day or month number to energy in Wh or None.
+        """
+        values = self.__load().get(device_id, {}).get(kind, {}).get(key)
+        if values is None:
+            return None
+        return {int(number): energy_wh for number, energy_wh in values.items()}
+
+    def store(self, entries):
+        """
+        Save the values.
+
+        Args:
+            entries: Iterable of `(device_id, kind, key, values)` tuples with
+                the arguments of `lookup` and its result.
+        """
+        entries = list(entries)
+        if not entries:
+            return
+        data = self.__read()
+        for device_id, kind, key, values in entries:
+            data.setdefault(device_id, {}).setdefault(kind, {})[key] = {
+                str(number): energy_wh for number, energy_wh in values.items()
+            }
+        self.__data = data
+        write_json_atomic(self.path, data)
+
+    def __load(self):
+        """Get the cache content, reading the file on first use."""
+        if self.__data is None:
+            self.__data = self.__read()
+        return self.__data
+
+    def __read(self):
+        """Read the cache file. Return empty content if it is missing or broken."""
+        data = read_json(self.path)
+        return data if data is not None else {}
+
+
+class EnergyCollector(object):
+    """
+    Collect the energy use history of many bulbs at once.
+
+    Every sweep sends each bulb one `get_daystat` or `get_monthstat`
+    request, so the history of many months takes one sweep per month still
+    to fetch. Months and years before the current one are complete: they
+    are taken from the cache if it has them and stored in it otherwise.
+    The cache is looked up by the `deviceId` from the sysinfo sent with the
+    first request of every bulb.
+    """
+
+    def __init__(self, bulbs, cache=None, group=None):
+        """
+        Initialise the collector.
+
+        Args:
+            bulbs: Iterable of bulbs accepted by `BulbGroup`.
+            cache: `EnergyCache` of the completed periods. Nothing is cached
+                if not provided.
+            group: `BulbGroup` of the bulbs to send through. Created for the
+                bulbs if not provided, and closed with the collector then.
+        """
+        self.__own_group = group is None
+        self.group = BulbGroup(bulbs) if group is None else group
+        self.cache = cache
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the group created by the collector."""
+        if self.__own_group:
+            self.group.close()
+
+    def days(self, start, end=None, today=None):
+        """
+        Get the daily energy use of the bulbs.
+
+        Args:
+            start: First `datetime.date`.
+            end: Last `datetime.date`, `today` by default.
+            today: Current date deciding the completed months. Taken from
+                the host clock by default.
+
+        Returns:
+            `EnergyTable` of the days the bulbs report, by bulb and date.
+        """
+        today = today or datetime.date.today()
+        end = min(end or today, today)
+        months = []
+        year, month = start.year, start.month
+        while (year, month) <= (end.year, end.month):
+            months.append((year, month))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+        table = EnergyTable('day', map(self.__label, self.group.bulbs))
+        history = self.__collect(
+            'day', months, (today.year, today.month),
+            lambda key: protocol.daystat_request(*key),
+            lambda response: {
+                date.day: energy_wh
+                for date, energy_wh in protocol.parse_daystat(response).items()
+            },
+            lambda key: f'{key[0]:04d}-{key[1]:02d}', table.errors,
+        )
+        first, last = start.toordinal(), end.toordinal()
+        for index, bulb in enumerate(self.group.bulbs):
+            for (year, month), values in sorted(history.get(bulb, {}).items()):
+                for day, energy_wh in sorted(values.items()):
+                    period = datetime.date(year, month, day).toordinal()
+                    if first <= period <= last:
+                        table.append(index, period, energy_wh)
+        return table
+
+    def months(self, start_year, end_year=None, today=None):
+        """
+        Get the monthly energy use of the bulbs.
+
+        Args:
+            start_year: First year.
+            end_year: Last year, the current one by default.
+            today: Current date deciding the completed years. Taken from
+                the host clock by default.
+
+        Returns:
+            `EnergyTable` of the months the bulbs report, by bulb and month.
+        """
+        today = today or datetime.date.today()
+        end_year = min(end_year or today.year, today.year)
+        table = EnergyTable('month', map(self.__label, self.group.bulbs))
+        history = self.__collect(
+            'month', list(range(start_year, end_year + 1)), today.year,
+            protocol.monthstat_request,
+            protocol.parse_monthstat,
+            lambda key: f'{key:04d}', table.errors,
+        )
+        for index, bulb in enumerate(self.group.bulbs):
+            for year, values in sorted(history.get(bulb, {}).items()):
+                for month, energy_wh in sorted(values.items()):
+                    table.append(index, year * 12 + month - 1, energy_wh)
+        return table
+
+    def __label(self, bulb):
+        ip, port = self.group.address(bulb)
+        return ip if port == 9999 else f'{ip}:{port}'
+
+    def __collect(self, kind, keys, current, request, parse, cache_key, errors):
+        """
+        Get the values of the periods, from the cache or from the bulbs.
+
+        With a cache, the first request of every bulb asks for its sysinfo
+        too, the cached periods are looked up by its `deviceId`.
+
+        Returns:
+            Dict of bulb to dict of period key to dict of number to energy.
+        """
+        history = {bulb: {} for bulb in self.group.bulbs}
+        device_ids = {}
+        if self.cache is None:
+            pending = {bulb: list(keys) for bulb in self.group.bulbs}
+        else:
+            # Periods not complete yet are fetched whatever the cache holds
+            pending = {bulb: [key for key in keys if key >= current] for bulb in history}
+            requests = {}
+            for bulb, bulb_keys in pending.items():
+                requests[bulb] = dict(protocol.GET_SYSINFO)
+                if bulb_keys:
+                    requests[bulb].update(request(bulb_keys[0]))
+            for bulb, response in self.group.fetch_each(requests).items():
+                if isinstance(response, Exception):
+                    self.__fail(bulb, response, history, pending, errors)
+                    continue
+                if pending[bulb]:
+                    history[bulb][pending[bulb].pop(0)] = parse(response)
+                device_id = protocol.parse_device_info(response).get('deviceId')
+                if device_id is not None:
+                    device_ids[bulb] = device_id
+                for key in keys:
+                    if key >= current:
+                        continue
+                    cached = None
+                    if device_id is not None:
+                        cached = self.cache.lookup(device_id, kind, cache_key(key))
+                    if cached is None:
+                        pending[bulb].append(key)
+                    else:
+                        history[bulb][key] = cached
+            pending = {bulb: bulb_keys for bulb, bulb_keys in pending.items() if bulb_keys}
+
+        completed = []
+        while pending:
+            requests = {bulb: request(bulb_keys[0]) for bulb, bulb_keys in pending.items()}
+            for bulb, response in self.group.fetch_each(requests).items():
+                if isinstance(response, Exception):
+                    self.__fail(bulb, response, history, pending, errors)
+                    continue
+                key = pending[bulb].pop(0)
+                values = history[bulb][key] = parse(response)
+                if bulb in device_ids and key < current:
+                    completed.append((device_ids[bulb], kind, cache_key(key), values))
+                if not pending[bulb]:
+                    del pending[bulb]
+        if self.cache is not None:
+            self.cache.store(completed)
+        return history
+
+    @staticmethod
+    def __fail(bulb, error, history, pending, errors):
+        """Drop the history of the bulb which failed to answer."""
+        errors[bulb] = error
+        history.pop(bulb, None)
+        pending.pop(bulb, None)
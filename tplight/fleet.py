@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""Control of many LB130 bulbs at once."""
+
+import logging
+import socket
+import time
+
+from . import metrics
+from . import protocol
+from .retry import AdaptiveRetryPolicy
+from .tplight import LB130
+from .transport import DatagramTruncated, receive_into
+
+
+class SyncReport(object):
+    """
+    Outcome of `BulbGroup.transite_synchronized`.
+
+    Times are `time.monotonic()` values. The start of a bulb is estimated as
+    the send of its acknowledged request plus half of the round trip time.
+
+    Attributes:
+        results: Dict of bulb to None on success or the exception.
+        at: Requested time of the burst or None.
+        burst_start: Time of the first send of the burst.
+        burst_end: Time of the last send of the burst.
+        starts: Dict of the acknowledged bulbs to their estimated start.
+        ends: Dict of the acknowledged bulbs to their estimated transition end.
+        periods: Dict of the acknowledged bulbs to the `transition_period`
+            of their acknowledged request, shortened for the retried bulbs.
+        attempts: Dict of bulb to the number of sends.
+    """
+
+    def __init__(self, at):
+        self.results = {}
+        self.at = at
+        self.burst_start = None
+        self.burst_end = None
+        self.starts = {}
+        self.ends = {}
+        self.periods = {}
+        self.attempts = {}
+
+    def __repr__(self):
+        return (
+            f'<SyncReport ok:{len(self.starts)}/{len(self.results)}'
+            f' burst:{self.burst * 1000:.2f}ms start_skew:{self.start_skew * 1000:.2f}ms'
+            f' end_skew:{self.end_skew * 1000:.2f}ms retried:{len(self.retried)}>'
+        )
+
+    @property
+    def burst(self):
+        """Get seconds between the first and the last send of the burst."""
+        if self.burst_start is None:
+            return 0.0
+        return self.burst_end - self.burst_start
+
+    @property
+    def lateness(self):
+        """Get seconds the burst started after `at`, 0.0 without `at`."""
+        if self.at is None or self.burst_start is None:
+            return 0.0
+        return max(0.0, self.burst_start - self.at)
+
+    @property
+    def start_skew(self):
+        """Get seconds between the first and the last estimated start."""
+        return max(self.starts.values(), default=0.0) - min(self.starts.values(), default=0.0)
+
+    @property
+    def end_skew(self):
+        """Get seconds between the first and the last estimated transition end."""
+        return max(self.ends.values(), default=0.0) - min(self.ends.values(), default=0.0)
+
+    @property
+    def retried(self):
+        """Get the list of bulbs sent more than once."""
+        return [bulb for bulb, attempts in self.attempts.items() if attempts > 1]
+
+
+class BulbGroup(object):
+    """
+    Send the same command to many bulbs over one UDP socket.
+
+    Replies are matched to the bulbs by their source address. Retries go only
+    to the bulbs which have not answered yet, so the whole group costs about
+    one round trip. Every bulb has its own retry policy and timer: `LB130`
+    objects share theirs with the group, other bulbs get a new one.
+
+    Results are dicts keyed by the bulbs as they were passed to the group.
+    """
+
+    encryption_key = LB130.encryption_key
+    port = 9999
+    buffer_size = 4096
+
+    def __init__(self, bulbs, retry_policy_factory=AdaptiveRetryPolicy):
+        """
+        Initialise the group.
+
+        Args:
+            bulbs: Iterable of bulb IP addresses, `(ip, port)` tuples or
+                `LB130` objects.
+            retry_policy_factory: Callable creating `RetryPolicy` for the
+                bulbs given by address.
+        """
+        self.bulbs = []
+        self.__addresses = {}
+        self.__policies = {}
+        for bulb in bulbs:
+            if bulb not in self.__addresses:
+                self.bulbs.append(bulb)
+                address = self.__addresses[bulb] = self.__address(bulb)
+                if isinstance(bulb, LB130):
+                    self.__policies[address] = bulb.retry_policy
+                else:
+                    self.__policies[address] = retry_policy_factory()
+        self.__transition_period = 0
+        self.__socket = None
+        self.__buffer = bytearray(self.buffer_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.bulbs)
+
+    def close(self):
+        """Close the socket of the group."""
+        if self.__socket is not None:
+            self.__socket.close()
+            self.__socket = None
+
+    @property
+    def transition_period(self):
+        """Get the group transition period."""
+        return self.__transition_period
+
+    @transition_period.setter
+    def transition_period(self, period):
+        """Set the group transition period."""
+        self.__transition_period = self.__check_period(period)
+
+    def address(self, bulb):
+        """Get `(ip, port)` of the bulb of the group."""
+        return self.__addresses[bulb]
+
+    def retry_policy(self, bulb):
+        """Get the retry policy of the bulb with its statistics."""
+        return self.__policies[self.__addresses[bulb]]
+
+    def transite_light_state(self, **kwargs):
+        """
+        Transite all bulbs to the same state.
+
+        Accepts the same keyword arguments as `LB130.transite_light_state`
+        except `synchronous`.
+
+        Returns:
+            Dict of bulb to None on success or the exception.
+        """
+        if 'transition_period' in kwargs:
+            self.transition_period = kwargs['transition_period']
+        data = protocol.transition_request(LB130, self.__transition_period, kwargs)
+        return {
+            bulb: result if isinstance(result, Exception) else None
+            for bulb, result in self.fetch_dict(data).items()
+        }
+
+    def transite_synchronized(self, states=None, at=None, **kwargs):
+        """
+        Start the transitions of the bulbs at the same time.
+
+        Every request is encoded before the first one is sent, then all are
+        sent in one burst, at `at` if given. Replies and retries are handled
+        after the burst. A retried request gets `transition_period` shortened
+        by the time since the burst, so the bulbs still end together.
+
+        Args:
+            states: Dict of bulb to its own `LB130.transite_light_state`
+                keyword arguments, merged over `kwargs`. Only these bulbs
+                are sent to if given, otherwise all bulbs of the group.
+            at: `time.monotonic()` time to send the burst at.
+            kwargs: State of all bulbs. Accepts the same keyword arguments as
+                `LB130.transite_light_state` except `synchronous`.
+
+        Returns:
+            `SyncReport` with the results and the achieved skew.
+        """
+        if states is None:
+            states = dict.fromkeys(self.bulbs, {})
+        states = {bulb: dict(kwargs, **state) for bulb, state in states.items()}
+        # All periods are checked before anything is encoded or sent
+        for state in states.values():
+            state['transition_period'] = self.__check_period(
+                state.get('transition_period', self.__transition_period)
+            )
+        requests = {}
+        periods = {}
+        messages = {}
+        for bulb, state in states.items():
+            period = state.pop('transition_period')
+            state.pop('synchronous', None)
+            start = time.perf_counter()
+            data = protocol.transition_request(LB130, period, state)
+            address = self.__addresses[bulb]
+            requests[address] = data
+            periods[address] = data[protocol.LIGHTING]['transition_light_state'][
+                'transition_period'
+            ]
+            messages[address] = (
+                protocol.encode(data, self.encryption_key), data, time.perf_counter() - start
+            )
+        sent_periods = dict(periods)
+
+        def resend(address, elapsed):
+            # The bulb may have started already, the shorter transition ends on time anyway
+            data = requests[address]
+            request = dict(data[protocol.LIGHTING]['transition_light_state'])
+            request['transition_period'] = max(0, periods[address] - round(elapsed * 1000))
+            sent_periods[address] = request['transition_period']
+            return protocol.encode(
+                {protocol.LIGHTING: {'transition_light_state': request}},
+                self.encryption_key,
+                cache=False,
+            )
+
+        sends = {}
+        events = {}
+        results = self.__fetch_data(messages, at, resend, sends, events)
+
+        report = SyncReport(at)
+        first_sends = [times[0] for times in sends.values()]
+        if first_sends:
+            report.burst_start = min(first_sends)
+            report.burst_end = max(first_sends)
+        for bulb in states:
+            address = self.__addresses[bulb]
+            result = results[address]
+            report.results[bulb] = result if isinstance(result, Exception) else None
+            report.attempts[bulb] = len(sends.get(address, ()))
+            rtt = events[address].rtt
+            if rtt is not None and not isinstance(result, Exception):
+                report.starts[bulb] = sends[address][-1] + rtt / 2
+                report.periods[bulb] = sent_periods[address]
+                report.ends[bulb] = report.starts[bulb] + sent_periods[address] / 1000
+        return report
+
+    def on(self):
+        """Set all bulbs to an ON state."""
+        return self.transite_light_state(on_off=1)
+
+    def off(self):
+        """Set all bulbs to an OFF state."""
+        return self.transite_light_state(on_off=0)
+
+    def status(self):
+        """
+        Get sysinfo of all bulbs.
+
+        Returns:
+            Dict of bulb to sysinfo dict or the exception.
+        """
+        return self.fetch_dict(protocol.GET_SYSINFO)
+
+    def fetch_dict(self, data, bulbs=None):
+        """
+        Send the request dict to the bulbs and collect the responses.
+
+        Args:
+            data: Request dict.
+            bulbs: Bulbs of the group to send to. All of them by default.
+
+        Returns:
+            Dict of bulb to response dict or the exception.
+        """
+        start = time.perf_counter()
+        enc_message = protocol.encode(data, self.encryption_key)
+        # The message is encoded once for all bulbs
+        if bulbs is None:
+            bulbs = self.bulbs
+        encode_time = (time.perf_counter() - start) / max(1, len(bulbs))
+        messages = {self.__addresses[bulb]: (enc_message, data, encode_time) for bulb in bulbs}
+        results = self.__fetch_data(messages)
+        return {bulb: results[self.__addresses[bulb]] for bulb in bulbs}
+
+    def fetch_each(self, requests):
+        """
+        Send every bulb its own request dict at once and collect the responses.
+
+        Args:
+            requests: Dict of bulb of the group to request dict.
+
+        Returns:
+            Dict of bulb to response dict or the exception.
+        """
+        messages = {}
+        for bulb, data in requests.items():
+            start = time.perf_counter()
+            enc_message = protocol.encode(data, self.encryption_key)
+            messages[self.__addresses[bulb]] = (
+                enc_message, data, time.perf_counter() - start
+            )
+        results = self.__fetch_data(messages)
+        return {bulb: results[self.__addresses[bulb]] for bulb in requests}
+
+    def __fetch_data(self, messages, at=None, resend=None, sends=None, events=None):
+        """
+        Send the encrypted requests to the bulbs. Return response dicts.
+
+        Args:
+            messages: Dict of address to `(encrypted request, request dict,
+                encode time)`.
+            at: `time.monotonic()` time to send the first requests at.
+            resend: Callable taking the address and seconds since its first
+                send, returning the encrypted request to retry with.
+            sends: Dict filled with address to list of send times.
+            events: Dict filled with address to `RequestEvent`.
+        """
+        sock = self.__open()
+        start = time.perf_counter()
+        results = {}
+        calls = {}
+        events = {} if events is None else events
+        sends = {} if sends is None else sends
+        sent_at = {}
+
+        def finish(address, result):
+            results[address] = result
+            event = events[address]
+            event.duration = time.perf_counter() - start
+            if isinstance(result, Exception):
+                event.fail(result)
+
+        for address, (_, request, encode_time) in messages.items():
+            event = events[address] = metrics.RequestEvent(request, address)
+            event.encode_time = encode_time
+            try:
+                calls[address] = self.__policies[address].begin()
+            except RuntimeError as e:
+                finish(address, e)
+        # Time of the next attempt of every bulb waiting for reply
+        timers = dict.fromkeys(calls, 0)
+        if at is not None:
+            wait_until(at)
+
+        while timers:
+            now = time.monotonic()
+            for address, next_at in list(timers.items()):
+                if next_at > now:
+                    continue
+                call = calls[address]
+                timeout = call.next_timeout()
+                if timeout is None:
+                    call.failed()
+                    finish(address, RuntimeError('Error connecting to bulb'))
+                    del timers[address]
+                    continue
+                if call.attempts > 1:
+                    logging.debug('Socket timed out for %s. Try %d', address, call.attempts)
+                events[address].attempts = call.attempts
+                if resend is not None and address in sends:
+                    enc_message = resend(address, now - sends[address][0])
+                else:
+                    enc_message = messages[address][0]
+                try:
+                    sock.sendto(enc_message, address)
+                except OSError as e:
+                    call.failed()
+                    finish(address, e)
+                    del timers[address]
+                    continue
+                sent_at[address] = time.perf_counter()
+                sends.setdefault(address, []).append(time.monotonic())
+                events[address].bytes_sent += len(enc_message)
+                timers[address] = now + timeout
+            if not timers:
+                break
+
+            wait = min(timers.values()) - time.monotonic()
+            if wait <= 0:
+                # Zero timeout would make the socket non-blocking
+                continue
+            sock.settimeout(wait)
+            try:
+                size, address = receive_into(sock, self.__buffer)
+            except DatagramTruncated as e:
+                # Retry right away, the reply fits now
+                self.__buffer = bytearray(e.buffer_size)
+                if e.address in timers:
+                    timers[e.address] = 0
+                continue
+            except socket.timeout:
+                continue
+            if address not in timers:
+                continue
+            received = time.perf_counter()
+            event = events[address]
+            event.bytes_received += size
+            request = messages[address][1]
+            response = protocol.read_reply(
+                memoryview(self.__buffer)[:size], request, self.encryption_key
+            )
+            event.decode_time += time.perf_counter() - received
+            if response is None:
+                logging.debug('Ignored unexpected datagram from %s', address)
+                continue
+            event.rtt = received - sent_at[address]
+            event.response = response
+            calls[address].succeeded()
+            del timers[address]
+            try:
+                protocol.check_reply(request, response)
+            except RuntimeError as e:
+                finish(address, e)
+            else:
+                finish(address, response)
+
+        if metrics.observers:
+            for event in events.values():
+                metrics.emit(event)
+        return results
+
+    @staticmethod
+    def __check_period(period):
+        """Check `transition_period` is in range. Return it."""
+        if LB130.min_transition_period <= period <= LB130.max_transition_period:
+            return period
+        raise ValueError(
+            '`transition_period` is out of range:'
+            f' {LB130.min_transition_period} to {LB130.max_transition_period}'
+        )
+
+    def __address(self, bulb):
+        """Get `(ip, port)` of the bulb."""
+        if isinstance(bulb, LB130):
+            return (bulb.ip_address, bulb.port)
+        if isinstance(bulb, tuple):
+            return bulb
+        return (bulb, self.port)
+
+    def __open(self):
+        """Create the socket if it is not open yet."""
+        if self.__socket is None:
+            self.__socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.__socket.bind(('0.0.0.0', 0))
+        return self.__socket
+
+
+def wait_until(deadline):
+    """Sleep until the `time.monotonic()` deadline, spinning over its last milliseconds."""
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        if remaining > 0.002:
+            time.sleep(remaining - 0.002)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Instrumentation of the requests sent to the bulbs.
+
+Every request of `LB130`, `AsyncLB130` and `BulbGroup` produces one
+`RequestEvent` passed to the observers registered with `observe()`, e.g. a
+`MetricsCollector`:
+
+    collector = tplight.metrics.observe(MetricsCollector())
+    ...
+    print(collector.prometheus())
+"""
+
+import bisect
+import logging
+import threading
+
+from . import protocol
+from .retry import BulbUnavailableError
+
+# Registered observers: callables taking `RequestEvent`
+observers = []
+
+
+def observe(observer):
+    """Register the observer of all requests. Return it, so it can be used as a decorator."""
+    observers.append(observer)
+    return observer
+
+
+def unobserve(observer):
+    """Unregister the observer."""
+    observers.remove(observer)
+
+
+def emit(event):
+    """Pass the event to the observers. Errors of the observers are logged."""
+    for observer in list(observers):
+        try:
+            observer(event)
+        except Exception:
+            logging.exception('Request observer %r failed', observer)
+
+
+class RequestEvent(object):
+    """
+    Outcome of one request to one bulb.
+
+    Attributes:
+        calls: List of `module.method` names of the request.
+        address: `(ip, port)` of the bulb.
+        transport: `udp` or `tcp`.
+        outcome: `ok`, `error` if the bulb returned an error code,
+            `timeout` if it did not answer, `unavailable` if the request was
+            not sent because the bulb did not answer recently, or `failed`
+            for other errors.
+        attempts: Number of times the request was sent.
+        bytes_sent: Size of the sent messages, retries included.
+        bytes_received: Size of the received messages, ignored ones included.
+        encode_time: Seconds spent serializing and encrypting the request.
+        decode_time: Seconds spent decrypting and parsing the replies.
+        rtt: Seconds from the last send to the reply, None without reply.
+        duration: Seconds from the first send to the end of the request.
+        response: Response dict, None without reply.
+        error: The exception raised for the request or None.
+    """
+
+    def __init__(self, request, address, transport='udp'):
+        self.calls = [
+            f'{module}.{method}'
+            for module, methods in request.items()
+            for method in (methods if isinstance(methods, dict) else ())
+        ]
+        self.address = address
+        self.transport = transport
+        self.outcome = 'ok'
+        self.attempts = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.encode_time = 0.0
+        self.decode_time = 0.0
+        self.rtt = None
+        self.duration = 0.0
+        self.response = None
+        self.error = None
+
+    def __repr__(self):
+        rtt = 'none' if self.rtt is None else f'{self.rtt * 1000:.1f}ms'
+        return (
+            f'<RequestEvent {self.address[0]} {",".join(self.calls)} {self.outcome}'
+            f' attempts:{self.attempts} rtt:{rtt}>'
+        )
+
+    @property
+    def bulb(self):
+        """Get the label of the bulb: its IP, with the port if it is not the default one."""
+        ip, port = self.address[:2]
+        return ip if port == 9999 else f'{ip}:{port}'
+
+    def fail(self, error):
+        """Set the outcome from the exception raised for the request."""
+        self.error = error
+        if self.response is not None:
+            self.outcome = 'error'
+        elif isinstance(error, BulbUnavailableError):
+            self.outcome = 'unavailable'
+        elif isinstance(error, RuntimeError) and self.attempts:
+            self.outcome = 'timeout'
+        else:
+            self.outcome = 'failed'
+
+
+class Histogram(object):
+    """Counts of the observed values in cumulative buckets, like Prometheus."""
+
+    # Upper bounds in seconds, suited to the round trip times in a LAN
+    default_buckets = (
+        0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    )
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(sorted(buckets or self.default_buckets))
+        # The last count is for values over the highest bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value):
+        """Count the value."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """Get `(upper bound, count)` pairs, the last bound is infinity."""
+        total = 0
+        pairs = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def quantile(self, fraction):
+        """Estimate the quantile as the upper bound of its bucket. None if empty."""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound
+
+    @property
+    def mean(self):
+        """Get the mean of the values."""
+        return self.sum / self.count if self.count else 0.0
+
+
+class MetricsCollector(object):
+    """
+    Observer aggregating the request events in memory.
+
+    Keeps RTT histograms per bulb and per call, request counts by outcome,
+    retries, bytes, codec time and the Wi-Fi signal strength reported in
+    `get_sysinfo` replies. `prometheus()` exports them in the Prometheus
+    text format.
+    """
+
+    def __init__(self, buckets=None):
+        self.buckets = buckets
+        self.__lock = threading.Lock()
+        self.rtt_by_bulb = {}
+        self.rtt_by_call = {}
+        self.requests = {}
+        self.retries = {}
+        self.bytes_sent = {}
+        self.bytes_received = {}
+        self.encode_time = 0.0
+        self.decode_time = 0.0
+        self.rssi = {}
+
+    def __call__(self, event):
+        ip = event.bulb
+        with self.__lock:
+            key = (ip, event.outcome)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.retries[ip] = self.retries.get(ip, 0) + max(0, event.attempts - 1)
+            self.bytes_sent[ip] = self.bytes_sent.get(ip, 0) + event.bytes_sent
+            self.bytes_received[ip] = self.bytes_received.get(ip, 0) + event.bytes_received
+            self.encode_time += event.encode_time
+            self.decode_time += event.decode_time
+            if event.rtt is not None:
+                self.__histogram(self.rtt_by_bulb, ip).add(event.rtt)
+                for call in event.calls:
+                    self.__histogram(self.rtt_by_call, call).add(event.rtt)
+            sysinfo = (event.response or {}).get('system', {}).get('get_sysinfo')
+            if isinstance(sysinfo, dict) and 'rssi' in sysinfo:
+                self.rssi[ip] = sysinfo['rssi']
+
+    def worst_bulbs(self, count=10):
+        """
+        Get the bulbs with the highest median RTT.
+
+        Returns:
+            List of `(bulb, median rtt, retries, rssi)` tuples, the worst first.
+        """
+        with self.__lock:
+            rows = [
+                (ip, histogram.quantile(0.5), self.retries.get(ip, 0), self.rssi.get(ip))
+                for ip, histogram in self.rtt_by_bulb.items()
+            ]
+        return sorted(rows, key=lambda row: (row[1], row[2]), reverse=True)[:count]
+
+    def prometheus(self, prefix='tplight'):
+        """Export the metrics in the Prometheus text format."""
+        lines = []
+
+        def header(name, kind, text):
+            lines.append(f'# HELP {prefix}_{name} {text}')
+            lines.append(f'# TYPE {prefix}_{name} {kind}')
+
+        def histograms(name, label, histograms):
+            for value, histogram in sorted(histograms.items()):
+                for bound, total in histogram.cumulative():
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(
+                        f'{prefix}_{name}_bucket{{{label}="{value}",le="{le}"}} {total}'
+                    )
+                lines.append(f'{prefix}_{name}_sum{{{label}="{value}"}} {histogram.sum!r}')
+                lines.append(f'{prefix}_{name}_count{{{label}="{value}"}} {histogram.count}')
+
+        def counters(name, values):
+            for ip, value in sorted(values.items()):
+                lines.append(f'{prefix}_{name}{{bulb="{ip}"}} {value}')
+
+        with self.__lock:
+            header('rtt_seconds', 'histogram', 'Round trip time of the requests by bulb.')
+            histograms('rtt_seconds', 'bulb', self.rtt_by_bulb)
+            header('call_rtt_seconds', 'histogram', 'Round trip time of the requests by call.')
+            histograms('call_rtt_seconds', 'call', self.rtt_by_call)
+            header('requests_total', 'counter', 'Requests by bulb and outcome.')
+            for (ip, outcome), value in sorted(self.requests.items()):
+                lines.append(f'{prefix}_requests_total{{bulb="{ip}",outcome="{outcome}"}} {value}')
+            header('retries_total', 'counter', 'Repeated sends of the requests.')
+            counters('retries_total', self.retries)
+            header('sent_bytes_total', 'counter', 'Size of the sent messages.')
+            counters('sent_bytes_total', self.bytes_sent)
+            header('received_bytes_total', 'counter', 'Size of the received messages.')
+            counters('received_bytes_total', self.bytes_received)
+            header('encode_seconds_total', 'counter', 'Time spent encoding the requests.')
+            lines.append(f'{prefix}_encode_seconds_total {self.encode_time!r}')
+            header('decode_seconds_total', 'counter', 'Time spent decoding the replies.')
+            lines.append(f'{prefix}_decode_seconds_total {self.decode_time!r}')
+            header('rssi_dbm', 'gauge', 'Wi-Fi signal strength reported by the bulb.')
+            counters('rssi_dbm', self.rssi)
+        cache = protocol.payload_cache.stats()
+        header('payload_cache_hits_total', 'counter', 'Requests taken from the payload cache.')
+        lines.append(f'{prefix}_payload_cache_hits_total {cache["hits"]}')
+        header('payload_cache_misses_total', 'counter', 'Requests encoded for the payload cache.')
+        lines.append(f'{prefix}_payload_cache_misses_total {cache["misses"]}')
+        header('payload_cache_evictions_total', 'counter', 'Requests dropped from the LRU.')
+        lines.append(f'{prefix}_payload_cache_evictions_total {cache["evictions"]}')
+        return '\n'.join(lines) + '\n'
+
+    def __histogram(self, histograms, key):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(self.buckets)
+        return histogram
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Polling of the light state of many bulbs, reporting only the changes.
+
+`Poller` sends `get_light_state` instead of the full sysinfo, about a tenth
+of its size, to the bulbs due for polling in one `BulbGroup` sweep. Every
+bulb has its own interval: it drops to `min_interval` when the state
+changes and grows up to `max_interval` while it does not. Bulbs without
+reply are polled less and less often, up to `max_backoff`.
+
+Changes are reported as `StateChange` events of one field each to callbacks,
+queues and async iterators:
+
+    poller = Poller(ips)
+    poller.subscribe(print)
+    poller.start()
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+from . import protocol
+from .fleet import BulbGroup
+from .retry import AdaptiveRetryPolicy
+
+
+class StateChange(object):
+    """
+    Change of one field of the bulb state.
+
+    Attributes:
+        bulb: The bulb as passed to the poller.
+        field: Light state key, e.g. `brightness`, or `available` for the
+            bulb starting or stopping to answer.
+        old: Previous value, None on the first reply of the bulb.
+        new: New value.
+        time: `time.time()` of the reply.
+    """
+
+    __slots__ = ('bulb', 'field', 'old', 'new', 'time')
+
+    def __init__(self, bulb, field, old, new, time):
+        self.bulb = bulb
+        self.field = field
+        self.old = old
+        self.new = new
+        self.time = time
+
+    def __repr__(self):
+        return f'<StateChange {self.bulb} {self.field}: {self.old!r} -> {self.new!r}>'
+
+
+class BulbSchedule(object):
+    """Polling interval, due time and last known state of one bulb."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.due = 0.0
+        self.failures = 0
+        self.available = None
+        self.state = None
+        # Bulbs without `get_light_state` are polled with `get_sysinfo`
+        self.sysinfo = False
+
+
+class Poller(object):
+    """
+    Poll many bulbs with adaptive intervals and report the state changes.
+
+    The poller runs in a thread with `start()` or in the calling one with
+    `run()`. Subscribers are called from the polling thread.
+    """
+
+    def __init__(
+        self,
+        bulbs,
+        min_interval=1.0,
+        max_interval=30.0,
+        growth=1.5,
+        max_backoff=300.0,
+        timeout=1.0,
+        group=None,
+    ):
+        """
+        Initialise the poller.
+
+        Args:
+            bulbs: Iterable of bulbs accepted by `BulbGroup`.
+            min_interval: Interval in seconds after a change.
+            max_interval: Longest interval in seconds of answering bulbs.
+            growth: Factor of the interval after every poll without change.
+            max_backoff: Longest interval in seconds of bulbs without reply,
+                doubled on every failure from `min_interval`.
+            timeout: Longest wait for the replies of one sweep in seconds,
+                so a bulb without reply delays the others by that at most.
+            group: `BulbGroup` of the bulbs to poll through. Created for the
+                bulbs with `timeout` if not provided, and closed with the
+                poller then.
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.growth = growth
+        self.max_backoff = max_backoff
+        self.__own_group = group is None
+        if group is None:
+            group = BulbGroup(bulbs, lambda: AdaptiveRetryPolicy(max_retry=3, deadline=timeout))
+        self.group = group
+        self.schedules = {bulb: BulbSchedule(min_interval) for bulb in self.group.bulbs}
+        self.polls = 0
+        self.__subscribers = []
+        self.__lock = threading.Lock()
+        self.__wakeup = threading.Condition(self.__lock)
+        self.__stopped = threading.Event()
+        self.__thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def state(self, bulb):
+        """Get the last known light state dict of the bulb, None before its first reply."""
+        return self.schedules[bulb].state
+
+    def subscribe(self, callback):
+        """Call `callback(change)` for every `StateChange`. Return the callback."""
+        with self.__lock:
+            self.__subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        """Stop calling the callback."""
+        with self.__lock:
+            self.__subscribers.remove(callback)
+
+    def queue(self, maxsize=0):
+        """Get a new `queue.Queue` receiving the changes."""
+        changes = queue.Queue(maxsize)
+        self.subscribe(changes.put)
+        return changes
+
+    async def changes(self):
+        """
+        Iterate the changes in the running event loop:
+
+            async for change in poller.changes():
+                print(change)
+        """
+        loop = asyncio.get_running_loop()
+        changes = asyncio.Queue()
+        callback = self.subscribe(
+            lambda change: loop.call_soon_threadsafe(changes.put_nowait, change)
+        )
+        try:
+            while True:
+                yield await changes.get()
+        finally:
+            self.unsubscribe(callback)
+
+    def refresh(self, bulb):
+        """Poll the bulb as soon as possible, e.g. after changing its state."""
+        with self.__wakeup:
+            schedule = self.schedules[bulb]
+            schedule.due = 0.0
+            schedule.interval = self.min_interval
+            self.__wakeup.notify()
+
+    def poll(self):
+        """
+        Poll the bulbs which are due now.
+
+        Returns:
+            List of `StateChange` events, already passed to the subscribers.
+        """
+        now = time.monotonic()
+        with self.__lock:
+            due = [bulb for bulb, schedule in self.schedules.items() if schedule.due <= now]
+            for bulb in due:
+                # Rescheduled after the reply unless refreshed meanwhile
+                self.schedules[bulb].due = float('inf')
+        changes = []
+        for sysinfo in (False, True):
+            bulbs = [bulb for bulb in due if self.schedules[bulb].sysinfo == sysinfo]
+            if not bulbs:
+                continue
+            request = protocol.GET_SYSINFO if sysinfo else protocol.GET_LIGHT_STATE
+            self.polls += len(bulbs)
+            for bulb, result in self.group.fetch_dict(request, bulbs).items():
+                changes.extend(self.__update(bulb, result, sysinfo))
+
+        with self.__lock:
+            subscribers = list(self.__subscribers)
+        for change in changes:
+            for callback in subscribers:
+                try:
+                    callback(change)
+                except Exception:
+                    logging.exception('State change subscriber %r failed', callback)
+        return changes
+
+    def next_due(self):
+        """Get the seconds until the next bulb is due, 0.0 if one is due now."""
+        with self.__lock:
+            due = min((schedule.due for schedule in self.schedules.values()), default=None)
+        if due is None:
+            return None
+        return max(0.0, due - time.monotonic())
+
+    def run(self, duration=None):
+        """Poll until `stop()` is called or `duration` seconds pass."""
+        end = None if duration is None else time.monotonic() + duration
+        self.__stopped.clear()
+        while not self.__stopped.is_set():
+            self.poll()
+            wait = self.next_due()
+            if end is not None:
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    break
+                wait = remaining if wait is None else min(wait, remaining)
+            with self.__wakeup:
+                if not self.__stopped.is_set():
+                    self.__wakeup.wait(wait)
+
+    def start(self):
+        """Run the poller in a daemon thread."""
+        if self.__thread is not None and self.__thread.is_alive():
+            raise RuntimeError('Poller is already running')
+        self.__thread = threading.Thread(target=self.run, name='tplight-poller', daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """Stop polling and wait for the thread started by `start()`."""
+        with self.__wakeup:
+            self.__stopped.set()
+            self.__wakeup.notify()
+        if self.__thread is not None and self.__thread is not threading.current_thread():
+            self.__thread.join()
+            self.__thread = None
+
+    def close(self):
+        """Stop polling and close the group created by the poller."""
+        self.stop()
+        if self.__own_group:
+            self.group.close()
+
+    def __update(self, bulb, result, sysinfo):
+        """Reschedule the bulb after the poll. Return its state changes."""
+        schedule = self.schedules[bulb]
+        now = time.time()
+        changes = []
+        if isinstance(result, protocol.BulbError) and result.unsupported and not sysinfo:
+            # The bulb answers but lacks the method, e.g. another model
+            logging.debug('Polling %s with get_sysinfo: %s', bulb, result)
+            schedule.sysinfo = True
+            schedule.due = 0.0
+            return changes
+
+        if not isinstance(result, Exception):
+            try:
+                if sysinfo:
+                    state = protocol.parse_light_state(
+                        result[protocol.SYSTEM]['get_sysinfo']['light_state']
+                    )
+                else:
+                    state = protocol.parse_light_state(
+                        result[protocol.LIGHTING]['get_light_state']
+                    )
+            except (KeyError, TypeError, ValueError) as e:
+                # Malformed reply counts as a failed poll
+                logging.debug('Malformed light state from %s: %r', bulb, e)
+                result = e
+
+        if isinstance(result, Exception):
+            schedule.failures += 1
+            # The exponent is capped, the float would overflow after 1024 failures
+            schedule.interval = min(
+                self.max_backoff, self.min_interval * 2 ** min(schedule.failures, 32)
+            )
+            if schedule.available is not False:
+                changes.append(StateChange(bulb, 'available', schedule.available, False, now))
+                schedule.available = False
+        else:
+            if schedule.available is not True:
+                changes.append(StateChange(bulb, 'available', schedule.available, True, now))
+                schedule.available = True
+            old = schedule.state or {}
+            changes.extend(
+                StateChange(bulb, field, old.get(field), value, now)
+                for field, value in state.items()
+                if old.get(field) != value
+            )
+            changed = schedule.state is not None and state != schedule.state
+            schedule.state = state
+            schedule.failures = 0
+            if changed:
+                schedule.interval = self.min_interval
+            else:
+                schedule.interval = min(
+                    self.max_interval, max(self.min_interval, schedule.interval * self.growth)
+                )
+        with self.__lock:
+            if schedule.due == float('inf'):
+                schedule.due = time.monotonic() + schedule.interval
+        return changes
@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+"""
+Requests and responses of the bulb protocol shared by the sync and async
+clients. See `protocols.md` for the messages.
+"""
+
+import collections
+import datetime
+import json
+import threading
+
+from . import codec
+
+SYSTEM = 'system'
+COMMON_SYSTEM = 'smartlife.iot.common.system'
+TIMESETTING = 'smartlife.iot.common.timesetting'
+LIGHTING = 'smartlife.iot.smartbulb.lightingservice'
+SCHEDULE = 'smartlife.iot.common.schedule'
+EMETER = 'smartlife.iot.common.emeter'
+
+GET_SYSINFO = {SYSTEM: {'get_sysinfo': {}}}
+GET_LIGHT_DETAILS = {LIGHTING: {'get_light_details': ''}}
+GET_LIGHT_STATE = {LIGHTING: {'get_light_state': {}}}
+GET_TIME = {TIMESETTING: {'get_time': {}}}
+GET_TIMEZONE = {TIMESETTING: {'get_timezone': {}}}
+REBOOT = {COMMON_SYSTEM: {'reboot': {'delay': 1}}}
+GET_RULES = {SCHEDULE: {'get_rules': {}}}
+GET_NEXT_ACTION = {SCHEDULE: {'get_next_action': {}}}
+DELETE_ALL_RULES = {SCHEDULE: {'delete_all_rules': {}}}
+
+# Sysinfo values which do not change unless the firmware is updated.
+STATIC_SYSINFO = (
+    'sw_ver', 'hw_ver', 'model', 'description', 'mic_type', 'mic_mac', 'deviceId', 'oemId',
+    'hwId', 'is_dimmable', 'is_color', 'is_variable_color_temp',
+)
+
+MIN_TIMEZONE = 0
+MAX_TIMEZONE = 109
+
+# Error codes of the bulb firmware
+MODULE_NOT_SUPPORTED = -1
+METHOD_NOT_SUPPORTED = -2
+INVALID_ARGUMENT = -3
+
+
+class BulbError(RuntimeError):
+    """
+    The bulb answered the request with an error code.
+
+    Attributes:
+        err_code: The error code, None if the reply lacks the method.
+    """
+
+    def __init__(self, message, err_code=None):
+        super().__init__(message)
+        self.err_code = err_code
+
+    @property
+    def unsupported(self):
+        """Whether the bulb lacks the module or the method, e.g. another model."""
+        return self.err_code in (MODULE_NOT_SUPPORTED, METHOD_NOT_SUPPORTED)
+
+
+class PayloadCache(object):
+    """
+    Encrypted requests memoized for repeated sends.
+
+    The request constants of this module are encoded once per key and kept
+    for good: they must not be modified. Other requests, e.g. transitions to
+    the same state, are kept in a bounded LRU keyed by the `repr()` of the
+    request, which is several times cheaper than `json.dumps` and encryption
+    and tells `True` from `1`. `maxsize = 0` disables the LRU.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__constants = {}
+        self.__constant_ids = set()
+        self.__entries = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    def register(self, *requests):
+        """Mark the request dicts as constants, memoized by identity."""
+        self.__constant_ids.update(id(request) for request in requests)
+
+    def encode(self, data, key):
+        """Get the encrypted request from the cache or encode it."""
+        if id(data) in self.__constant_ids:
+            cache_key = (key, id(data))
+            payload = self.__constants.get(cache_key)
+            if payload is None:
+                payload = self.__constants[cache_key] = _encode(data, key)
+                self.misses += 1
+            else:
+                self.hits += 1
+            return payload
+        if not self.maxsize:
+            return _encode(data, key)
+
+        cache_key = (key, repr(data))
+        with self.__lock:
+            payload = self.__entries.get(cache_key)
+            if payload is not None:
+                self.__entries.move_to_end(cache_key)
+                self.hits += 1
+                return payload
+            self.misses += 1
+        payload = _encode(data, key)
+        with self.__lock:
+            self.__entries[cache_key] = payload
+            while len(self.__entries) > self.maxsize:
+                self.__entries.popitem(last=False)
+                self.evictions += 1
+        return payload
+
+    @property
+    def hit_rate(self):
+        """Get the share of requests taken from the cache."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        """Get the counters and the sizes of the cache as dict."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hit_rate,
+            'size': len(self.__entries),
+            'constants': len(self.__constants),
+        }
+
+    def clear(self):
+        """Drop the memoized requests and reset the counters."""
+        with self.__lock:
+            self.__entries.clear()
+            self.__constants.clear()
+            self.hits = self.misses = self.evictions = 0
+
+
+payload_cache = PayloadCache()
+payload_cache.register(
+    GET_SYSINFO, GET_LIGHT_DETAILS, GET_LIGHT_STATE, GET_TIME, GET_TIMEZONE, REBOOT,
+    GET_RULES, GET_NEXT_ACTION,
+)
+
+
+def encode(data, key=codec.DEFAULT_KEY, cache=True):
+    """Serialize and encrypt the request dict. Repeated requests come from `payload_cache`."""
+    if not isinstance(data, dict):
+        raise ValueError('data should be dict.')
+    if cache:
+        return payload_cache.encode(data, key)
+    return _encode(data, key)
+
+
+def _encode(data, key):
+    return codec.encrypt(json.dumps(data).encode('latin_1'), key)
+
+
+def decode(data, key=codec.DEFAULT_KEY):
+    """Decrypt the received datagram. Return decrypted bytes."""
+    return codec.decrypt(data, key)
+
+
+def read_reply(data, request, key=codec.DEFAULT_KEY):
+    """
+    Decrypt and parse the received datagram.
+
+    Returns:
+        Response dict, or None if the datagram is not a complete reply to the
+        request, e.g. a late reply to another one.
+    """
+    try:
+        response = json.loads(codec.decrypt(data, key))
+    except ValueError:
+        return None
+    if not isinstance(response, dict):
+        return None
+    for module, methods in request.items():
+        module_reply = response.get(module)
+        if not isinstance(module_reply, dict):
+            return None
+        if 'err_code' in module_reply and not any(m in module_reply for m in methods):
+            continue  # The module itself failed, e.g. it is not supported
+        if not all(method in module_reply for method in methods):
+            return None
+    return response
+
+
+def check_reply(request, response):
+    """Raise `BulbError` if any module or method of the request reports an error."""
+    for module, methods in request.items():
+        module_reply = response[module]
+        if module_reply.get('err_code', 0) != 0:
+            raise BulbError(
+                'Bulb returned error: ' + json.dumps({module: module_reply}),
+                module_reply['err_code'],
+            )
+        for method in methods:
+            if method not in module_reply:
+                raise BulbError(
+                    f'Bulb returned no reply for {module}.{method}: ' + json.dumps(module_reply)
+                )
+            reply = module_reply[method]
+            if isinstance(reply, dict) and reply.get('err_code', 0) != 0:
+                raise BulbError(
+                    'Bulb returned error: ' + json.dumps({module: {method: reply}}),
+                    reply['err_code'],
+                )
+
+
+def transition_request(limits, transition_period, kwargs):
+    """
+    Build `transition_light_state` request.
+
+    Args:
+        limits: Object with `min_*` and `max_*` range constants, e.g. `LB130`.
+        transition_period: Transition duration in milliseconds.
+        kwargs: Dict of target state. Refer to `LB130.transite_light_state`.
+
+    Returns:
+        Request dict. Its `transition_light_state` dict holds validated values.
+    """
+    data = {LIGHTING: {'transition_light_state': {'ignore_default': 1}}}
+    state = data[LIGHTING]['transition_light_state']
+
+    if ('hue' in kwargs or 'saturation' in kwargs):
+        if 'color_temp' in kwargs:
+            raise ValueError('color_temp should not be set with hue or saturation.')
+        kwargs = dict(kwargs, color_temp=0)
+
+    state['transition_period'] = transition_period
+
+    def state_setter(arg, arg_type, checker):
+        if arg in kwargs:
+            casted_arg = arg_type(kwargs[arg])
+            if not checker(casted_arg):
+                raise ValueError(arg + ' is wrong.')
+            state[arg] = casted_arg
+
+    state_setter('on_off', int, lambda x: x in (0, 1))
+    state_setter('hue', int, lambda x: limits.min_hue <= x <= limits.max_hue)
+    state_setter(
+        'saturation', int, lambda x: limits.min_saturation <= x <= limits.max_saturation
+    )
+    state_setter(
+        'brightness', int, lambda x: limits.min_brightness <= x <= limits.max_brightness
+    )
+    state_setter(
+        'color_temp', int,
+        lambda x: limits.min_color_temp <= x <= limits.max_color_temp or x == 0
+    )
+    state_setter('mode', str, lambda x: x in ('normal', 'circadian'))
+
+    return data
+
+
+def merge_transition(pending, kwargs):
+    """
+    Merge the target state into the pending one as if they were sent one by
+    one: later values win and hue or saturation replace color_temp and vice
+    versa. Return the merged dict.
+    """
+    merged = dict(pending)
+    if 'hue' in kwargs or 'saturation' in kwargs:
+        merged.pop('color_temp', None)
+    elif 'color_temp' in kwargs:
+        merged.pop('hue', None)
+        merged.pop('saturation', None)
+    merged.update(kwargs)
+    return merged
+
+
+def drop_unchanged(kwargs, state):
+    """
+    Remove target values equal to the current light state dict. Return the
+    remaining dict.
+
+    Hue and saturation are compared only in color mode, i.e. when current
+    color_temp is 0, as they do not define the light otherwise.
+    """
+    color_mode = state.get('color_temp') == 0
+    result = {}
+    for arg, value in kwargs.items():
+        if arg in ('hue', 'saturation') and not color_mode:
+            result[arg] = value
+        elif arg not in state or state[arg] != value:
+            result[arg] = value
+    return result
+
+
+def parse_sysinfo(data):
+    """
+    Extract the bulb state from `get_sysinfo` response.
+
+    Light values of the switched off bulb are taken from `dft_on_state`.
+    """
+    sysinfo_data = data[SYSTEM]['get_sysinfo']
+    return dict(
+        alias=sysinfo_data['alias'],
+        device_id=str(sysinfo_data['deviceId']),
+        **parse_light_state(sysinfo_data['light_state'])
+    )
+
+
+def parse_light_state(light_state_data):
+    """
+    Extract the light state from `light_state` dict of sysinfo or from
+    `get_light_state` and `transition_light_state` responses.
+
+    Light values of the switched off bulb are taken from `dft_on_state`.
+    """
+    on_off = int(light_state_data['on_off'])
+    if not on_off:
+        light_state_data = light_state_data['dft_on_state']
+
+    return {
+        'on_off': on_off,
+        'hue': int(light_state_data['hue']),
+        'saturation': int(light_state_data['saturation']),
+        'brightness': int(light_state_data['brightness']),
+        'color_temp': int(light_state_data['color_temp']),
+        'mode': light_state_data['mode'],
+    }
+
+
+def parse_device_info(data):
+    """Extract static values from `get_sysinfo` response."""
+    sysinfo_data = data[SYSTEM]['get_sysinfo']
+    return {name: sysinfo_data[name] for name in STATIC_SYSINFO if name in sysinfo_data}
+
+
+def parse_light_details(data):
+    """Extract static hardware values from `get_light_details` response."""
+    light_details_data = data[LIGHTING]['get_light_details']
+    return {
+        'lamp_beam_angle': int(light_details_data['lamp_beam_angle']),
+        'min_voltage': int(light_details_data['min_voltage']),
+        'max_voltage': int(light_details_data['max_voltage']),
+        'wattage': int(light_details_data['wattage']),
+        'incandescent_equivalent': int(light_details_data['incandescent_equivalent']),
+        'max_lumens': int(light_details_data['max_lumens']),
+        'color_rendering_index': str(light_details_data['color_rendering_index']),
+    }
+
+
+def parse_time(data):
+    """Extract datetime from `get_time` response."""
+    get_time = data[TIMESETTING]['get_time']
+
+    return datetime.datetime(
+        get_time['year'],
+        get_time['month'],
+        get_time['mday'],
+        get_time['hour'],
+        get_time['min'],
+        get_time['sec'],
+    )
+
+
+def parse_timezone(data):
+    """Extract timezone index from `get_timezone` response."""
+    return data[TIMESETTING]['get_timezone']['index']
+
+
+def set_time_request(date):
+    """Build `set_time` request."""
+    if not isinstance(date, datetime.datetime):
+        raise ValueError('Invalid type: must pass a datetime object')
+    return {TIMESETTING: {'set_time': _date_fields(date)}}
+
+
+def check_timezone(timezone):
+    """Raise ValueError if the timezone index is out of range."""
+    if not MIN_TIMEZONE <= timezone <= MAX_TIMEZONE:
+        raise ValueError(f'Timezone out of range: {MIN_TIMEZONE} to {MAX_TIMEZONE}')
+
+
+def set_timezone_request(timezone, date):
+    """Build `set_timezone` request. `date` is the current time of the device."""
+    check_timezone(timezone)
+    return {TIMESETTING: {'set_timezone': dict(index=timezone, **_date_fields(date))}}
+
+
+def set_alias_request(name):
+    """Build `set_dev_alias` request."""
+    if not isinstance(name, str):
+        raise ValueError('name should be str.')
+    return {COMMON_SYSTEM: {'set_dev_alias': {'alias': name}}}
+
+
+def parse_rules(data):
+    """Extract the list of rule dicts from `get_rules` response."""
+    return data[SCHEDULE]['get_rules'].get('rule_list', [])
+
+
+def parse_next_action(data):
+    """Extract the next action dict from `get_next_action` response."""
+    next_action = data[SCHEDULE]['get_next_action']
+    return {key: value for key, value in next_action.items() if key != 'err_code'}
+
+
+def add_rule_request(rule):
+    """Build `add_rule` request of the rule dict. See `tplight.schedule.light_rule`."""
+    return {SCHEDULE: {'add_rule': dict(rule)}}
+
+
+def delete_rule_request(rule_id):
+    """Build `delete_rule` request."""
+    return {SCHEDULE: {'delete_rule': {'id': rule_id}}}
+
+
+def set_schedule_enable_request(enable):
+    """Build `set_overall_enable` request turning the whole schedule on or off."""
+    return {SCHEDULE: {'set_overall_enable': {'enable': int(bool(enable))}}}
+
+
+def daystat_request(year, month):
+    """Build `get_daystat` request of the month."""
+    return {EMETER: {'get_daystat': {'year': int(year), 'month': int(month)}}}
+
+
+def monthstat_request(year):
+    """Build `get_monthstat` request of the year."""
+    return {EMETER: {'get_monthstat': {'year': int(year)}}}
+
+
+def parse_daystat(data):
+    """Extract dict of `datetime.date` to energy in Wh from `get_daystat` response."""
+    return {
+        datetime.date(day['year'], day['month'], day['day']): int(day['energy_wh'])
+        for day in data[EMETER]['get_daystat'].get('day_list', [])
+    }
+
+
+def parse_monthstat(data):
+    """Extract dict of month number to energy in Wh from `get_monthstat` response."""
+    return {
+        int(month['month']): int(month['energy_wh'])
+        for month in data[EMETER]['get_monthstat'].get('month_list', [])
+    }
+
+
+def _date_fields(date):
+    """Split datetime to the fields used by timesetting requests."""
+    return {
+        'year': date.year,
+        'month': date.month,
+        'mday': date.day,
+        'hour': date.hour,
+        'min': date.minute,
+        'sec': date.second,
+    }
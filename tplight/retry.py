@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""Retry policies deciding how long to wait for the bulb reply."""
+
+import random
+import time
+
+
+class BulbUnavailableError(RuntimeError):
+    """The bulb stopped answering recently and is not asked until later."""
+
+
+class RetryCall(object):
+    """
+    Attempts of one request. Created by `RetryPolicy.begin()`.
+
+    Iterate to get the reply timeout of every attempt right before sending
+    it, then report the outcome with `succeeded()` or `failed()`.
+    """
+
+    def __init__(self, policy, timeouts, deadline=None):
+        self.policy = policy
+        self.attempts = 0
+        self.__timeouts = iter(timeouts)
+        self.__deadline = deadline
+        self.__first_sent = None
+        self.__finished = False
+
+    def __iter__(self):
+        while True:
+            timeout = self.next_timeout()
+            if timeout is None:
+                return
+            yield timeout
+
+    def next_timeout(self):
+        """Get the timeout of the next attempt. Return None if no attempts are left."""
+        now = time.monotonic()
+        timeout = next(self.__timeouts, None)
+        if timeout is None:
+            return None
+        if self.__deadline is not None:
+            if now >= self.__deadline:
+                return None
+            timeout = min(timeout, self.__deadline - now)
+        self.attempts += 1
+        if self.__first_sent is None:
+            self.__first_sent = now
+        return timeout
+
+    def succeeded(self):
+        """Report the reply. The round trip time is sampled only from the first attempt."""
+        if self.__finished:
+            return
+        self.__finished = True
+        rtt = time.monotonic() - self.__first_sent if self.attempts == 1 else None
+        self.policy.record_success(rtt)
+
+    def failed(self):
+        """Report no reply after all attempts."""
+        if self.__finished:
+            return
+        self.__finished = True
+        self.policy.record_failure()
+
+
+class RetryPolicy(object):
+    """
+    Fixed schedule: the timeout grows linearly with every attempt.
+
+    This was the only behaviour before the adaptive policy.
+    """
+
+    def __init__(self, timeout=0.5, max_retry=5):
+        self.timeout = timeout
+        self.max_retry = max_retry
+        self.successes = 0
+        self.failures = 0
+
+    def begin(self):
+        """Start a request. Return `RetryCall`."""
+        return RetryCall(self, (self.timeout * retry for retry in range(1, self.max_retry + 1)))
+
+    def record_success(self, rtt):
+        """Account the answered request. `rtt` is None if it is ambiguous."""
+        self.successes += 1
+
+    def record_failure(self):
+        """Account the request left without reply."""
+        self.failures += 1
+
+
+class AdaptiveRetryPolicy(RetryPolicy):
+    """
+    Timeouts derived from the measured round trip time of the bulb.
+
+    The retransmission timeout is estimated like in TCP (RFC 6298) from the
+    smoothed round trip time and its variance. Every retry doubles it with a
+    random jitter, and the whole request is limited by `deadline` seconds.
+
+    After `failure_threshold` requests in a row without reply the bulb is
+    considered down: requests fail fast with `BulbUnavailableError` for
+    `reset_timeout` seconds, then one probe with a single attempt is allowed.
+    """
+
+    alpha = 1 / 8
+    beta = 1 / 4
+
+    def __init__(
+        self,
+        initial_rto=0.5,
+        min_rto=0.05,
+        max_rto=4.0,
+        max_retry=5,
+        deadline=3.0,
+        backoff=2.0,
+        jitter=0.1,
+        failure_threshold=3,
+        reset_timeout=30.0,
+    ):
+        super().__init__(initial_rto, max_retry)
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.deadline = deadline
+        self.backoff = backoff
+        self.jitter = jitter
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+        self.consecutive_failures = 0
+        self.__opened_at = None
+
+    @property
+    def state(self):
+        """Get circuit breaker state: `closed`, `open` or `half-open`."""
+        if self.__opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.__opened_at < self.reset_timeout:
+            return 'open'
+        return 'half-open'
+
+    def begin(self):
+        """Start a request. Return `RetryCall`. Raise `BulbUnavailableError` if open."""
+        state = self.state
+        if state == 'open':
+            raise BulbUnavailableError('Bulb does not answer, retry later')
+        attempts = 1 if state == 'half-open' else self.max_retry
+        deadline = None if self.deadline is None else time.monotonic() + self.deadline
+        return RetryCall(self, self.__timeouts(attempts), deadline)
+
+    def record_success(self, rtt):
+        super().record_success(rtt)
+        self.consecutive_failures = 0
+        self.__opened_at = None
+        if rtt is None:
+            return
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.beta) * self.rttvar + self.beta * abs(self.srtt - rtt)
+            self.srtt = (1 - self.alpha) * self.srtt + self.alpha * rtt
+        self.rto = self.__clamp(self.srtt + 4 * self.rttvar)
+
+    def record_failure(self):
+        super().record_failure()
+        self.consecutive_failures += 1
+        if self.__opened_at is not None or self.consecutive_failures >= self.failure_threshold:
+            self.__opened_at = time.monotonic()
+
+    def __timeouts(self, attempts):
+        """Generate timeouts of the attempts with exponential backoff and jitter."""
+        rto = self.rto
+        for _ in range(attempts):
+            yield self.__clamp(rto) * random.uniform(1 - self.jitter, 1 + self.jitter)
+            rto *= self.backoff
+
+    def __clamp(self, rto):
+        return min(self.max_rto, max(self.min_rto, rto))
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Light plans stored on the bulbs as schedule rules.
+
+A bulb runs its own rules of `smartlife.iot.common.schedule`, so a plan
+compiled to rules needs no process kept awake and no traffic once stored.
+`compile_plan()` turns keyframes into rules on a minute grid and
+`sync_rules()` stores them on many bulbs, sending only the rules which
+differ from the ones already there:
+
+    rules = compile_wakeup('07:30', 20)
+    sync_rules(ips, rules, 'wakeup')
+"""
+
+import json
+import math
+
+from . import protocol
+from .effects import Timeline
+from .fleet import BulbGroup
+from .tplight import LB130
+
+# Fields of a rule compared by `sync_rules()`, the ID and dates are not
+RULE_FIELDS = (
+    'name', 'enable', 'wday', 'stime_opt', 'smin', 'sact', 's_light', 'etime_opt', 'emin',
+    'eact', 'repeat',
+)
+
+EVERY_DAY = (1, 1, 1, 1, 1, 1, 1)
+
+
+def parse_minute(value):
+    """Get the minute of the day from `HH:MM` string. Integers are returned as they are."""
+    if isinstance(value, int):
+        return value
+    hours, _, minutes = value.partition(':')
+    if not (hours.isdigit() and minutes.isdigit() and int(hours) < 24 and int(minutes) < 60):
+        raise ValueError(f'Time {value!r} is not HH:MM.')
+    return int(hours) * 60 + int(minutes)
+
+
+def light_rule(name, minute, state, wday=EVERY_DAY):
+    """
+    Build the rule setting the light state at the minute of the day.
+
+    Args:
+        name: Rule name.
+        minute: Minute of the day, from 0 to 1439.
+        state: Dict of `on_off`, `hue`, `saturation`, `brightness` and
+            `color_temp`, validated like `LB130.transite_light_state`
+            arguments. Missing values are 0, except `on_off` which is 1.
+        wday: Seven 0 or 1 flags of the days to run on, from Sunday.
+
+    Returns:
+        Rule dict for `LB130.add_rule`.
+    """
+    if not 0 <= minute < 1440:
+        raise ValueError('minute is out of range: 0 to 1439')
+    wday = [int(bool(day)) for day in wday]
+    if len(wday) != 7:
+        raise ValueError('wday should have 7 days.')
+    request = protocol.transition_request(LB130, 0, dict(state))
+    values = request[protocol.LIGHTING]['transition_light_state']
+    if values.get('on_off', 1):
+        s_light = {'on_off': 1, 'mode': 'customize_preset'}
+        for arg in ('hue', 'saturation', 'color_temp', 'brightness'):
+            s_light[arg] = values.get(arg, 0)
+    else:
+        s_light = {'on_off': 0}
+    return {
+        'name': name,
+        'enable': 1,
+        'wday': wday,
+        'stime_opt': 0,
+        'smin': minute,
+        'sact': 2,
+        's_light': s_light,
+        'etime_opt': -1,
+        'emin': 0,
+        'eact': -1,
+        'repeat': 1,
+    }
+
+
+def compile_plan(keyframes, start, name='tplight', wday=EVERY_DAY, max_rules=16):
+    """
+    Compile keyframes of a light plan to schedule rules.
+
+    The plan is interpolated like `tplight.effects.Timeline` on a grid of
+    whole minutes, coarse enough to keep to `max_rules`. Steps equal to the
+    previous one give no rule. Rules past midnight run on the next days.
+
+    Args:
+        keyframes: Iterable of `(minutes, state)` pairs, the minutes from
+            the start of the plan. See `light_rule` for the states.
+        start: Start of the plan as `HH:MM` or minute of the day. Minutes
+            out of the day start the plan on another day.
+        name: Prefix of the rule names, followed by the step number.
+        wday: Seven 0 or 1 flags of the days the plan starts on, from Sunday.
+        max_rules: Maximum number of rules.
+
+    Returns:
+        List of rule dicts in the order of their time.
+    """
+    if max_rules < 1:
+        raise ValueError('max_rules should be positive.')
+    timeline = Timeline(keyframes)
+    start = parse_minute(start)
+    duration = math.ceil(timeline.duration)
+    step = max(1, math.ceil(duration / (max_rules - 1))) if max_rules > 1 else duration + 1
+    offsets = list(range(0, duration + 1, step))
+    if offsets[-1] != duration and len(offsets) < max_rules:
+        offsets.append(duration)
+
+    rules = []
+    previous = None
+    for offset in offsets:
+        state = timeline.state_at(offset)
+        if state == previous:
+            continue
+        previous = state
+        days, minute = divmod(start + offset, 1440)
+        rule_wday = [wday[(day - days) % 7] for day in range(7)]
+        rules.append(light_rule(f'{name} {len(rules):02d}', minute, state, rule_wday))
+    return rules
+
+
+def compile_wakeup(
+    wakeup,
+    minutes_before_wakeup,
+    max_brightness=60,
+    max_temperature=3600,
+    name='wakeup',
+    wday=EVERY_DAY,
+    max_rules=16,
+):
+    """
+    Compile the sunrise of `alarm.scenario_1` to schedule rules.
+
+    The bulbs are turned on with minimal brightness and temperature,
+    raised to the half of the maximum values at 85% of the time and to the
+    maximum at the wake up time. The pulse of `scenario_1` is left out,
+    rules change the light once a minute at most.
+
+    Args:
+        wakeup: Wake up time as `HH:MM` or minute of the day.
+        minutes_before_wakeup: Length of the sunrise in minutes.
+        max_brightness: Brightness at the wake up time.
+        max_temperature: Color temperature at the wake up time.
+        name: Prefix of the rule names.
+        wday: Seven 0 or 1 flags of the wake up days, from Sunday.
+        max_rules: Maximum number of rules.
+
+    Returns:
+        List of rule dicts.
+    """
+    dim = {'on_off': 1, 'color_temp': LB130.min_color_temp, 'brightness': LB130.min_brightness}
+    half = {
+        'on_off': 1,
+        'color_temp': (max_temperature + LB130.min_color_temp) // 2,
+        'brightness': max(LB130.min_brightness, max_brightness // 2),
+    }
+    full = {'on_off': 1, 'color_temp': max_temperature, 'brightness': max_brightness}
+    keyframes = [
+        (0, dim),
+        (0.5 * minutes_before_wakeup, dim),
+        (0.85 * minutes_before_wakeup, half),
+        (minutes_before_wakeup, full),
+    ]
+    start = parse_minute(wakeup) - math.ceil(minutes_before_wakeup)
+    return compile_plan(keyframes, start, name, wday, max_rules)
+
+
+def rule_key(rule):
+    """Get the comparable content of the rule, without its ID."""
+    return json.dumps({field: rule.get(field) for field in RULE_FIELDS}, sort_keys=True)
+
+
+def diff_rules(current, desired, prefix):
+    """
+    Find the changes turning the managed rules of a bulb into the desired ones.
+
+    Args:
+        current: Rule dicts of the bulb. Only the rules named with `prefix`
+            are managed, other rules are kept.
+        desired: Rule dicts to have on the bulb.
+        prefix: Name prefix of the managed rules.
+
+    Returns:
+        `(rules to add, IDs of the rules to delete)` pair.
+    """
+    # Desired rules by content, the ones found on the bulb are removed
+    missing = {}
+    for rule in desired:
+        missing.setdefault(rule_key(rule), []).append(rule)
+    delete = []
+    for rule in current:
+        if not str(rule.get('name', '')).startswith(prefix):
+            continue
+        same = missing.get(rule_key(rule))
+        if same:
+            same.pop()
+        else:
+            delete.append(rule['id'])
+    add = [rule for rules in missing.values() for rule in rules]
+    return add, delete
+
+
+def sync_rules(bulbs, rules, prefix):
+    """
+    Store the rules on all bulbs concurrently, changing only what differs.
+
+    The rules of every bulb are read in one sweep, then each round sends
+    every bulb with changes left one `add_rule` or `delete_rule` request.
+    The schedule of the bulbs is enabled if it is off. A bulb already in
+    sync costs the `get_rules` request only.
+
+    A retried `add_rule` may store the rule twice, the extra rule is deleted
+    by the next sync.
+
+    Args:
+        bulbs: `BulbGroup` or iterable of bulbs accepted by it.
+        rules: Rule dicts, e.g. from `compile_plan`. Their names should
+            start with `prefix`.
+        prefix: Name prefix of the rules managed by the sync. Other rules
+            of the bulbs are kept, managed ones not in `rules` are deleted.
+
+    Returns:
+        Dict of bulb to `{'added': [IDs], 'deleted': [IDs]}` or the exception.
+    """
+    if not prefix:
+        raise ValueError('prefix should not be empty.')
+    for rule in rules:
+        if not rule['name'].startswith(prefix):
+            raise ValueError(f'Rule name {rule["name"]!r} does not start with {prefix!r}.')
+
+    group = bulbs if isinstance(bulbs, BulbGroup) else BulbGroup(bulbs)
+    try:
+        results = {}
+        pending = {}
+        for bulb, response in group.fetch_dict(protocol.GET_RULES).items():
+            if isinstance(response, Exception):
+                results[bulb] = response
+                continue
+            add, delete = diff_rules(protocol.parse_rules(response), rules, prefix)
+            # Deleted first, the bulbs store a limited number of rules
+            requests = [protocol.delete_rule_request(rule_id) for rule_id in delete]
+            requests += [protocol.add_rule_request(rule) for rule in add]
+            if rules and not response[protocol.SCHEDULE]['get_rules'].get('enable', 1):
+                enable = protocol.set_schedule_enable_request(True)
+                if requests:
+                    requests[0][protocol.SCHEDULE].update(enable[protocol.SCHEDULE])
+                else:
+                    requests.append(enable)
+            results[bulb] = {'added': [], 'deleted': []}
+            if requests:
+                pending[bulb] = requests
+
+        while pending:
+            replies = group.fetch_each({bulb: requests[0] for bulb, requests in pending.items()})
+            for bulb, response in replies.items():
+                if isinstance(response, Exception):
+                    results[bulb] = response
+                    del pending[bulb]
+                    continue
+                request = pending[bulb].pop(0)[protocol.SCHEDULE]
+                if 'add_rule' in request:
+                    results[bulb]['added'].append(
+                        response[protocol.SCHEDULE]['add_rule']['id']
+                    )
+                if 'delete_rule' in request:
+                    results[bulb]['deleted'].append(request['delete_rule']['id'])
+                if not pending[bulb]:
+                    del pending[bulb]
+        return results
+    finally:
+        if group is not bulbs:
+            group.close()
@@ -0,0 +1,503 @@
+#!/usr/bin/env python3
+"""
+Gateway daemon keeping the bulbs of a fleet warm for short-lived clients.
+
+`Gateway` holds one `AsyncLB130` per bulb, all sharing one UDP endpoint, and
+caches their status. Identical reads of a bulb in flight at the same time
+are sent once and their reply is shared. The gateway serves a small HTTP API
+with JSON bodies over TCP and/or a Unix socket:
+
+    GET  /bulbs                      Known bulbs with their cached state.
+    GET  /bulbs/<ip>/status          `get_sysinfo` response.
+    GET  /bulbs/<ip>/state           Light state dict.
+    GET  /bulbs/<ip>/details         Light details dict, fetched once.
+    POST /bulbs/<ip>/transition      Keyword args of `transite_light_state`.
+    GET  /metrics                    Request metrics in the Prometheus format.
+
+Reads take a `max_age` query parameter in seconds, the gateway default is
+used without it. Bulbs are added on first request; `<ip>` may carry a port.
+
+Run with `python -m tplight serve` or `python -m tplight.server`, and talk
+to it with `GatewayClient` or e.g. `curl --unix-socket`.
+"""
+
+import argparse
+import asyncio
+import http.client
+import ipaddress
+import json
+import logging
+import os
+import signal
+import socket
+import time
+import urllib.parse
+
+from . import metrics
+from . import protocol
+from .aio import AsyncLB130
+from .retry import BulbUnavailableError
+
+DEFAULT_HTTP = '127.0.0.1:8999'
+
+REASONS = {
+    200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+    500: 'Internal Server Error', 502: 'Bad Gateway', 503: 'Service Unavailable',
+    504: 'Gateway Timeout',
+}
+
+
+class HTTPError(Exception):
+    """Error answered to the client with the status code."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Gateway(object):
+    """
+    Warm bulbs of a fleet with cached status and shared concurrent reads.
+
+    Use within a running event loop. The methods take the bulb as `ip` or
+    `ip:port` string.
+    """
+
+    def __init__(self, max_age=5.0, retry_policy=None):
+        """
+        Initialise the gateway.
+
+        Args:
+            max_age: Maximum age of the cached status in seconds for reads
+                without explicit `max_age`.
+            retry_policy: Callable returning the retry policy of a new bulb.
+                `AdaptiveRetryPolicy` by default.
+        """
+        self.max_age = max_age
+        self.retry_policy = retry_policy
+        # `(ip, port)` of the bulb to its `AsyncLB130`
+        self.__lights = {}
+        # `(ip, port)` of the bulb to (monotonic time, get_sysinfo response)
+        self.__status = {}
+        self.__details = {}
+        # `(ip, port)` to monotonic time of the last status or transition reply
+        self.__state_time = {}
+        # Reads in flight by (`(ip, port)`, kind)
+        self.__reads = {}
+        self.shared_reads = 0
+
+    @property
+    def bulbs(self):
+        """Get the known bulbs as `ip`, or `ip:port` for other ports than the default one."""
+        return [
+            ip if port == AsyncLB130.port else f'{ip}:{port}' for ip, port in self.__lights
+        ]
+
+    @staticmethod
+    def address(bulb):
+        """Get `(ip, port)` of the bulb given as `ip` or `ip:port`."""
+        ip, _, port = bulb.partition(':')
+        try:
+            ipaddress.IPv4Address(ip)
+            port = int(port) if port else AsyncLB130.port
+        except ValueError:
+            raise ValueError(f'Invalid bulb address: {bulb}')
+        return ip, port
+
+    def light(self, bulb):
+        """Get the `AsyncLB130` of the bulb, created on first use."""
+        address = self.address(bulb)
+        light = self.__lights.get(address)
+        if light is None:
+            retry_policy = self.retry_policy() if self.retry_policy else None
+            light = self.__lights[address] = AsyncLB130(address[0], retry_policy=retry_policy)
+            light.port = address[1]
+        return light
+
+    async def warm(self, bulbs):
+        """Fetch the status of the bulbs concurrently. Return dict of bulbs to errors."""
+        bulbs = list(bulbs)
+        results = await asyncio.gather(
+            *(self.status(bulb, max_age=0) for bulb in bulbs), return_exceptions=True
+        )
+        return {
+            bulb: result if isinstance(result, Exception) else None
+            for bulb, result in zip(bulbs, results)
+        }
+
+    async def status(self, bulb, max_age=None):
+        """Get the `get_sysinfo` response, from the cache if younger than `max_age`."""
+        light = self.light(bulb)
+        bulb = self.address(bulb)
+        cached = self.__status.get(bulb)
+        if cached is not None and self.__fresh(cached[0], max_age):
+            return cached[1]
+
+        async def fetch():
+            # `status()` updates the state of the bulb object too
+            data = json.loads(await light.status())
+            self.__status[bulb] = (time.monotonic(), data)
+            self.__state_time[bulb] = time.monotonic()
+            return data
+
+        return await self.__share((bulb, 'status'), fetch)
+
+    async def state(self, bulb, max_age=None):
+        """Get the light state dict, from the cache if younger than `max_age`."""
+        light = self.light(bulb)
+        if not self.__fresh(self.__state_time.get(self.address(bulb)), max_age):
+            await self.status(bulb, max_age)
+        return self.__light_state(light)
+
+    async def details(self, bulb):
+        """Get the light details dict. They are fetched once."""
+        light = self.light(bulb)
+        bulb = self.address(bulb)
+        details = self.__details.get(bulb)
+        if details is None:
+            data = await self.__share((bulb, 'details'), light.light_details)
+            details = self.__details[bulb] = protocol.parse_light_details(data)
+        return details
+
+    async def transite(self, bulb, **kwargs):
+        """
+        Send the transition like `AsyncLB130.transite_light_state`. Return the light state.
+
+        The `transition_period` applies to this transition only, 0 by default.
+        """
+        light = self.light(bulb)
+        # The bulb object keeps the last period, another client's must not be used
+        kwargs.setdefault('transition_period', 0)
+        await light.transite_light_state(**kwargs)
+        bulb = self.address(bulb)
+        # The reply holds the new light state, the rest of the status is outdated
+        self.__status.pop(bulb, None)
+        self.__state_time[bulb] = time.monotonic()
+        return self.__light_state(light)
+
+    def cached_state(self, bulb):
+        """Get the cached light state dict and its age in seconds, None if never read."""
+        updated = self.__state_time.get(self.address(bulb))
+        age = None if updated is None else time.monotonic() - updated
+        return self.__light_state(self.light(bulb)), age
+
+    def __fresh(self, updated, max_age):
+        if max_age is None:
+            max_age = self.max_age
+        return updated is not None and time.monotonic() - updated <= max_age
+
+    @staticmethod
+    def __light_state(light):
+        return {
+            'on_off': light.on_off,
+            'hue': light.hue,
+            'saturation': light.saturation,
+            'brightness': light.brightness,
+            'color_temp': light.temperature,
+            'mode': light.mode,
+        }
+
+    async def __share(self, key, factory):
+        """Await the read of the key in flight, or start it with the factory."""
+        task = self.__reads.get(key)
+        if task is None:
+            task = self.__reads[key] = asyncio.ensure_future(factory())
+            task.add_done_callback(lambda _: self.__reads.pop(key, None))
+        else:
+            self.shared_reads += 1
+        # A client going away does not cancel the read shared with others
+        return await asyncio.shield(task)
+
+
+class GatewayServer(object):
+    """HTTP API of the `Gateway` over TCP and Unix sockets."""
+
+    def __init__(self, gateway, collector=None):
+        """
+        Initialise the server.
+
+        Args:
+            gateway: `Gateway` to serve.
+            collector: `tplight.metrics.MetricsCollector` exported at
+                `/metrics`, the path is not found without it.
+        """
+        self.gateway = gateway
+        self.collector = collector
+        self.__servers = []
+        self.__paths = []
+
+    async def start(self, http=None, unix=None):
+        """Listen on `host:port` and/or the Unix socket path."""
+        if http is not None:
+            host, _, port = http.rpartition(':')
+            self.__servers.append(
+                await asyncio.start_server(self.__serve, host or None, int(port))
+            )
+        if unix is not None:
+            if os.path.exists(unix):
+                # Left by a daemon which did not stop cleanly
+                os.unlink(unix)
+            self.__servers.append(await asyncio.start_unix_server(self.__serve, unix))
+            self.__paths.append(unix)
+
+    @property
+    def addresses(self):
+        """Get the listening addresses: `(host, port)` tuples and Unix socket paths."""
+        return [sock.getsockname() for server in self.__servers for sock in server.sockets]
+
+    async def serve_forever(self):
+        """Serve until cancelled."""
+        await asyncio.gather(*(server.serve_forever() for server in self.__servers))
+
+    async def close(self):
+        """Stop listening."""
+        for server in self.__servers:
+            server.close()
+            await server.wait_closed()
+        for path in self.__paths:
+            if os.path.exists(path):
+                os.unlink(path)
+        self.__servers = []
+        self.__paths = []
+
+    async def handle(self, method, path, query, body):
+        """
+        Answer one API request.
+
+        Returns:
+            Tuple of the status code, the content type and the body bytes.
+        """
+        try:
+            if path == '/metrics' and self.collector is not None:
+                self.__check_method(method, 'GET')
+                return 200, 'text/plain; version=0.0.4', self.collector.prometheus().encode()
+            result = await self.__route(method, path, query, body)
+        except HTTPError as e:
+            status, result = e.status, {'error': str(e)}
+        except BulbUnavailableError as e:
+            status, result = 503, {'error': str(e)}
+        except protocol.BulbError as e:
+            status, result = 502, {'error': str(e)}
+        except RuntimeError as e:
+            status, result = 504, {'error': str(e)}
+        except (TypeError, ValueError) as e:
+            status, result = 400, {'error': str(e)}
+        except Exception as e:
+            logging.exception('Failed to answer %s %s', method, path)
+            status, result = 500, {'error': str(e)}
+        else:
+            status = 200
+        return status, 'application/json', json.dumps(result).encode()
+
+    async def __route(self, method, path, query, body):
+        parts = path.strip('/').split('/')
+        if parts == ['bulbs']:
+            self.__check_method(method, 'GET')
+            bulbs = []
+            for bulb in self.gateway.bulbs:
+                state, age = self.gateway.cached_state(bulb)
+                bulbs.append({'bulb': bulb, 'state': state, 'age': age})
+            return bulbs
+        if len(parts) != 3 or parts[0] != 'bulbs':
+            raise HTTPError(404, f'Unknown path {path}')
+        _, bulb, action = parts
+        max_age = float(query['max_age'][0]) if 'max_age' in query else None
+        if action == 'status':
+            self.__check_method(method, 'GET')
+            return await self.gateway.status(bulb, max_age)
+        if action == 'state':
+            self.__check_method(method, 'GET')
+            return await self.gateway.state(bulb, max_age)
+        if action == 'details':
+            self.__check_method(method, 'GET')
+            return await self.gateway.details(bulb)
+        if action == 'transition':
+            self.__check_method(method, 'POST')
+            kwargs = json.loads(body or b'{}')
+            if not isinstance(kwargs, dict):
+                raise ValueError('Transition body should be a JSON object')
+            return await self.gateway.transite(bulb, **kwargs)
+        raise HTTPError(404, f'Unknown path {path}')
+
+    @staticmethod
+    def __check_method(method, allowed):
+        if method != allowed:
+            raise HTTPError(405, f'Use {allowed}')
+
+    async def __serve(self, reader, writer):
+        """Answer the requests of one connection, kept alive like HTTP/1.1 does."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    method, target, version = line.decode('latin_1').split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin_1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = (
+                    version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                )
+                try:
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    # The end of the body is unknown, the connection cannot be reused
+                    status, content_type = 400, 'application/json'
+                    payload = json.dumps({'error': 'Invalid Content-Length'}).encode()
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    url = urllib.parse.urlsplit(target)
+                    status, content_type, payload = await self.handle(
+                        method, url.path, urllib.parse.parse_qs(url.query), body
+                    )
+                writer.write((
+                    f'HTTP/1.1 {status} {REASONS.get(status, "")}\r\n'
+                    f'Content-Type: {content_type}\r\n'
+                    f'Content-Length: {len(payload)}\r\n'
+                    f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'
+                ).encode('latin_1') + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix socket."""
+
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class GatewayClient(object):
+    """
+    Blocking client of the gateway API. The connection is kept open between
+    requests; close it with `close()` or use the client as a context manager.
+    """
+
+    def __init__(self, address=DEFAULT_HTTP, timeout=10.0):
+        """
+        Initialise the client.
+
+        Args:
+            address: `host:port` of the HTTP API or path of the Unix socket.
+            timeout: Timeout of the requests in seconds.
+        """
+        if os.sep in address:
+            self.__connection = UnixHTTPConnection(address, timeout)
+        else:
+            host, _, port = address.rpartition(':')
+            self.__connection = http.client.HTTPConnection(host, int(port), timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def bulbs(self):
+        """Get the known bulbs with their cached state."""
+        return self.__request('GET', '/bulbs')
+
+    def status(self, bulb, max_age=None):
+        """Get the `get_sysinfo` response of the bulb."""
+        return self.__request('GET', self.__path(bulb, 'status', max_age))
+
+    def state(self, bulb, max_age=None):
+        """Get the light state dict of the bulb."""
+        return self.__request('GET', self.__path(bulb, 'state', max_age))
+
+    def details(self, bulb):
+        """Get the light details dict of the bulb."""
+        return self.__request('GET', self.__path(bulb, 'details'))
+
+    def transite_light_state(self, bulb, **kwargs):
+        """Send the transition to the bulb. Return its new light state dict."""
+        return self.__request('POST', self.__path(bulb, 'transition'), kwargs)
+
+    def close(self):
+        """Close the connection."""
+        self.__connection.close()
+
+    @staticmethod
+    def __path(bulb, action, max_age=None):
+        path = f'/bulbs/{bulb}/{action}'
+        return path if max_age is None else f'{path}?max_age={max_age}'
+
+    def __request(self, method, path, data=None):
+        """Send the request. Return the decoded response."""
+        body = None if data is None else json.dumps(data)
+        headers = {} if body is None else {'Content-Type': 'application/json'}
+        self.__connection.request(method, path, body, headers)
+        response = self.__connection.getresponse()
+        result = json.loads(response.read())
+        if response.status == 400:
+            raise ValueError(result['error'])
+        if response.status != 200:
+            raise RuntimeError(result['error'])
+        return result
+
+
+async def serve(bulbs, http=None, unix=None, max_age=5.0):
+    """Run the gateway until cancelled, warming the bulbs first."""
+    collector = metrics.observe(metrics.MetricsCollector())
+    gateway = Gateway(max_age)
+    server = GatewayServer(gateway, collector)
+    # Stop cleanly on termination, removing the Unix socket
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    try:
+        for bulb, error in (await gateway.warm(bulbs)).items():
+            if error is not None:
+                logging.warning('Bulb %s did not answer: %s', bulb, error)
+        await server.start(http, unix)
+        for address in server.addresses:
+            logging.info('Listening on %s', address)
+        await server.serve_forever()
+    finally:
+        await server.close()
+        metrics.unobserve(collector)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(
+        prog='tplight serve', description='Serve the bulbs over a local HTTP API.'
+    )
+    p.add_argument('bulbs', nargs='*', help='Bulbs to warm up on start: IP or IP:port')
+    p.add_argument('--http', help=f'host:port to listen on, {DEFAULT_HTTP} without --unix')
+    p.add_argument('--unix', help='Path of the Unix socket to listen on')
+    p.add_argument(
+        '--max-age', type=float, default=5.0, help='Maximum age of the cached status in seconds'
+    )
+    p.add_argument('--verbose', '-v', action='store_true', help='Log the requests to the bulbs')
+    args = p.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    http = args.http or (None if args.unix else DEFAULT_HTTP)
+    try:
+        asyncio.run(serve(args.bulbs, http, args.unix, args.max_age))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+if __name__ == '__main__':
+    main()
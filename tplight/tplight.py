@@ -1,12 +1,18 @@
 #!/usr/bin/env python3
 """Control class for TP-Link A19-LB130 RBGW WiFi bulb."""
 
-import datetime
+import contextlib
 import socket
 import json
 import logging
 import time
 
+from . import metrics
+from . import protocol
+from .batch import Batch
+from .retry import AdaptiveRetryPolicy
+from .transport import DatagramTruncated, UDPTransport
+
 
 class LB130(object):
     """Methods for controlling the LB130 bulb."""
@@ -26,8 +32,6 @@ class LB130(object):
 
     __udp_ip = None
     __udp_port = 9999
-    __socket_timeout = 0.5
-    __max_retry = 5
     __on_off = 0
     __transition_period = 0
     __hue = 0
@@ -36,21 +40,53 @@ class LB130(object):
     __color_temp = 0
     __mode = ''
 
-    # Force quering the status every time when get property
+    # Maximum age of the cached status in seconds for property getters.
+    # None keeps the status until `refresh()` or a transition updates it.
+    max_age = None
+
+    # Force quering the status every time when get property. Same as `max_age = 0`.
     force_update = False
 
     __alias = ''
-    device_id = ''
-    lamp_beam_angle = 0
-    min_voltage = 0
-    max_voltage = 0
-    wattage = 0
-    incandescent_equivalent = 0
-    max_lumens = 0
-    color_rendering_index = 0
-
-    def __init__(self, ip_address):
-        """Initialise the bulb with an IP address."""
+    __device_id = ''
+    __status_loaded = False
+    __status_time = 0.0
+    __device_info = None
+    __light_details = None
+    __pending = None
+
+    def __init__(
+        self,
+        ip_address,
+        transport=None,
+        sysinfo=None,
+        lazy=False,
+        cache=None,
+        max_age=None,
+        retry_policy=None,
+    ):
+        """
+        Initialise the bulb with an IP address.
+
+        Args:
+            ip_address: IP address of the bulb.
+            transport: Transport to talk to the bulb through, e.g.
+                `tplight.transport.TCPTransport` or one from
+                `tplight.transport.TransportPool`. A dedicated `UDPTransport`
+                is created if not provided.
+            sysinfo: `get_sysinfo` response already received from the bulb,
+                e.g. by `tplight.discover()`. If provided, the bulb is
+                initialised from it without any network I/O.
+            lazy: Do no network I/O until a value is actually needed. The
+                status is fetched on first read of a bulb property and the
+                light details on first read of a hardware property.
+            cache: `tplight.cache.DeviceCache` to take the light details
+                from. Known bulbs then cost no request for them.
+            max_age: Maximum age of the cached status in seconds. Property
+                getters fetch the status again when it is older.
+            retry_policy: `tplight.retry.RetryPolicy` deciding reply timeouts
+                and retries. `AdaptiveRetryPolicy` by default.
+        """
 
         split_ip = tuple(int(i) if i.isdigit() else -1 for i in ip_address.split('.'))
         valid_ip = (len(split_ip) == 4) and all(
@@ -60,23 +96,37 @@ class LB130(object):
             raise ValueError('Invalid bulb IP address.')
 
         self.__udp_ip = ip_address
+        if transport is None:
+            transport = UDPTransport(ip_address, self.__udp_port)
+        self.__transport = transport
+        self.__cache = cache
+        self.retry_policy = retry_policy or AdaptiveRetryPolicy()
+        if max_age is not None:
+            self.max_age = max_age
+
+        if sysinfo is not None:
+            self.__apply_sysinfo(sysinfo)
+        if lazy or sysinfo is not None:
+            return
 
-        # Parse the sysinfo JSON message to get the
-        # status of the various parameters.
-        self.__update_self_status()
-
-        # Parse the light details JSON message to get the
-        # status of the various parameters.
-        data = self.light_details()
-
-        light_details_data = data['smartlife.iot.smartbulb.lightingservice']['get_light_details']
-        self.lamp_beam_angle = int(light_details_data['lamp_beam_angle'])
-        self.min_voltage = int(light_details_data['min_voltage'])
-        self.max_voltage = int(light_details_data['max_voltage'])
-        self.wattage = int(light_details_data['wattage'])
-        self.incandescent_equivalent = int(light_details_data['incandescent_equivalent'])
-        self.max_lumens = int(light_details_data['max_lumens'])
-        self.color_rendering_index = str(light_details_data['color_rendering_index'])
+        try:
+            if self.__cached_entry() is None:
+                # Fetch sysinfo and light details in one message
+                self.__load_all()
+            else:
+                # Parse the sysinfo JSON message to get the
+                # status of the various parameters.
+                self.__update_self_status()
+                self.__get_light_details()
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     def __str__(self):
         return (
@@ -108,54 +158,103 @@ class LB130(object):
             mode: Target bulb operational mode: `normal` or `circadian`.
             synchronous: Put sleep until the end of transition_period if True.
         """
-        data = {'smartlife.iot.smartbulb.lightingservice': {
-            'transition_light_state': {'ignore_default': 1}
-        }}
-        state = data['smartlife.iot.smartbulb.lightingservice']['transition_light_state']
-
-        if ('hue' in kwargs or 'saturation' in kwargs):
-            if 'color_temp' in kwargs:
-                raise ValueError('color_temp should not be set with hue or saturation.')
-            kwargs['color_temp'] = 0
-
         if 'transition_period' in kwargs:
             self.transition_period = kwargs['transition_period']
-        state['transition_period'] = self.__transition_period
-
-        def state_setter(arg, arg_type, checker):
-            if arg in kwargs:
-                casted_arg = arg_type(kwargs[arg])
-                if not checker(casted_arg):
-                    raise ValueError(arg + ' is wrong.')
-                setattr(self, '__' + arg, casted_arg)  # self.__arg = kwargs['arg']
-                state[arg] = casted_arg
-
-        state_setter('on_off', int, lambda x: x in (0, 1))
-        state_setter('hue', int, lambda x: self.min_hue <= x <= self.max_hue)
-        state_setter('saturation', int, lambda x: self.min_saturation <= x <= self.max_saturation)
-        state_setter('brightness', int, lambda x: self.min_brightness <= x <= self.max_brightness)
-        state_setter(
-            'color_temp', int, lambda x: self.min_color_temp <= x <= self.max_color_temp or x == 0
-        )
-        state_setter('mode', str, lambda x: x in ('normal', 'circadian'))
+        data = protocol.transition_request(self, self.__transition_period, kwargs)
+
+        if self.__pending is not None:
+            # Coalescing: validated above, send on the end of the block
+            self.__pending = protocol.merge_transition(self.__pending, {
+                arg: value for arg, value in kwargs.items()
+                if arg not in ('transition_period', 'synchronous')
+            })
+            if not kwargs.get('synchronous'):
+                return
+            data = self.__flush_pending()
+            self.__pending = {}
+            if data is None:
+                return
+
+        self.__fetch_transition(data, kwargs.get('synchronous'))
+
+    @contextlib.contextmanager
+    def coalesce(self):
+        """
+        Collect state changes made in the block and send them as one
+        transition at its end. Use as context manager:
 
-        if kwargs.get('synchronous'):
-            start_time = time.time()
+            with light.coalesce():
+                light.brightness = 50
+                light.saturation = 90
+                light.hue = 0
 
-        self.__fetch_dict(data)
+        Values equal to the cached state are not sent. A synchronous
+        transition inside the block sends the collected changes at once.
+        Nothing is sent if the block raises an exception.
+        """
+        if self.__pending is not None:
+            # Nested block joins the outer one
+            yield self
+            return
 
-        if kwargs.get('synchronous'):
-            time.sleep(self.__transition_period / 1000.0 - (time.time() - start_time))
+        self.__pending = {}
+        try:
+            yield self
+        except BaseException:
+            self.__pending = None
+            raise
+        data = self.__flush_pending()
+        if data is not None:
+            self.__fetch_transition(data)
+
+    def batch(self):
+        """
+        Queue requests to send them to the bulb in one message.
+
+        Use as context manager:
+
+            with light.batch() as b:
+                sysinfo = b.sysinfo()
+                date = b.time()
+            print(date.result())
+
+        Returns:
+            `LB130Batch` object.
+        """
+        return LB130Batch(
+            self,
+            self.__send_batch,
+            on_sysinfo=self.__apply_sysinfo,
+            on_light_details=self.__set_light_details,
+            on_transition=self.__apply_transition,
+        )
 
     def status(self):
         """Get the connection status from the bulb."""
         return json.dumps(self.__update_self_status())
 
+    def refresh(self):
+        """Fetch the status from the bulb. Return the light state dict."""
+        self.__update_self_status()
+        return self.light_state()
+
+    def light_state(self, max_age=None):
+        """
+        Get the light state dict: `on_off`, `hue`, `saturation`, `brightness`,
+        `color_temp` and `mode`.
+
+        Args:
+            max_age: Maximum age of the cached status in seconds. Overrides
+                `max_age` of the bulb for this call.
+        """
+        self.__load_status(max_age)
+        return self.__get_light_state()
+
     def light_details(self):
         """Get the light details from the bulb."""
-        return self.__fetch_dict(
-            {'smartlife.iot.smartbulb.lightingservice': {'get_light_details': ''}}
-        )
+        data = self.__fetch_dict(protocol.GET_LIGHT_DETAILS)
+        self.__set_light_details(data)
+        return data
 
     def on(self):
         """Set the bulb to an ON state."""
@@ -165,86 +264,176 @@ class LB130(object):
         """Set the bulb to an OFF state."""
         self.transite_light_state(on_off=0)
 
-    def ison(self):
-        """Check if bulb is on."""
-        self.__update_self_status()
+    def ison(self, max_age=0):
+        """
+        Check if bulb is on.
+
+        Args:
+            max_age: Maximum age of the cached status in seconds. The status
+                is fetched from the bulb by default.
+        """
+        self.__load_status(max_age)
         return self.__on_off
 
+    def pipeline(self, requests):
+        """
+        Send several requests at once and wait for all replies.
+
+        Over a reliable transport, e.g. `TCPTransport`, all requests are
+        written to the connection before reading the replies. Otherwise
+        they are sent one by one.
+
+        Args:
+            requests: List of request dicts.
+
+        Returns:
+            List of response dicts in the order of the requests.
+        """
+        if getattr(self.__transport, 'reliable', False):
+            return self.__fetch_pipelined(requests)
+        return [self.__fetch_dict(data) for data in requests]
+
+    def close(self):
+        """Close the connection to the bulb."""
+        self.__transport.close()
+
     def reboot(self):
         """Reboot the bulb."""
-        self.__fetch_dict({'smartlife.iot.common.system': {'reboot': {'delay': 1}}})
+        self.__fetch_dict(protocol.REBOOT)
+
+    @property
+    def ip_address(self):
+        """Get the bulb IP address."""
+        return self.__udp_ip
+
+    @property
+    def port(self):
+        """Get the bulb port."""
+        return self.__transport.port
 
     @property
     def alias(self):
         """Get the device alias."""
+        self.__load_status()
         return self.__alias
 
     @alias.setter
     def alias(self, name):
         """Set the device alias."""
-        if not isinstance(name, str):
-            ValueError('name should be str.')
-        self.__fetch_dict({'smartlife.iot.common.system': {'set_dev_alias': {'alias': name}}})
+        self.__fetch_dict(protocol.set_alias_request(name))
+
+    @property
+    def device_id(self):
+        """Get the device id."""
+        self.__load_status()
+        return self.__device_id
+
+    @property
+    def device_info(self):
+        """Get the static sysinfo values: model, firmware version, etc."""
+        if self.__device_info is None:
+            entry = self.__cached_entry()
+            if entry is not None:
+                return dict(entry['sysinfo'])
+            self.__update_self_status()
+        return dict(self.__device_info)
+
+    @property
+    def lamp_beam_angle(self):
+        """Get the lamp beam angle."""
+        return self.__get_light_details()['lamp_beam_angle']
+
+    @property
+    def min_voltage(self):
+        """Get the minimum voltage."""
+        return self.__get_light_details()['min_voltage']
+
+    @property
+    def max_voltage(self):
+        """Get the maximum voltage."""
+        return self.__get_light_details()['max_voltage']
+
+    @property
+    def wattage(self):
+        """Get the wattage."""
+        return self.__get_light_details()['wattage']
+
+    @property
+    def incandescent_equivalent(self):
+        """Get the wattage of equivalent incandescent lamp."""
+        return self.__get_light_details()['incandescent_equivalent']
+
+    @property
+    def max_lumens(self):
+        """Get the maximum luminous flux."""
+        return self.__get_light_details()['max_lumens']
+
+    @property
+    def color_rendering_index(self):
+        """Get the color rendering index."""
+        return self.__get_light_details()['color_rendering_index']
 
     @property
     def time(self):
         """Get the date and time from the device."""
-        response = self.__fetch_dict({'smartlife.iot.common.timesetting': {'get_time': {}}})
-        get_time = response['smartlife.iot.common.timesetting']['get_time']
-
-        return datetime.datetime(
-            get_time['year'],
-            get_time['month'],
-            get_time['mday'],
-            get_time['hour'],
-            get_time['min'],
-            get_time['sec'],
-        )
+        return protocol.parse_time(self.__fetch_dict(protocol.GET_TIME))
 
     @time.setter
     def time(self, date):
         """Set the date and time on the device."""
-        if isinstance(date, datetime.datetime):
-            self.__fetch_dict({'smartlife.iot.common.timesetting': {
-                'set_time': {
-                    'year': date.year,
-                    'month': date.month,
-                    'mday': date.day,
-                    'hour': date.hour,
-                    'min': date.minute,
-                    'sec': date.second,
-                }
-            }})
-        else:
-            raise ValueError('Invalid type: must pass a datetime object')
-        return
+        self.__fetch_dict(protocol.set_time_request(date))
 
     @property
     def timezone(self):
         """Get the timezone from the device."""
-        data = self.__fetch_dict({'smartlife.iot.common.timesetting': {'get_timezone': {}}})
-        timezone = data['smartlife.iot.common.timesetting']['get_timezone']['index']
-        return timezone
+        return protocol.parse_timezone(self.__fetch_dict(protocol.GET_TIMEZONE))
 
     @timezone.setter
     def timezone(self, timezone):
         """Set the timezone on the device."""
-        if timezone >= 0 and timezone <= 109:
-            date = self.time
-            self.__fetch_dict({'smartlife.iot.common.timesetting': {
-                'set_timezone': {
-                    'index': timezone,
-                    'year': date.year,
-                    'month': date.month,
-                    'mday': date.day,
-                    'hour': date.hour,
-                    'min': date.minute,
-                    'sec': date.second,
-                }
-            }})
-        else:
-            raise ValueError('Timezone out of range: 0 to 109')
-        return
+        protocol.check_timezone(timezone)
+        self.__fetch_dict(protocol.set_timezone_request(timezone, self.time))
+
+    def rules(self):
+        """Get the list of schedule rule dicts stored on the bulb."""
+        return protocol.parse_rules(self.__fetch_dict(protocol.GET_RULES))
+
+    def add_rule(self, rule):
+        """
+        Store the schedule rule on the bulb.
+
+        Args:
+            rule: Rule dict, e.g. built with `tplight.schedule.light_rule`.
+
+        Returns:
+            ID of the new rule.
+        """
+        data = self.__fetch_dict(protocol.add_rule_request(rule))
+        return data[protocol.SCHEDULE]['add_rule']['id']
+
+    def delete_rule(self, rule_id):
+        """Delete the schedule rule with the ID from the bulb."""
+        self.__fetch_dict(protocol.delete_rule_request(rule_id))
+
+    def delete_all_rules(self):
+        """Delete all schedule rules from the bulb."""
+        self.__fetch_dict(protocol.DELETE_ALL_RULES)
+
+    def next_action(self):
+        """Get the next scheduled action dict, its `type` is -1 if there is none."""
+        return protocol.parse_next_action(self.__fetch_dict(protocol.GET_NEXT_ACTION))
+
+    def enable_schedule(self, enable=True):
+        """Turn on or off all schedule rules of the bulb."""
+        self.__fetch_dict(protocol.set_schedule_enable_request(enable))
+
+    def daystat(self, year, month):
+        """Get dict of `datetime.date` to energy used on the day in Wh for the month."""
+        return protocol.parse_daystat(self.__fetch_dict(protocol.daystat_request(year, month)))
+
+    def monthstat(self, year):
+        """Get dict of month number to energy used in the month in Wh for the year."""
+        return protocol.parse_monthstat(self.__fetch_dict(protocol.monthstat_request(year)))
 
     @property
     def transition_period(self):
@@ -265,8 +454,7 @@ class LB130(object):
     @property
     def hue(self):
         """Get the bulb hue."""
-        if self.force_update:
-            self.__update_self_status()
+        self.__load_status()
         return self.__hue
 
     @hue.setter
@@ -277,8 +465,7 @@ class LB130(object):
     @property
     def saturation(self):
         """Get the bulb saturation."""
-        if self.force_update:
-            self.__update_self_status()
+        self.__load_status()
         return self.__saturation
 
     @saturation.setter
@@ -289,8 +476,7 @@ class LB130(object):
     @property
     def brightness(self):
         """Get the bulb brightness."""
-        if self.force_update:
-            self.__update_self_status()
+        self.__load_status()
         return self.__brightness
 
     @brightness.setter
@@ -301,8 +487,7 @@ class LB130(object):
     @property
     def temperature(self):
         """Get the bulb color temperature."""
-        if self.force_update:
-            self.__update_self_status()
+        self.__load_status()
         return self.__color_temp
 
     @temperature.setter
@@ -313,8 +498,7 @@ class LB130(object):
     @property
     def mode(self):
         """Get the bulb color mode."""
-        if self.force_update:
-            self.__update_self_status()
+        self.__load_status()
         return self.__mode
 
     @mode.setter
@@ -325,6 +509,7 @@ class LB130(object):
     @property
     def hsb(self):
         """Get the bulb hue, saturation, and brightness."""
+        self.__load_status()
         return (self.__hue, self.__saturation, self.__brightness)
 
     @hsb.setter
@@ -339,81 +524,351 @@ class LB130(object):
 
     # Private Methods
 
-    @staticmethod
-    def __encrypt(value, key):
-        """Encrypt the command string."""
-        valuelist = list(value)
+    def __load_status(self, max_age=None):
+        """Fetch sysinfo if it was not fetched yet or is older than `max_age`."""
+        if max_age is None:
+            max_age = 0 if self.force_update else self.max_age
+        if (
+            not self.__status_loaded
+            or max_age is not None and time.monotonic() - self.__status_time > max_age
+        ):
+            self.__update_self_status()
 
-        for i in range(len(valuelist)):
-            var = ord(valuelist[i])
-            valuelist[i] = chr(var ^ int(key))
-            key = ord(valuelist[i])
-        return bytearray(''.join(valuelist).encode('latin_1'))
+    def __cached_entry(self):
+        """Find the cache entry of the bulb. Return None if there is no cache or entry."""
+        if self.__cache is None:
+            return None
+        if self.__device_info is not None:
+            return self.__cache.lookup(device_id=self.__device_info.get('deviceId'))
+        return self.__cache.lookup(ip_address=self.__udp_ip)
+
+    def __get_light_details(self):
+        """Get the light details from the cache or fetch them from the bulb."""
+        if self.__light_details is None:
+            entry = self.__cached_entry()
+            if entry is not None:
+                self.__light_details = entry['light_details']
+            elif self.__cache is not None and self.__device_info is None:
+                # The bulb may be known under another address
+                self.__load_all()
+            else:
+                self.light_details()
+                self.__store_cache()
+        return self.__light_details
+
+    def __load_all(self):
+        """Fetch sysinfo and light details in one message."""
+        with self.batch() as batch:
+            sysinfo = batch.sysinfo()
+            light_details = batch.light_details()
+        sysinfo.result()
+        if self.__light_details is None:
+            light_details.result()
+            self.__store_cache()
+
+    def __set_light_details(self, data):
+        """Update local light details from `get_light_details` response."""
+        self.__light_details = protocol.parse_light_details(data)
+
+    def __store_cache(self):
+        """Save fetched light details to the cache."""
+        if self.__cache is not None and self.__device_info is not None:
+            self.__cache.store(self.__udp_ip, self.__device_info, self.__light_details)
+
+    def __fetch_transition(self, data, synchronous=False):
+        """Send `transition_light_state` request and update local values."""
+        if synchronous:
+            start_time = time.time()
 
-    @staticmethod
-    def __decrypt(value, key):
-        """Decrypt the command string."""
-        valuelist = list(value.decode('latin_1'))
+        response = self.__fetch_dict(data)
+        self.__apply_transition(data, response)
 
-        for i in range(len(valuelist)):
-            var = ord(valuelist[i])
-            valuelist[i] = chr(var ^ key)
-            key = var
+        if synchronous:
+            time.sleep(max(0, self.__transition_period / 1000.0 - (time.time() - start_time)))
 
-        return ''.join(valuelist)
+    def __flush_pending(self):
+        """
+        Build the request of coalesced changes and stop coalescing. Return
+        None if nothing changed.
+        """
+        pending, self.__pending = self.__pending, None
+        if self.__status_loaded:
+            pending = protocol.drop_unchanged(pending, self.__get_light_state())
+        if not pending:
+            return None
+        return protocol.transition_request(self, self.__transition_period, pending)
 
     def __update_self_status(self):
         """Fetch sysinfo from the bulb and update local values."""
-        data = self.__fetch_dict({'system': {'get_sysinfo': {}}})
-        sysinfo_data = data['system']['get_sysinfo']
-        light_state_data = sysinfo_data['light_state']
-        self.__alias = sysinfo_data['alias']
-        self.device_id = str(sysinfo_data['deviceId'])
-        self.__on_off = int(light_state_data['on_off'])
-        if not self.__on_off:
-            light_state_data = light_state_data['dft_on_state']
-
-        self.__hue = int(light_state_data['hue'])
-        self.__saturation = int(light_state_data['saturation'])
-        self.__brightness = int(light_state_data['brightness'])
-        self.__color_temp = int(light_state_data['color_temp'])
-        self.__mode = light_state_data['mode']
-
+        data = self.__fetch_dict(protocol.GET_SYSINFO)
+        self.__apply_sysinfo(data)
         return data
 
-    def __fetch_data(self, message):
-        """Fetch data from the device."""
-        enc_message = self.__encrypt(message, self.encryption_key)
-
-        for retry in range(1, self.__max_retry + 1):
-            try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                sock.settimeout(self.__socket_timeout * retry)
-                sock.sendto(enc_message, (self.__udp_ip, self.__udp_port))
-                data_received = False
-                dec_data = ''
-                while True:
-                    data, _ = sock.recvfrom(1024)  # buffer size is 1024 bytes
-                    dec_data = self.__decrypt(data, self.encryption_key)
-                    if '}}}' in dec_data:  # end of sysinfo message
-                        data_received = True
-                        break
-
-                if data_received:
-                    if '"err_code":0' in dec_data:
-                        return dec_data
-                    else:
-                        raise RuntimeError('Bulb returned error: ' + dec_data)
-                else:
-                    raise socket.timeout()
-            except socket.timeout:
-                logging.debug('Socket timed out. Try %d/%d' % (retry, self.__max_retry + 1))
-
-        raise RuntimeError('Error connecting to bulb')
-
-    def __fetch_dict(self, data):
+    def __apply_sysinfo(self, data):
+        """Update local values from `get_sysinfo` response."""
+        sysinfo = protocol.parse_sysinfo(data)
+        self.__status_loaded = True
+        self.__status_time = time.monotonic()
+        self.__alias = sysinfo['alias']
+        self.__device_id = sysinfo['device_id']
+        self.__set_light_state(sysinfo)
+
+        device_info = protocol.parse_device_info(data)
+        if device_info != self.__device_info:
+            self.__device_info = device_info
+            self.__check_cache()
+
+    def __get_light_state(self):
+        """Get local light values as dict."""
+        return {
+            'on_off': self.__on_off,
+            'hue': self.__hue,
+            'saturation': self.__saturation,
+            'brightness': self.__brightness,
+            'color_temp': self.__color_temp,
+            'mode': self.__mode,
+        }
+
+    def __set_light_state(self, state):
+        """Update local light values present in the state dict."""
+        self.__on_off = state.get('on_off', self.__on_off)
+        self.__hue = state.get('hue', self.__hue)
+        self.__saturation = state.get('saturation', self.__saturation)
+        self.__brightness = state.get('brightness', self.__brightness)
+        self.__color_temp = state.get('color_temp', self.__color_temp)
+        self.__mode = state.get('mode', self.__mode)
+
+    def __apply_transition(self, request, response):
+        """
+        Write the result of successful transition to local values.
+
+        The bulb replies with its complete new light state. If the reply
+        lacks it, the requested values are used.
+        """
+        try:
+            state = protocol.parse_light_state(
+                response[protocol.LIGHTING]['transition_light_state']
+            )
+        except (KeyError, TypeError, ValueError):
+            self.__set_light_state(request[protocol.LIGHTING]['transition_light_state'])
+        else:
+            self.__set_light_state(state)
+            if self.__status_loaded:
+                self.__status_time = time.monotonic()
+
+    def __check_cache(self):
+        """Drop the cached light details if they belong to another device or firmware."""
+        if self.__cache is None:
+            return
+        entry = self.__cache.lookup(ip_address=self.__udp_ip)
+        if (
+            entry is not None
+            and self.__light_details is entry['light_details']
+            and not self.__cache.is_valid(entry, self.__device_info)
+        ):
+            self.__light_details = None
+
+        device_id = self.__device_info.get('deviceId')
+        entry = self.__cache.lookup(device_id=device_id)
+        if entry is not None:
+            if self.__cache.is_valid(entry, self.__device_info):
+                self.__cache.remember_address(self.__udp_ip, device_id)
+            else:
+                self.__cache.invalidate(device_id)
+
+    def __fetch_data(self, enc_message, request, check_errors=True, encode_time=0.0):
+        """Send the encrypted request to the device. Return response dict."""
+        event = metrics.RequestEvent(request, (self.__udp_ip, self.port), self.__transport_name())
+        event.encode_time = encode_time
+        start = time.perf_counter()
+        try:
+            call = self.retry_policy.begin()
+            for timeout in call:
+                event.attempts = call.attempts
+                try:
+                    self.__transport.send(enc_message)
+                    sent = time.perf_counter()
+                    event.bytes_sent += len(enc_message)
+                    deadline = time.monotonic() + timeout
+                    while True:
+                        data = self.__transport.receive(max(0, deadline - time.monotonic()))
+                        received = time.perf_counter()
+                        event.bytes_received += len(data)
+                        response = protocol.read_reply(data, request, self.encryption_key)
+                        event.decode_time += time.perf_counter() - received
+                        if response is not None:
+                            break
+                        logging.debug('Ignored unexpected datagram from %s', self.__udp_ip)
+
+                    event.rtt = received - sent
+                    event.response = response
+                    call.succeeded()
+                    if check_errors:
+                        protocol.check_reply(request, response)
+                    return response
+                except (socket.timeout, ConnectionError, DatagramTruncated):
+                    logging.debug('No reply from %s. Try %d', self.__udp_ip, call.attempts)
+                    self.__drop_late_replies()
+
+            call.failed()
+            raise RuntimeError('Error connecting to bulb')
+        except Exception as e:
+            event.fail(e)
+            raise
+        finally:
+            event.duration = time.perf_counter() - start
+            if metrics.observers:
+                metrics.emit(event)
+
+    def __fetch_pipelined(self, requests):
+        """Send all requests before reading the replies. Return response dicts in order."""
+        address = (self.__udp_ip, self.port)
+        transport = self.__transport_name()
+        events = [metrics.RequestEvent(data, address, transport) for data in requests]
+        messages = []
+        for data, event in zip(requests, events):
+            encode_start = time.perf_counter()
+            messages.append(protocol.encode(data, self.encryption_key))
+            event.encode_time = time.perf_counter() - encode_start
+        responses = [None] * len(requests)
+        start = time.perf_counter()
+        try:
+            call = self.retry_policy.begin()
+            for timeout in call:
+                missing = [i for i, response in enumerate(responses) if response is None]
+                try:
+                    for i in missing:
+                        self.__transport.send(messages[i])
+                        events[i].attempts += 1
+                        events[i].bytes_sent += len(messages[i])
+                    sent = time.perf_counter()
+                    deadline = time.monotonic() + timeout
+                    while missing:
+                        data = self.__transport.receive(max(0, deadline - time.monotonic()))
+                        received = time.perf_counter()
+                        for i in missing:
+                            response = protocol.read_reply(data, requests[i], self.encryption_key)
+                            if response is not None:
+                                responses[i] = events[i].response = response
+                                events[i].rtt = received - sent
+                                events[i].bytes_received += len(data)
+                                events[i].decode_time += time.perf_counter() - received
+                                missing.remove(i)
+                                break
+                        else:
+                            logging.debug('Ignored unexpected reply from %s', self.__udp_ip)
+
+                    call.succeeded()
+                    for request, response, event in zip(requests, responses, events):
+                        try:
+                            protocol.check_reply(request, response)
+                        except RuntimeError as e:
+                            event.fail(e)
+                    for event in events:
+                        if event.error is not None:
+                            raise event.error
+                    return responses
+                except (socket.timeout, ConnectionError, DatagramTruncated):
+                    logging.debug('No reply from %s. Try %d', self.__udp_ip, call.attempts)
+                    self.__drop_late_replies()
+
+            call.failed()
+            raise RuntimeError('Error connecting to bulb')
+        except Exception as e:
+            for event in events:
+                if event.error is None and event.response is None:
+                    event.fail(e)
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            for event in events:
+                event.duration = duration
+            if metrics.observers:
+                for event in events:
+                    metrics.emit(event)
+
+    def __transport_name(self):
+        return 'tcp' if getattr(self.__transport, 'reliable', False) else 'udp'
+
+    def __drop_late_replies(self):
+        """Reconnect a stream transport, so a late reply is not read as the next one."""
+        if getattr(self.__transport, 'reliable', False):
+            self.__transport.close()
+
+    def __fetch_dict(self, data, check_errors=True):
         """Fetch dict from the device. Return value is a dict too."""
-        if not isinstance(data, dict):
-            raise ValueError('data should be dict.')
-        message = json.dumps(data)
-        return json.loads(self.__fetch_data(message))
+        start = time.perf_counter()
+        enc_message = protocol.encode(data, self.encryption_key)
+        return self.__fetch_data(
+            enc_message, data, check_errors, encode_time=time.perf_counter() - start
+        )
+
+    def __send_batch(self, data):
+        """Fetch dict from the device leaving `err_code` checks to the batch."""
+        return self.__fetch_dict(data, check_errors=False)
+
+
+class LB130Batch(Batch):
+    """
+    Requests to the LB130 bulb sent in one message. Created by `LB130.batch()`.
+
+    Every method queues one call and returns its `PendingResult`. Local
+    values of the bulb are updated when the batch is sent, as if the calls
+    were made one by one.
+    """
+
+    def __init__(self, light, send, on_sysinfo, on_light_details, on_transition):
+        super().__init__(send)
+        self.light = light
+        self.__on_sysinfo = on_sysinfo
+        self.__on_light_details = on_light_details
+        self.__on_transition = on_transition
+
+    def sysinfo(self):
+        """Queue `get_sysinfo`. Result is the response dict."""
+        return self.add(protocol.GET_SYSINFO, self.__hook(self.__on_sysinfo))
+
+    def light_details(self):
+        """Queue `get_light_details`. Result is the response dict."""
+        return self.add(protocol.GET_LIGHT_DETAILS, self.__hook(self.__on_light_details))
+
+    def time(self):
+        """Queue `get_time`. Result is datetime."""
+        return self.add(protocol.GET_TIME, protocol.parse_time)
+
+    def timezone(self):
+        """Queue `get_timezone`. Result is the timezone index."""
+        return self.add(protocol.GET_TIMEZONE, protocol.parse_timezone)
+
+    def set_time(self, date):
+        """Queue `set_time`."""
+        return self.add(protocol.set_time_request(date))
+
+    def transite_light_state(self, **kwargs):
+        """
+        Queue `transition_light_state`.
+
+        Accepts the same keyword arguments as `LB130.transite_light_state`
+        except `synchronous`.
+        """
+        if kwargs.get('synchronous'):
+            raise ValueError('synchronous is not supported in batch.')
+        if 'transition_period' in kwargs:
+            self.light.transition_period = kwargs['transition_period']
+        request = protocol.transition_request(
+            self.light, self.light.transition_period, kwargs
+        )
+
+        def parse(data):
+            self.__on_transition(request, data)
+            return data
+
+        return self.add(request, parse)
+
+    @staticmethod
+    def __hook(callback):
+        """Make parse function calling the callback and returning the response dict."""
+        def parse(data):
+            callback(data)
+            return data
+        return parse
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""Transitions longer than the maximum `transition_period` of the bulb."""
+
+import asyncio
+import collections
+import inspect
+import logging
+import threading
+import time
+
+
+class LongTransition(object):
+    """
+    Transition of one bulb split into steps of the maximum transition period.
+
+    The step plan is computed once from one snapshot of the light state: no
+    status is fetched between the steps. Every step sets absolute values on
+    the time line, so a lost step is corrected by the next one. Every step
+    turns the bulb on. Run it with `TransitionScheduler`.
+
+    Input values are normalized according to the limits of the bulb.
+    """
+
+    names = ('brightness', 'color_temp', 'hue', 'saturation')
+
+    def __init__(self, light, duration, state=None, **targets):
+        """
+        Initialise the transition and plan its steps.
+
+        Args:
+            light: `LB130` or any object with its limits and
+                `transite_light_state`, e.g. `AsyncLB130`.
+            duration: Duration of the transition in milliseconds.
+            state: Light state dict to start from. Taken from
+                `light.light_state()` if not provided, which `AsyncLB130`
+                does not have.
+            **targets: Target `brightness`, `color_temp`, `hue` and
+                `saturation`.
+        """
+        unknown = set(targets) - set(self.names)
+        if unknown:
+            raise ValueError('Unknown transition values: ' + ', '.join(sorted(unknown)))
+        if state is None:
+            state = light.light_state()
+
+        self.light = light
+        self.duration = max(0, int(duration))
+        self.errors = 0
+        self.values = {
+            name: (self.__clamp(name, state.get(name, target)), self.__clamp(name, target))
+            for name, target in targets.items()
+            if target is not None
+        }
+        self.__status = 'pending'
+        self.__started_at = None
+        self.__elapsed = 0
+        self.__steps = collections.deque(self.plan())
+
+    def __repr__(self):
+        return f'<LongTransition {self.__status} {self.elapsed}/{self.duration}ms>'
+
+    @property
+    def status(self):
+        """Get the transition status: `pending`, `running`, `paused`, `cancelled` or `done`."""
+        return self.__status
+
+    @property
+    def active(self):
+        """Check if the transition has not finished nor been cancelled."""
+        return self.__status in ('pending', 'running', 'paused')
+
+    @property
+    def elapsed(self):
+        """Get the time passed in the transition in milliseconds, excluding pauses."""
+        if self.__status == 'running':
+            return min(self.duration, int((time.monotonic() - self.__started_at) * 1000))
+        return self.__elapsed
+
+    @property
+    def next_due(self):
+        """
+        Get the monotonic time of the next step or of the transition end.
+        None if the transition is not running.
+        """
+        if self.__steps and self.__steps[0][0] is None:
+            # Freezing step of a pause is due at once
+            return 0.0
+        if self.__status == 'pending':
+            return 0.0
+        if self.__status != 'running':
+            return None
+        offset = self.__steps[0][0] if self.__steps else self.duration
+        return self.__started_at + offset / 1000
+
+    def state_at(self, elapsed):
+        """Get the planned values after `elapsed` milliseconds."""
+        ratio = min(1, elapsed / self.duration) if self.duration else 1
+        return {
+            name: round(start + (end - start) * ratio)
+            for name, (start, end) in self.values.items()
+        }
+
+    def plan(self, elapsed=0):
+        """
+        Compute the steps from `elapsed` milliseconds to the end.
+
+        Returns:
+            List of `(offset, kwargs)` pairs: the step start in milliseconds
+            from the transition start and `transite_light_state` arguments.
+        """
+        max_period = self.light.max_transition_period
+        steps = []
+        offset = elapsed
+        while True:
+            period = min(max_period, self.duration - offset)
+            kwargs = self.state_at(offset + period)
+            kwargs.update(on_off=1, transition_period=period)
+            steps.append((offset, kwargs))
+            offset += period
+            if offset >= self.duration:
+                return steps
+
+    def cancel(self):
+        """Stop sending steps. The bulb finishes its current step."""
+        if self.active:
+            self.__elapsed = self.elapsed
+            self.__status = 'cancelled'
+            self.__steps.clear()
+
+    def pause(self):
+        """Stop the bulb at the planned current values and stop sending steps."""
+        if self.__status != 'running':
+            return
+        self.__elapsed = self.elapsed
+        self.__status = 'paused'
+        kwargs = self.state_at(self.__elapsed)
+        kwargs.update(on_off=1, transition_period=0)
+        # Sent by the scheduler at once
+        self.__steps = collections.deque([(None, kwargs)])
+
+    def resume(self):
+        """Continue the paused transition from the values it was stopped at."""
+        if self.__status != 'paused':
+            return
+        self.__status = 'running'
+        self.__started_at = time.monotonic() - self.__elapsed / 1000
+        self.__steps = collections.deque(self.plan(self.__elapsed))
+
+    def _take_step(self):
+        """Get the arguments of the next step and advance the plan. None at the end."""
+        if not self.__steps:
+            self.__elapsed = self.duration
+            self.__status = 'done'
+            return None
+        offset, kwargs = self.__steps.popleft()
+        if offset is not None and self.__started_at is None:
+            self.__status = 'running'
+            self.__started_at = time.monotonic()
+        return kwargs
+
+    def __clamp(self, name, value):
+        low = getattr(self.light, 'min_' + name, value)
+        high = getattr(self.light, 'max_' + name, value)
+        return min(high, max(low, value))
+
+
+class TransitionScheduler(object):
+    """
+    Run long transitions of many bulbs in one thread or event loop.
+
+    Steps are sent on the monotonic clock without waiting for the end of the
+    previous step. Transitions may be added, paused and cancelled from other
+    threads while `run()` is waiting.
+    """
+
+    def __init__(self, transitions=()):
+        self.transitions = []
+        self.__condition = threading.Condition()
+        self.__wakeup = None
+        for transition in transitions:
+            self.add(transition)
+
+    def add(self, transition):
+        """Schedule the transition. Its first step is sent at once."""
+        with self.__condition:
+            self.transitions.append(transition)
+        self.__notify()
+        return transition
+
+    def transite(self, light, duration, **targets):
+        """Create `LongTransition` of the bulb and schedule it."""
+        return self.add(LongTransition(light, duration, **targets))
+
+    def cancel(self, transition=None):
+        """Cancel the transition or all of them."""
+        self.__control('cancel', transition)
+
+    def pause(self, transition=None):
+        """Pause the transition or all of them."""
+        self.__control('pause', transition)
+
+    def resume(self, transition=None):
+        """Resume the transition or all of them."""
+        self.__control('resume', transition)
+
+    def run(self):
+        """Send the steps until all transitions end. Paused transitions keep it waiting."""
+        while True:
+            due, wait = self.__due_steps()
+            if due is None:
+                return
+            for transition, kwargs in due:
+                self.__send(transition, kwargs)
+            if wait:
+                with self.__condition:
+                    self.__condition.wait(wait)
+
+    async def run_async(self):
+        """Send the steps until all transitions end, awaiting asynchronous bulbs."""
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        self.__wakeup = (loop, wakeup)
+        try:
+            while True:
+                due, wait = self.__due_steps()
+                if due is None:
+                    return
+                steps = []
+                for transition, kwargs in due:
+                    result = self.__send(transition, kwargs)
+                    if inspect.isawaitable(result):
+                        steps.append(self.__await_step(transition, result))
+                await asyncio.gather(*steps)
+                if wait:
+                    wakeup.clear()
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            self.__wakeup = None
+
+    def __due_steps(self):
+        """
+        Take the steps due now.
+
+        Returns:
+            List of `(transition, kwargs)` and the time to wait for the next
+            step in seconds, or `(None, None)` if all transitions ended.
+        """
+        with self.__condition:
+            now = time.monotonic()
+            due = []
+            wait = None
+            for transition in self.transitions:
+                next_due = transition.next_due
+                if next_due is None:
+                    continue
+                if next_due <= now:
+                    kwargs = transition._take_step()
+                    if kwargs is not None:
+                        due.append((transition, kwargs))
+                else:
+                    wait = next_due - now if wait is None else min(wait, next_due - now)
+            self.transitions = [t for t in self.transitions if t.active]
+            if not due and not self.transitions:
+                return None, None
+            if not due and wait is None:
+                # Only paused transitions left
+                wait = 1.0
+            return due, wait
+
+    def __send(self, transition, kwargs):
+        """Send one step. Errors are logged: the next step sets absolute values anyway."""
+        logging.debug('Step of %s: %s', transition, kwargs)
+        try:
+            return transition.light.transite_light_state(**kwargs)
+        except Exception as e:
+            logging.debug('Transition step failed: %s', e)
+            transition.errors += 1
+
+    @staticmethod
+    async def __await_step(transition, result):
+        try:
+            await result
+        except Exception as e:
+            logging.debug('Transition step failed: %s', e)
+            transition.errors += 1
+
+    def __control(self, action, transition):
+        with self.__condition:
+            for t in self.transitions if transition is None else [transition]:
+                getattr(t, action)()
+        self.__notify()
+
+    def __notify(self):
+        """Wake up the running loop to recompute the next step."""
+        with self.__condition:
+            self.__condition.notify_all()
+        wakeup = self.__wakeup
+        if wakeup is not None:
+            loop, event = wakeup
+            loop.call_soon_threadsafe(event.set)
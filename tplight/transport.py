@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Socket transports used to exchange messages with the bulbs.
+
+Every transport has the same interface: `send(data)` writes one encrypted
+message, `receive(timeout)` returns the next one from the bulb, `close()`
+drops the socket, which is reopened on the next send, and `port` is the
+bulb port. `reliable` tells if messages can be neither lost nor reordered.
+"""
+
+import collections
+import logging
+import select
+import socket
+import struct
+import time
+
+# Makes recv report the real size of the truncated datagram. Not available
+# everywhere: without it a datagram filling the buffer is taken as truncated.
+_MSG_TRUNC = getattr(socket, 'MSG_TRUNC', 0)
+
+
+class DatagramTruncated(OSError):
+    """
+    The received datagram did not fit into the buffer and was cut.
+
+    `buffer_size` is the size of the buffer the next datagram would fit in
+    and `address` is the source address.
+    """
+
+    def __init__(self, buffer_size, address):
+        super().__init__(f'Datagram from {address} truncated, {buffer_size} bytes needed')
+        self.buffer_size = buffer_size
+        self.address = address
+
+
+def receive_into(sock, buffer):
+    """
+    Receive one datagram into the buffer with `recvfrom_into`.
+
+    Returns:
+        Tuple of the datagram size and the source address.
+
+    Raises:
+        DatagramTruncated: The datagram did not fit into the buffer.
+    """
+    size, address = sock.recvfrom_into(buffer, 0, _MSG_TRUNC)
+    if size > len(buffer) or (not _MSG_TRUNC and size == len(buffer)):
+        buffer_size = max(size, len(buffer) * 2)
+        logging.debug('Datagram of %d bytes truncated from %s', size, address)
+        raise DatagramTruncated(buffer_size, address)
+    return size, address
+
+
+class UDPTransport(object):
+    """
+    Connected UDP socket to a single bulb.
+
+    The socket is opened on first use and kept until `close()`. Received
+    datagrams are written to a preallocated buffer, which grows when a
+    datagram does not fit into it.
+    """
+
+    port = 9999
+    buffer_size = 4096
+    reliable = False
+
+    def __init__(self, address, port=None, buffer_size=None):
+        self.address = address
+        if port is not None:
+            self.port = port
+        if buffer_size is not None:
+            self.buffer_size = buffer_size
+        self.__socket = None
+        self.__buffer = bytearray(self.buffer_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def closed(self):
+        """Check if the socket is not open."""
+        return self.__socket is None
+
+    def open(self):
+        """Create and connect the socket if it is not open yet."""
+        if self.__socket is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                sock.connect((self.address, self.port))
+            except OSError:
+                sock.close()
+                raise
+            self.__socket = sock
+        return self.__socket
+
+    def close(self):
+        """Close the socket. It is reopened on the next send."""
+        if self.__socket is not None:
+            self.__socket.close()
+            self.__socket = None
+
+    def send(self, data):
+        """Send one datagram to the bulb."""
+        self.open().send(data)
+
+    def receive(self, timeout):
+        """
+        Wait for one datagram from the bulb.
+
+        Returns a memoryview on the internal buffer, valid until the next call.
+        Raises `socket.timeout` if nothing arrives in `timeout` seconds and
+        `DatagramTruncated` if the datagram did not fit into the buffer.
+        """
+        sock = self.open()
+        sock.settimeout(timeout)
+        try:
+            size, _ = receive_into(sock, self.__buffer)
+        except DatagramTruncated as e:
+            self.__buffer = bytearray(e.buffer_size)
+            raise
+        return memoryview(self.__buffer)[:size]
+
+
+class TCPTransport(object):
+    """
+    Persistent TCP connection to a single bulb.
+
+    Every message is framed with a 4-byte big-endian length prefix. The
+    connection is opened on first use and kept alive between requests, so
+    several requests may be sent before reading their replies: the bulb
+    answers them in order. A connection closed by the bulb is reopened on
+    the next send.
+    """
+
+    port = 9999
+    buffer_size = 4096
+    connect_timeout = 2.0
+    reliable = True
+
+    __header = struct.Struct('>I')
+
+    def __init__(self, address, port=None, buffer_size=None, connect_timeout=None):
+        self.address = address
+        if port is not None:
+            self.port = port
+        if buffer_size is not None:
+            self.buffer_size = buffer_size
+        if connect_timeout is not None:
+            self.connect_timeout = connect_timeout
+        self.__socket = None
+        self.__buffer = bytearray(self.buffer_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def closed(self):
+        """Check if the connection is not open."""
+        return self.__socket is None
+
+    def open(self):
+        """Connect to the bulb if the connection is not open yet."""
+        if self.__socket is not None and not self.__usable():
+            logging.debug('Reconnecting to %s:%d', self.address, self.port)
+            self.close()
+        if self.__socket is None:
+            sock = socket.create_connection((self.address, self.port), self.connect_timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            self.__socket = sock
+        return self.__socket
+
+    def close(self):
+        """Close the connection. It is reopened on the next send."""
+        if self.__socket is not None:
+            self.__socket.close()
+            self.__socket = None
+
+    def send(self, data):
+        """Send one length-prefixed message to the bulb."""
+        sock = self.open()
+        sock.settimeout(self.connect_timeout)
+        try:
+            sock.sendall(self.__header.pack(len(data)) + data)
+        except OSError:
+            self.close()
+            raise
+
+    def receive(self, timeout):
+        """
+        Wait for the next message from the bulb.
+
+        Returns a memoryview on the internal buffer, valid until the next call.
+        Raises `socket.timeout` if the message does not arrive in `timeout`
+        seconds and `ConnectionError` if the bulb closed the connection. The
+        connection is closed when a message was read only partially.
+        """
+        sock = self.__socket
+        if sock is None:
+            raise ConnectionError(f'Not connected to {self.address}')
+        deadline = time.monotonic() + timeout
+        header = bytearray(self.__header.size)
+        self.__read_exact(sock, memoryview(header), deadline, partial=False)
+        (size,) = self.__header.unpack(header)
+        if size > len(self.__buffer):
+            self.__buffer = bytearray(max(size, len(self.__buffer) * 2))
+        view = memoryview(self.__buffer)[:size]
+        self.__read_exact(sock, view, deadline, partial=True)
+        return view
+
+    def __read_exact(self, sock, view, deadline, partial):
+        """Fill the view from the socket. `partial` tells if the message was started."""
+        received = 0
+        try:
+            while received < len(view):
+                sock.settimeout(max(0, deadline - time.monotonic()))
+                size = sock.recv_into(view[received:])
+                if not size:
+                    raise ConnectionResetError(f'Connection closed by {self.address}')
+                received += size
+        except socket.timeout:
+            if partial or received:
+                self.close()
+            raise
+        except OSError:
+            self.close()
+            raise
+
+    def __usable(self):
+        """
+        Check that the idle connection is still open and has no stale data.
+
+        The bulb may close the connection after a while. Any data waiting on
+        an idle connection is a late reply which would be taken as the reply
+        to the next request.
+        """
+        try:
+            readable, _, _ = select.select([self.__socket], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+
+class FallbackTransport(object):
+    """
+    `TCPTransport` falling back to `UDPTransport` when TCP is unavailable.
+
+    If the TCP connection cannot be opened, messages go through UDP and the
+    TCP connection is tried again after `retry_after` seconds.
+    """
+
+    port = 9999
+    retry_after = 60.0
+
+    def __init__(self, address, port=None, retry_after=None):
+        self.address = address
+        if port is not None:
+            self.port = port
+        if retry_after is not None:
+            self.retry_after = retry_after
+        self.tcp = TCPTransport(address, self.port)
+        self.udp = UDPTransport(address, self.port)
+        self.__active = self.tcp
+        self.__failed_at = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def reliable(self):
+        """Check if the messages currently go through TCP."""
+        return self.__tcp_allowed()
+
+    @property
+    def closed(self):
+        """Check if both sockets are not open."""
+        return self.tcp.closed and self.udp.closed
+
+    def close(self):
+        """Close both sockets."""
+        self.tcp.close()
+        self.udp.close()
+
+    def send(self, data):
+        """Send the message through TCP if possible, otherwise through UDP."""
+        if self.__tcp_allowed():
+            try:
+                self.tcp.open()
+            except OSError as e:
+                logging.debug(
+                    'TCP connection to %s failed, falling back to UDP: %s', self.address, e
+                )
+                self.__failed_at = time.monotonic()
+            else:
+                self.__failed_at = None
+                self.__active = self.tcp
+                self.tcp.send(data)
+                return
+        self.__active = self.udp
+        self.udp.send(data)
+
+    def receive(self, timeout):
+        """Wait for the next message on the transport of the last send."""
+        return self.__active.receive(timeout)
+
+    def __tcp_allowed(self):
+        return self.__failed_at is None or time.monotonic() - self.__failed_at >= self.retry_after
+
+
+class TransportPool(object):
+    """
+    Shared `UDPTransport` objects for a fleet of bulbs.
+
+    Keeps at most `max_open` sockets open: the least recently used one is
+    closed when the limit is reached and reopened on its next use.
+    """
+
+    def __init__(self, max_open=256):
+        self.max_open = max_open
+        self.__transports = {}
+        self.__open = collections.OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.__transports)
+
+    def get(self, address, port=UDPTransport.port):
+        """Get the transport for the bulb address, creating it if needed."""
+        key = (address, port)
+        transport = self.__transports.get(key)
+        if transport is None:
+            transport = self.__transports[key] = _PooledUDPTransport(self, address, port)
+        return transport
+
+    def close(self):
+        """Close all sockets of the pool."""
+        for transport in self.__transports.values():
+            transport.close()
+        self.__open.clear()
+
+    def _touch(self, transport):
+        """Mark the transport as used, closing the oldest ones over the limit."""
+        key = (transport.address, transport.port)
+        self.__open[key] = transport
+        self.__open.move_to_end(key)
+        while len(self.__open) > self.max_open:
+            _, oldest = self.__open.popitem(last=False)
+            oldest.close()
+
+    def _forget(self, transport):
+        """Unmark the closed transport."""
+        self.__open.pop((transport.address, transport.port), None)
+
+
+class _PooledUDPTransport(UDPTransport):
+    """`UDPTransport` which reports its socket usage to the pool."""
+
+    def __init__(self, pool, address, port):
+        super().__init__(address, port)
+        self.__pool = pool
+
+    def open(self):
+        self.__pool._touch(self)
+        return super().open()
+
+    def close(self):
+        self.__pool._forget(self)
+        super().close()